@@ -4,11 +4,22 @@ import requests
 import threading
 import os
 import datetime
-import uuid
 import logging
-from PIL import ImageGrab # Use Pillow for screenshots
+import gzip
+import json
+import hashlib
+import io
+from PIL import Image, ImageGrab # Use Pillow for screenshots
 import psutil
 # import pyautogui # Optional for idle detection
+try:
+    import zstandard # Optional: zstd request compression
+except ImportError:
+    zstandard = None
+try:
+    import msgpack # Optional: binary activity batches
+except ImportError:
+    msgpack = None
 
 # Import configuration
 try:
@@ -20,6 +31,10 @@ except ImportError:
     logging.basicConfig(level=logging.CRITICAL) # Basic config for this critical error
     logging.critical("CRITICAL: config.py not found. Agent cannot start.")
     exit(1) # Exit if config is missing
+from outbox import Outbox
+from transport import Transport, RetryScheduler, backoff_delay
+from window_probe import create_probe
+from idle import IdleDetector, create_idle_source
 
 # --- Logging Setup ---
 # Ensure TEMP_DIR exists or handle its creation failure gracefully
@@ -48,110 +63,244 @@ logging.getLogger().addHandler(console_handler) # Add console handler to root lo
 
 
 # --- Global State ---
-last_user_activity_time = time.time() # For idle detection (if you implement it)
+last_user_activity_time = time.time() # Last keyboard/mouse input, updated by activity_monitor_worker
 current_activities = [] # Store activities between log intervals
 activity_lock = threading.Lock() # Lock for accessing current_activities
+unsupported_encodings = set() # Content-Encodings / body formats the server answered 415 for
+unsupported_endpoints = set() # Endpoints the server answered 404 for (older server)
+server_activity_formats = set() # Activity body formats the server advertised (heartbeat / 415 answers); empty until then
+# The monitor splits a long-running window into segments of this length; coalescing never merges past it
+LONG_ACTIVITY_SPLIT_SECONDS = config.ACTIVITY_LOG_INTERVAL_SECONDS * 10
+transport = Transport(config.SERVER_URL, {'X-API-KEY': config.API_KEY, 'User-Agent': f'MonitoringAgent/{config.EMPLOYEE_ID}'},
+                      pool_size=getattr(config, 'HTTP_POOL_SIZE', 4))
+# Screenshot uploads are retried here, off the capture thread; each frame is in the outbox from its first attempt
+# and a job that gives up leaves it there for the uploader
+upload_scheduler = RetryScheduler('UploadRetryThread', base_delay=getattr(config, 'RETRY_BASE_DELAY', 5),
+                                  max_delay=getattr(config, 'RETRY_MAX_DELAY', 300),
+                                  max_attempts=getattr(config, 'MAX_UPLOAD_RETRIES', 3),
+                                  max_pending=getattr(config, 'MAX_PENDING_UPLOADS', 20))
+try:
+    upload_outbox = Outbox(os.path.join(config.TEMP_DIR, 'outbox'), max_bytes=getattr(config, 'OUTBOX_MAX_BYTES', 200 * 1024 * 1024),
+                           max_entries=getattr(config, 'OUTBOX_MAX_ENTRIES', 50000))
+except Exception as e:
+    # Keep running without durability rather than not at all
+    logging.critical(f"Could not open the on-disk outbox, queueing in memory only: {e}", exc_info=True)
+    upload_outbox = Outbox(config.TEMP_DIR, database=':memory:')
 
 
 # --- Helper Functions ---
+window_probe = create_probe(getattr(config, 'WINDOW_PROBE', 'auto'))
+idle_detector = IdleDetector(create_idle_source(getattr(config, 'IDLE_SOURCE', 'auto')), config.IDLE_THRESHOLD_SECONDS)
+
 def get_active_window_info():
     """Gets the title and process name of the currently active window."""
-    window_title = "Unknown Window" # Default
-    process_name = "unknown_process" # Default
     try:
-        if os.name == 'nt':
-            import win32gui
-            import win32process
-            # import win32api # Not used in this function
-
-            hwnd = win32gui.GetForegroundWindow()
-            if hwnd:
-                window_title_raw = win32gui.GetWindowText(hwnd)
-                window_title = window_title_raw if window_title_raw else "No Title Window"
-
-                # Getting process ID
-                try:
-                    _, pid = win32process.GetWindowThreadProcessId(hwnd)
-                except Exception as e_pid:
-                    logging.error(f"Error getting PID for HWND {hwnd}: {e_pid}")
-                    pid = 0 # Fallback
-
-                if pid == 0: # Idle process or system process without a clear owner
-                    process_name = "System Idle/Background"
-                else:
-                    try:
-                        process = psutil.Process(pid)
-                        process_name = process.name()
-                        # exe_path = process.exe() # Optional: get full path
-                    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess) as e_psu_proc:
-                        process_name = f"Protected/Zombie Process (PID: {pid})"
-                        logging.warning(f"Psutil: Could not get process name for PID {pid}: {e_psu_proc}")
-                    except Exception as e_psutil_other:
-                        process_name = f"Error Psutil (PID: {pid})"
-                        logging.error(f"Psutil: Other error for PID {pid}: {e_psutil_other}", exc_info=False)
-            else:
-                window_title = "No Active Window" # E.g., Desktop is active
-                process_name = "System Desktop/Background"
-        else: # Placeholder for other OS
-            logging.warning("Active window detection not fully implemented for non-Windows OS.")
-            window_title = "Unsupported OS Window"
-            process_name = "Unsupported OS Process"
-
-    except ImportError as e_imp:
-        logging.error(f"ImportError for active window detection (win32gui/psutil likely missing): {e_imp}")
-        window_title = "Error Importing Libs"
+        return window_probe.sample()
     except Exception as e_gen:
         # Log the full traceback for unexpected errors
-        logging.error(f"General error in get_active_window_info: {e_gen}", exc_info=True)
-        window_title = "Error Detecting Window"
-
-    logging.debug(f"Detected active window: Title='{window_title}', Process='{process_name}'")
-    return window_title, process_name
-
-def take_screenshot():
-    """Takes a screenshot and saves it to a temporary file."""
+        logging.error(f"General error in get_active_window_info ({window_probe.name} probe): {e_gen}", exc_info=True)
+        return "Error Detecting Window", "unknown_process"
+
+# format name -> (Pillow format, mimetype, file extension)
+SCREENSHOT_FORMATS = {
+    'webp': ('WEBP', 'image/webp', '.webp'),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'png': ('PNG', 'image/png', '.png'),
+}
+
+def screenshot_format():
+    fmt = getattr(config, 'SCREENSHOT_FORMAT', 'png')
+    if fmt not in SCREENSHOT_FORMATS:
+        logging.warning(f"Unknown SCREENSHOT_FORMAT '{fmt}', using png.")
+        return 'png'
+    return fmt
+
+def active_monitor_bbox():
+    """Bounding box (virtual-screen coordinates) of the monitor showing the foreground window, or None."""
+    if os.name != 'nt':
+        return None
+    try:
+        import win32api
+        import win32gui
+        monitor = win32api.MonitorFromWindow(win32gui.GetForegroundWindow(), 2) # MONITOR_DEFAULTTONEAREST
+        return tuple(win32api.GetMonitorInfo(monitor)['Monitor'])
+    except Exception as e:
+        logging.warning(f"Could not find the active monitor, capturing all screens: {e}")
+        return None
+
+def encode_screenshot(image, fmt, quality=70, max_dimension=None):
+    """Downscales (keeping the aspect ratio) and encodes a captured frame into bytes."""
+    if max_dimension and max(image.size) > max_dimension:
+        # reducing_gap=1.0 box-reduces by the integer factor first: ~5x faster on 2x sources (multi-monitor, 4K)
+        image.thumbnail((max_dimension, max_dimension), Image.BILINEAR, reducing_gap=1.0)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    if fmt == 'png':
+        image.save(buffer, 'PNG')
+    else:
+        image.save(buffer, SCREENSHOT_FORMATS[fmt][0], quality=quality)
+    return buffer.getvalue()
+
+def grab_screen():
+    """Captures the screen(s). Returns (image, timestamp) or (None, None)."""
     try:
         timestamp = datetime.datetime.now(datetime.timezone.utc)
-        # Create a more unique filename to avoid rare collisions if multiple agents share TEMP_DIR (not typical)
-        filename = f"screenshot_{timestamp.strftime('%Y%m%d_%H%M%S%f')}_{config.EMPLOYEE_ID}_{uuid.uuid4().hex[:6]}.png"
-        filepath = os.path.join(config.TEMP_DIR, filename)
-
-        logging.info(f"Attempting to take screenshot: {filename}")
-        screenshot = ImageGrab.grab(all_screens=True) # Capture all monitors
-        screenshot.save(filepath, "PNG")
-        logging.info(f"Screenshot saved locally: {filepath}")
-        return filepath, timestamp
+        bbox = active_monitor_bbox() if getattr(config, 'SCREENSHOT_ACTIVE_MONITOR_ONLY', False) else None
+        started = time.perf_counter()
+        screenshot = ImageGrab.grab(bbox=bbox, all_screens=True) # bbox is relative to the virtual screen
+        logging.debug(f"Screen grabbed {screenshot.size[0]}x{screenshot.size[1]} in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return screenshot, timestamp
     except Exception as e:
         logging.error(f"Failed to take screenshot: {e}", exc_info=True)
         return None, None
 
-def send_data(endpoint, data=None, files=None):
-    """Sends data to the server API with retries."""
-    url = f"{config.SERVER_URL}{endpoint}"
-    headers = {'X-API-KEY': config.API_KEY, 'User-Agent': f'MonitoringAgent/{config.EMPLOYEE_ID}'} # Added User-Agent
-    max_retries = config.MAX_UPLOAD_RETRIES if hasattr(config, 'MAX_UPLOAD_RETRIES') else 3
-    retry_delay = config.UPLOAD_RETRY_DELAY if hasattr(config, 'UPLOAD_RETRY_DELAY') else 10 # seconds
+def take_screenshot(image):
+    """Encodes a captured frame in memory. Returns (bytes, format), or (None, None) on failure."""
+    try:
+        fmt = screenshot_format()
+        started = time.perf_counter()
+        width, height = image.size
+        data = encode_screenshot(image, fmt, quality=getattr(config, 'SCREENSHOT_QUALITY', 70),
+                                 max_dimension=getattr(config, 'SCREENSHOT_MAX_DIMENSION', None))
+        # Encode time and size are logged so settings can be compared on the actual machine
+        logging.info(f"Screenshot {width}x{height} encoded as {fmt}: {len(data)} bytes in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return data, fmt
+    except Exception as e:
+        logging.error(f"Failed to encode screenshot: {e}", exc_info=True)
+        return None, None
 
-    for attempt in range(max_retries):
+def frame_dhash(image, hash_size=8):
+    """64-bit difference hash: brightness gradients of a 9x8 grayscale thumbnail, robust to noise and scaling."""
+    small = image.resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0).convert('L')
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            value = (value << 1) | (left > pixels[row * (hash_size + 1) + col + 1])
+    return value
+
+def compress_body(raw_body):
+    """Compresses a request body with gzip/zstd when it is above the configured threshold."""
+    method = getattr(config, 'REQUEST_COMPRESSION', None)
+    min_bytes = getattr(config, 'REQUEST_COMPRESSION_MIN_BYTES', 1024)
+    if not method or len(raw_body) < min_bytes:
+        return raw_body, None
+    if method == 'zstd' and zstandard is not None and 'zstd' not in unsupported_encodings:
+        return zstandard.ZstdCompressor(level=getattr(config, 'REQUEST_COMPRESSION_LEVEL', 3)).compress(raw_body), 'zstd'
+    if method in ('zstd', 'gzip') and 'gzip' not in unsupported_encodings:
+        # zstd falls back to gzip when the module is missing or the server doesn't accept it
+        return gzip.compress(raw_body, compresslevel=6), 'gzip'
+    return raw_body, None
+
+def to_epoch_ms(iso_str):
+    return int(datetime.datetime.fromisoformat(iso_str).timestamp() * 1000)
+
+def encode_activity_batch(payload):
+    """msgpack encoding of an activity batch with compact keys and integer epoch-ms timestamps."""
+    compact = {
+        "e": payload['employee_id'],
+        "a": [{
+            "w": act["window_title"], "p": act["process_name"],
+            "s": to_epoch_ms(act["start_time"]), "n": to_epoch_ms(act["end_time"]),
+            "d": act["duration_seconds"], "i": act["is_active"],
+        } for act in payload['activities']]
+    }
+    return msgpack.packb(compact, use_bin_type=True)
+
+def encode_dictionary_batch(payload):
+    """
+    Activity batch with a per-batch string table (titles and process names sent once, referenced by index)
+    and each row as [title, process, start - previous end (ms), duration (ms), is_active]. Expanded by
+    the server's utils/wire.py expand_dictionary_batch.
+    """
+    strings, index, rows = [], {}, []
+    base = previous_end = None
+    for act in payload['activities']:
+        start, end = to_epoch_ms(act["start_time"]), to_epoch_ms(act["end_time"])
+        if base is None:
+            base = previous_end = start
+        refs = []
+        for value in (act["window_title"], act["process_name"]):
+            if value not in index:
+                index[value] = len(strings)
+                strings.append(value)
+            refs.append(index[value])
+        rows.append([refs[0], refs[1], start - previous_end, end - start, 1 if act["is_active"] else 0])
+        previous_end = end
+    return {"e": payload['employee_id'], "t": strings, "b": base or 0, "r": rows}
+
+def encode_body(data, body_format):
+    """
+    Serializes a payload. Returns (raw_body, content_type, format_used); format_used ends in '+dict' for
+    dictionary batches, which are only sent once the server has advertised them (server_activity_formats).
+    """
+    use_msgpack = body_format == 'msgpack' and msgpack is not None and 'msgpack' not in unsupported_encodings
+    use_dictionary = ('activities' in data and getattr(config, 'ACTIVITY_DICTIONARY_ENCODING', True)
+                      and f"{'msgpack' if use_msgpack else 'json'}+dict" in server_activity_formats)
+    if use_msgpack:
+        if use_dictionary:
+            return msgpack.packb(encode_dictionary_batch(data), use_bin_type=True), 'application/msgpack', 'msgpack+dict'
+        return encode_activity_batch(data), 'application/msgpack', 'msgpack'
+    if use_dictionary:
+        return json.dumps(encode_dictionary_batch(data), ensure_ascii=False).encode('utf-8'), 'application/json', 'json+dict'
+    return json.dumps(data).encode('utf-8'), 'application/json', 'json'
+
+def coalesce_activities(activities, max_gap_seconds=2, max_duration_seconds=None):
+    """
+    Merges adjacent segments with the same window, process and is_active when the next one starts within
+    max_gap_seconds of the previous end (alt-tabbing back after a skipped sub-second switch), as long as
+    the merged segment stays within max_duration_seconds (the monitor's deliberate long-activity split).
+    """
+    merged = []
+    for act in activities:
+        previous = merged[-1] if merged else None
+        if (previous is not None and previous["window_title"] == act["window_title"]
+                and previous["process_name"] == act["process_name"] and previous["is_active"] == act["is_active"]):
+            previous_end = datetime.datetime.fromisoformat(previous["end_time"])
+            start = datetime.datetime.fromisoformat(act["start_time"])
+            merged_seconds = (datetime.datetime.fromisoformat(act["end_time"])
+                              - datetime.datetime.fromisoformat(previous["start_time"])).total_seconds()
+            if (0 <= (start - previous_end).total_seconds() <= max_gap_seconds
+                    and (max_duration_seconds is None or merged_seconds <= max_duration_seconds)):
+                previous["end_time"] = act["end_time"]
+                previous["duration_seconds"] = int(round(merged_seconds))
+                continue
+        merged.append(dict(act))
+    return merged
+
+def send_data(endpoint, data=None, files=None, body_format='json'):
+    """
+    Sends data to the server API in one attempt on the pooled session. Returns the response JSON,
+    {"status": "error", "http_status": N} for a 4xx, or None when the server is unreachable or failing.
+    Retrying is up to the caller (outbox drain, upload_scheduler), so this never sleeps.
+    """
+    while True: # Only repeats after a 415, once per rejected encoding/format
+        used_format = None
         try:
             if files:
-                logging.debug(f"Attempt {attempt+1}: Sending POST (files) to {url}. Form data keys: {list(data.keys()) if data else 'None'}. File part name: {list(files.keys())[0] if files else 'None'}")
-                response = requests.post(url, headers=headers, data=data, files=files, timeout=60) # Increased timeout for uploads
+                logging.debug(f"Sending POST (files) to {endpoint}. Form data keys: {list(data.keys()) if data else 'None'}. File part name: {list(files.keys())[0] if files else 'None'}")
+                response = transport.post(endpoint, data=data, files=files, timeout=60) # Increased timeout for uploads
             elif data:
                  # Log only a snippet of potentially large data for privacy/log size
                 data_preview = {k: (str(v)[:100] + '...' if len(str(v)) > 100 else v) for k, v in data.items() if k != 'activities'}
                 if 'activities' in data: data_preview['activities_count'] = len(data['activities'])
 
-                logging.debug(f"Attempt {attempt+1}: Sending POST (json) to {url}. Payload sample: {data_preview}")
-                response = requests.post(url, headers=headers, json=data, timeout=30) # Timeout for JSON data
+                raw_body, content_type, used_format = encode_body(data, body_format)
+                body, encoding = compress_body(raw_body)
+                body_headers = {'Content-Type': content_type}
+                if encoding:
+                    body_headers['Content-Encoding'] = encoding
+                logging.debug(f"Sending POST ({used_format}, {encoding or 'identity'}, {len(raw_body)}->{len(body)} bytes) to {endpoint}. Payload sample: {data_preview}")
+                response = transport.post(endpoint, headers=body_headers, data=body, timeout=30) # Timeout for JSON data
             else: # For simple calls like heartbeat
-                 logging.debug(f"Attempt {attempt+1}: Sending POST (no body) to {url}.")
-                 response = requests.post(url, headers=headers, timeout=15)
+                 logging.debug(f"Sending POST (no body) to {endpoint}.")
+                 response = transport.post(endpoint, timeout=15)
 
             # Log basic response info
-            logging.info(f"Response from {url} (Attempt {attempt+1}): Status {response.status_code}, Response text (first 200 chars): {response.text[:200]}")
+            logging.info(f"Response from {endpoint}: Status {response.status_code}, Response text (first 200 chars): {response.text[:200]}")
             response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
-            logging.info(f"Successfully sent data to {endpoint} on attempt {attempt+1}.")
             try:
                 return response.json() # Attempt to parse JSON from successful response
             except requests.exceptions.JSONDecodeError as json_err:
@@ -159,55 +308,237 @@ def send_data(endpoint, data=None, files=None):
                 return {"status": "ok_no_json", "message": "Server responded successfully but not with JSON."} # Or return None
 
         except requests.exceptions.Timeout:
-            logging.warning(f"Attempt {attempt + 1}/{max_retries} - Timeout connecting to {endpoint}.")
+            logging.warning(f"Timeout connecting to {endpoint}.")
         except requests.exceptions.ConnectionError:
-            logging.warning(f"Attempt {attempt + 1}/{max_retries} - Connection error to {endpoint}. Server might be down or unreachable.")
+            logging.warning(f"Connection error to {endpoint}. Server might be down or unreachable.")
         except requests.exceptions.HTTPError as http_err: # 4xx or 5xx errors
-            logging.error(f"Attempt {attempt + 1}/{max_retries} - HTTP error for {endpoint}: {http_err}. Status: {http_err.response.status_code}. Response: {http_err.response.text[:500]}")
-            # For 401 Unauthorized, retrying might not help if API key is wrong.
+            logging.error(f"HTTP error for {endpoint}: {http_err}. Status: {http_err.response.status_code}. Response: {http_err.response.text[:500]}")
             if http_err.response.status_code == 401:
-                logging.critical("CRITICAL: Received 401 Unauthorized. Check API_KEY. Stopping retries for this call.")
-                return None # Don't retry on 401
-            # For other client errors (4xx), retrying might also not help.
-            # For server errors (5xx), retrying is often useful.
+                logging.critical("CRITICAL: Received 401 Unauthorized. Check API_KEY.")
+            if http_err.response.status_code == 404:
+                logging.warning(f"Server has no {endpoint} endpoint.")
+                unsupported_endpoints.add(endpoint)
+            sent_headers = http_err.request.headers if http_err.request is not None else {}
+            sent_encoding = sent_headers.get('Content-Encoding')
+            sent_msgpack = sent_headers.get('Content-Type') == 'application/msgpack'
+            if http_err.response.status_code == 415 and used_format and used_format.endswith('+dict'):
+                # The server withdrew dictionary batches; its 415 lists what it accepts now
+                try:
+                    note_server_formats(http_err.response.json())
+                except ValueError:
+                    pass
+                if used_format not in server_activity_formats:
+                    logging.warning(f"Server no longer accepts '{used_format}' activity batches. Falling back.")
+                    continue
+            if http_err.response.status_code == 415 and (sent_encoding or sent_msgpack):
+                # Older/limited server: stop using this encoding/format and resend right away.
+                # Only the server's decompression middleware lists Accept-Encoding on its 415; without that
+                # header (or when it lists our encoding) the route itself refused the body format.
+                accepted = http_err.response.headers.get('Accept-Encoding')
+                if accepted is not None:
+                    encoding_refused = sent_encoding and sent_encoding not in [e.strip().lower() for e in accepted.split(',')]
+                else:
+                    encoding_refused = sent_encoding and not sent_msgpack # Nothing else to blame
+                rejected = sent_encoding if encoding_refused else ('msgpack' if sent_msgpack else None)
+                if rejected and rejected not in unsupported_encodings:
+                    logging.warning(f"Server does not accept '{rejected}' request bodies. Falling back.")
+                    unsupported_encodings.add(rejected)
+                    continue
+            if http_err.response.status_code < 500:
+                # The server answered and refused; unlike None (unreachable / 5xx), resending won't help
+                return {"status": "error", "http_status": http_err.response.status_code}
         except Exception as e_gen:
-            logging.error(f"Attempt {attempt + 1}/{max_retries} - Unexpected error sending data to {endpoint}: {e_gen}", exc_info=True)
-        
-        if attempt + 1 < max_retries:
-            logging.info(f"Retrying {endpoint} in {retry_delay} seconds...")
-            time.sleep(retry_delay)
-        else:
-            logging.error(f"Max retries ({max_retries}) reached for {endpoint}. Giving up on this request.")
-    return None # Return None if all retries fail
-
+            logging.error(f"Unexpected error sending data to {endpoint}: {e_gen}", exc_info=True)
+        return None
+
+def note_server_formats(response_json):
+    """Records the activity body formats a server reply advertises (heartbeat reply or 415 body), if any."""
+    formats = response_json.get("activity_formats") if isinstance(response_json, dict) else None
+    if isinstance(formats, list) and set(formats) != server_activity_formats:
+        logging.info(f"Server accepts activity batches as: {formats}")
+        server_activity_formats.clear()
+        server_activity_formats.update(formats)
+
+# 4xx answers that say nothing about the request itself: bad API key, a proxy without the route, rate limiting
+RETRYABLE_CLIENT_ERRORS = (401, 403, 404, 408, 429)
+
+def is_refused(response_json):
+    """True if the server answered and refused this request for good (a 4xx); resending it won't help."""
+    if not isinstance(response_json, dict) or response_json.get("status") != "error":
+        return False
+    http_status = response_json.get("http_status")
+    return http_status is not None and 400 <= http_status < 500 and http_status not in RETRYABLE_CLIENT_ERRORS
+
+
+def upload_screenshot_chunked(data, timestamp, fmt):
+    """
+    Uploads a screenshot with the resumable protocol: init (size + sha256), offset-addressed chunk PUTs,
+    finalize. One pass; after a dropped connection the next attempt re-inits, which returns the server's
+    acknowledged offset, so only the missing bytes are sent again.
+    Returns the server's final JSON, {"status": "error", "http_status": N} for a 4xx, None on failure,
+    or "unsupported" if the server predates the protocol.
+    """
+    base_path = "/api/upload/screenshot"
+    size = len(data)
+    init_payload = {'employee_id': config.EMPLOYEE_ID, 'timestamp': timestamp.isoformat(),
+                    'size': size, 'sha256': hashlib.sha256(data).hexdigest(), 'format': fmt}
+    try:
+        response = transport.post(f"{base_path}/init", json=init_payload, timeout=15)
+        if response.status_code in (404, 405):
+            return "unsupported"
+        response.raise_for_status()
+        init = response.json()
+        if init.get('complete'):
+            logging.info(f"Server already has this screenshot's content ({init.get('filename')}); nothing to upload.")
+            return init
+        upload_id, offset = init['upload_id'], init['offset']
+        chunk_size = min(init.get('chunk_size', size), getattr(config, 'UPLOAD_CHUNK_BYTES', 256 * 1024))
+        if offset:
+            logging.info(f"Resuming screenshot upload {upload_id} at byte {offset}/{size}.")
+        while offset < size:
+            response = transport.put(f"{base_path}/{upload_id}", label=f"{base_path}/<id>", params={'offset': offset},
+                                     data=data[offset:offset + chunk_size], headers={'Content-Type': 'application/octet-stream'}, timeout=30)
+            if response.status_code == 409 and 'offset' in response.json():
+                offset = response.json()['offset'] # Server acknowledged a different offset; continue from it
+                continue
+            response.raise_for_status()
+            offset = response.json()['offset']
+        response = transport.post(f"{base_path}/{upload_id}/finalize", label=f"{base_path}/<id>/finalize", timeout=30)
+        if response.status_code == 422:
+            logging.error(f"Server rejected screenshot upload {upload_id}: content hash mismatch. Restarting upload.")
+        response.raise_for_status()
+        logging.info(f"Chunked screenshot upload {upload_id} finalized ({size} bytes).")
+        return response.json()
+    except requests.exceptions.HTTPError as http_err:
+        logging.error(f"Chunked upload HTTP error: {http_err}. Response: {http_err.response.text[:300]}")
+        if http_err.response.status_code == 401:
+            logging.critical("CRITICAL: Received 401 Unauthorized. Check API_KEY.")
+        if http_err.response.status_code < 500 and http_err.response.status_code != 422: # 422: re-init and resend
+            return {"status": "error", "http_status": http_err.response.status_code}
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logging.warning(f"Chunked upload of {size} bytes interrupted: {e}")
+    return None
+
+def upload_screenshot(data, timestamp, fmt):
+    """Uploads an encoded screenshot, chunked when the server supports it. Returns the server's JSON or None."""
+    response_json = "unsupported"
+    if getattr(config, 'CHUNKED_SCREENSHOT_UPLOADS', True):
+        logging.info(f"Attempting chunked upload of screenshot ({len(data)} bytes).")
+        response_json = upload_screenshot_chunked(data, timestamp, fmt)
+    if response_json == "unsupported":
+        # Older server without the chunked protocol: single multipart POST
+        _, mimetype, ext = SCREENSHOT_FORMATS[fmt]
+        filename = f"screenshot_{timestamp.strftime('%Y%m%d_%H%M%S%f')}_{config.EMPLOYEE_ID}{ext}"
+        files_payload = {'screenshot': (filename, data, mimetype)}
+        form_payload = {
+            'employee_id': config.EMPLOYEE_ID,
+            'timestamp': timestamp.isoformat()
+        }
+        logging.info(f"Attempting to upload screenshot: {filename}")
+        response_json = send_data('/api/upload/screenshot', data=form_payload, files=files_payload)
+    return response_json
 
 # --- Worker Threads ---
+UNCHANGED_SCREENSHOT_ENDPOINT = '/api/upload/screenshot/unchanged'
+
+last_uploaded_frame = {"hash": None, "at": None, "filename": None} # Reference for unchanged-screen records
+last_uploaded_lock = threading.Lock()
+
+def screenshot_upload_job(image, timestamp, frame_hash, reference=None):
+    """
+    Builds the upload_scheduler job for one captured frame. With a reference (since, filename) it first
+    tries an unchanged-screen record and only encodes and uploads the image if that isn't accepted.
+    The encoded frame goes to the outbox before its first upload attempt and leaves it once delivered.
+    """
+    state = {"image": image, "data": None, "fmt": None, "entry_id": None}
+
+    def encode():
+        """Encodes the frame once, then lets go of the bitmap. Returns False if encoding failed (logged)."""
+        if state["image"] is not None:
+            state["data"], state["fmt"] = take_screenshot(state["image"])
+            state["image"] = None # A full-size frame outweighs its encoding many times over
+        return state["data"] is not None
+
+    def settle():
+        """The server has answered for this frame for good; it leaves the outbox."""
+        if state["entry_id"] is not None:
+            upload_outbox.ack([state["entry_id"]])
+
+    def job():
+        if reference is not None and UNCHANGED_SCREENSHOT_ENDPOINT not in unsupported_endpoints:
+            since, filename = reference
+            response_json = send_data(UNCHANGED_SCREENSHOT_ENDPOINT, data={
+                'employee_id': config.EMPLOYEE_ID, 'timestamp': timestamp.isoformat(),
+                'since': since.isoformat(), 'screenshot_path': filename,
+            })
+            if response_json and response_json.get("status") == "ok":
+                logging.info(f"Screen unchanged since {since.isoformat()}; sent record instead of image.")
+                return True
+            if response_json is None:
+                return False # Server unreachable; retry the small record later
+            logging.info("Unchanged-screen record not accepted; uploading the full frame.")
+        if not encode():
+            return True # Encoding failed (logged); nothing to retry
+        if state["entry_id"] is None:
+            # Written ahead, so neither a crash nor a give-up loses the frame; claimed, so drain_outbox
+            # leaves it to this job while the job is still retrying it
+            try:
+                state["entry_id"], _ = upload_outbox.put_screenshot(state["data"], timestamp, state["fmt"],
+                                                                    SCREENSHOT_FORMATS[state["fmt"]][2], claim=True)
+            except Exception as e:
+                logging.error(f"Could not write the screenshot taken at {timestamp.isoformat()} to the outbox: {e}", exc_info=True)
+        response_json = upload_screenshot(state["data"], timestamp, state["fmt"])
+        if is_refused(response_json):
+            logging.error(f"Server refused the screenshot taken at {timestamp.isoformat()} (HTTP {response_json['http_status']}); not retrying it.")
+            settle()
+            return True
+        if not (response_json and response_json.get("status") == "ok"):
+            return False
+        settle()
+        logging.info("Screenshot uploaded successfully.")
+        with last_uploaded_lock:
+            if last_uploaded_frame["at"] is None or timestamp > last_uploaded_frame["at"]:
+                last_uploaded_frame.update(hash=frame_hash, at=timestamp, filename=response_json.get("filename"))
+        return True
+
+    def give_up():
+        if state["entry_id"] is not None:
+            upload_outbox.release([state["entry_id"]]) # Already in the outbox; the uploader retries it from there
+            logging.warning(f"Screenshot upload failed. Left in outbox for the uploader: taken at {timestamp.isoformat()}")
+            return
+        # Also called without any attempt when the scheduler's queue is full, and after an unchanged-screen
+        # record that never got through: the full frame is kept either way
+        if not encode():
+            return
+        _, filepath = upload_outbox.put_screenshot(state["data"], timestamp, state["fmt"], SCREENSHOT_FORMATS[state["fmt"]][2])
+        logging.warning(f"Screenshot upload failed. Queued in outbox: {filepath}")
+
+    return job, give_up
+
 def screenshot_worker():
     logging.info("Screenshot worker thread started.")
     while True:
         try:
-            filepath, timestamp = take_screenshot()
-            if filepath and timestamp:
-                with open(filepath, 'rb') as f_screenshot:
-                    files_payload = {'screenshot': (os.path.basename(filepath), f_screenshot, 'image/png')}
-                    form_payload = {
-                        'employee_id': config.EMPLOYEE_ID,
-                        'timestamp': timestamp.isoformat()
-                    }
-                    logging.info(f"Attempting to upload screenshot: {os.path.basename(filepath)}")
-                    response_json = send_data('/api/upload/screenshot', data=form_payload, files=files_payload)
-                
-                # File is closed automatically when 'with open' block exits
-
-                if response_json and response_json.get("status") == "ok":
-                    logging.info("Screenshot uploaded successfully.")
-                    try:
-                        os.remove(filepath)
-                        logging.info(f"Removed temp screenshot: {filepath}")
-                    except OSError as e_os:
-                        logging.error(f"Failed to remove temp screenshot {filepath}: {e_os}")
-                else:
-                    logging.warning(f"Screenshot upload failed or server response not 'ok'. Response: {response_json}. File kept: {filepath}")
+            if idle_detector.is_idle:
+                logging.debug("User idle; skipping screenshot.")
+                time.sleep(config.SCREENSHOT_INTERVAL_SECONDS)
+                continue
+            image, timestamp = grab_screen()
+            if image is not None:
+                frame_hash = frame_dhash(image) if getattr(config, 'SCREENSHOT_SKIP_UNCHANGED', True) else None
+                with last_uploaded_lock:
+                    last_hash, last_frame_at, last_filename = (last_uploaded_frame["hash"], last_uploaded_frame["at"],
+                                                               last_uploaded_frame["filename"])
+                unchanged = (
+                    frame_hash is not None and last_hash is not None and last_filename
+                    and bin(frame_hash ^ last_hash).count('1') <= getattr(config, 'SCREENSHOT_CHANGE_THRESHOLD', 3)
+                    and (timestamp - last_frame_at).total_seconds() < getattr(config, 'SCREENSHOT_FORCE_FULL_SECONDS', 3600)
+                )
+                # The network part runs on the retry scheduler; capture never waits for the server
+                job, give_up = screenshot_upload_job(image, timestamp, frame_hash,
+                                                     reference=(last_frame_at, last_filename) if unchanged else None)
+                upload_scheduler.submit(f"screenshot {timestamp.isoformat()}", job, on_give_up=give_up)
+                image = None # The job holds the frame until it is encoded; don't keep another one through the sleep
             else:
                 logging.warning("Screenshot taking failed, skipping upload for this cycle.")
         except Exception as e:
@@ -217,8 +548,25 @@ def screenshot_worker():
         time.sleep(config.SCREENSHOT_INTERVAL_SECONDS)
 
 
+IDLE_WINDOW_TITLE = "Idle"
+IDLE_PROCESS_NAME = "idle"
+
+def record_activity(window_title, process_name, start_time, end_time, is_active=True):
+    """Queues one activity segment for the uploader. Returns the queued dict."""
+    activity_data = {
+        "window_title": window_title if window_title else "N/A",
+        "process_name": process_name if process_name else "N/A",
+        "start_time": start_time.isoformat(),
+        "end_time": end_time.isoformat(),
+        "duration_seconds": int(round((end_time - start_time).total_seconds())),
+        "is_active": is_active
+    }
+    with activity_lock:
+        current_activities.append(activity_data)
+    return activity_data
+
 def activity_monitor_worker():
-    global current_activities, last_user_activity_time # last_user_activity_time not used yet
+    global last_user_activity_time
     last_window_title = None
     last_process_name = None
     activity_start_time = None 
@@ -226,10 +574,28 @@ def activity_monitor_worker():
 
     while True:
         try:
-            is_active = True # Placeholder: Implement proper idle detection later
+            now_utc = datetime.datetime.now(datetime.timezone.utc)
+            transition = idle_detector.poll(now_utc)
+            last_user_activity_time = idle_detector.last_input_at.timestamp()
+            if transition and transition[0] == "idle":
+                idle_since = transition[1]
+                if activity_start_time is not None and last_window_title is not None and (idle_since - activity_start_time).total_seconds() >= 1.0:
+                    # The window's segment ends at the last input; the idle span is recorded once input resumes
+                    activity_data = record_activity(last_window_title, last_process_name, activity_start_time, idle_since)
+                    logging.info(f"Logged activity: P='{activity_data['process_name']}', T='{activity_data['window_title'][:30]}', Dur={activity_data['duration_seconds']}s")
+                activity_start_time = None
+                logging.info(f"User idle since {idle_since.isoformat()}; slowing window polling and pausing screenshots.")
+            elif transition and transition[0] == "active":
+                _, idle_since, resumed_at = transition
+                activity_data = record_activity(IDLE_WINDOW_TITLE, IDLE_PROCESS_NAME, idle_since, resumed_at, is_active=False)
+                logging.info(f"User active again; logged idle span of {activity_data['duration_seconds']}s.")
+
+            if idle_detector.is_idle:
+                # Low-power mode: no window sampling until input resumes
+                time.sleep(getattr(config, 'IDLE_POLL_SECONDS', 5))
+                continue
 
             current_title, current_process = get_active_window_info()
-            now_utc = datetime.datetime.now(datetime.timezone.utc)
 
             if activity_start_time is None: # Initialize on first run or after logging
                 activity_start_time = now_utc
@@ -245,16 +611,7 @@ def activity_monitor_worker():
                 logging.debug(f"Activity change detected. Prev: T='{last_window_title[:50]}', P='{last_process_name}'. New: T='{current_title[:50]}', P='{current_process}'. Duration: {duration_seconds:.2f}s")
 
                 if duration_seconds >= 1.0: # Log activities lasting at least 1 second
-                    activity_data = {
-                        "window_title": last_window_title if last_window_title else "N/A",
-                        "process_name": last_process_name if last_process_name else "N/A",
-                        "start_time": activity_start_time.isoformat(),
-                        "end_time": now_utc.isoformat(),
-                        "duration_seconds": int(round(duration_seconds)),
-                        "is_active": is_active 
-                    }
-                    with activity_lock:
-                        current_activities.append(activity_data)
+                    activity_data = record_activity(last_window_title, last_process_name, activity_start_time, now_utc)
                     logging.info(f"Logged activity: P='{activity_data['process_name']}', T='{activity_data['window_title'][:30]}', Dur={activity_data['duration_seconds']}s")
                 else:
                     logging.debug(f"Skipping very short activity ({duration_seconds:.2f}s) for P='{last_process_name}'")
@@ -263,17 +620,12 @@ def activity_monitor_worker():
                 activity_start_time = now_utc
                 last_window_title = current_title
                 last_process_name = current_process
-            elif activity_start_time is not None and (now_utc - activity_start_time).total_seconds() > (config.ACTIVITY_LOG_INTERVAL_SECONDS * 10) and last_window_title:
+            elif activity_start_time is not None and (now_utc - activity_start_time).total_seconds() > LONG_ACTIVITY_SPLIT_SECONDS and last_window_title:
                 # Optional: Force log a long-running activity to prevent huge single entries
                 # This logic might need refinement based on desired behavior.
                 duration_seconds = (now_utc - activity_start_time).total_seconds()
                 logging.info(f"Logging long-running activity due to timeout. P='{last_process_name}', T='{last_window_title[:30]}', Dur={int(round(duration_seconds))}s")
-                activity_data = {
-                    "window_title": last_window_title, "process_name": last_process_name,
-                    "start_time": activity_start_time.isoformat(), "end_time": now_utc.isoformat(),
-                    "duration_seconds": int(round(duration_seconds)), "is_active": is_active
-                }
-                with activity_lock: current_activities.append(activity_data)
+                record_activity(last_window_title, last_process_name, activity_start_time, now_utc)
                 activity_start_time = now_utc # Reset start time for this continuing activity
 
 
@@ -285,38 +637,90 @@ def activity_monitor_worker():
             time.sleep(5) # Wait a bit longer after an error
 
 
+def drain_outbox():
+    """
+    Replays the outbox oldest-first: activity batches merged into large requests, then a few screenshots.
+    Stops at the first failure (server unreachable or failing) and leaves the rest for the next cycle.
+    An entry the server refuses (is_refused) is logged and dropped so it doesn't block everything behind it;
+    when a merged batch is refused, its entries are resent one by one to single out the bad one.
+    """
+    max_activities = getattr(config, 'OUTBOX_DRAIN_MAX_ACTIVITIES', 5000)
+    isolate_left = 0 # Entries of a refused merged batch still to be resent on their own
+    while True:
+        ids, activities = upload_outbox.activity_batch(1 if isolate_left else max_activities)
+        if not ids:
+            break
+        isolate_left = max(0, isolate_left - 1)
+        activities = coalesce_activities(activities, getattr(config, 'ACTIVITY_COALESCE_GAP_SECONDS', 2), LONG_ACTIVITY_SPLIT_SECONDS)
+        logging.info(f"Preparing to upload {len(activities)} activity log(s) from {len(ids)} queued batch(es).")
+        payload = {
+            'employee_id': config.EMPLOYEE_ID,
+            'activities': activities # This is a list of dicts
+        }
+        response_json = send_data('/api/log/activity', data=payload, body_format=getattr(config, 'ACTIVITY_WIRE_FORMAT', 'json'))
+        if response_json and response_json.get("status") == "ok":
+            upload_outbox.ack(ids)
+            logging.info(f"Successfully uploaded {len(activities)} activity logs. Server msg: {response_json.get('message')}")
+        elif is_refused(response_json) and len(ids) > 1:
+            logging.warning(f"Server refused a merged batch of {len(ids)} queued batch(es) (HTTP {response_json['http_status']}); resending them one by one.")
+            isolate_left = len(ids)
+        elif is_refused(response_json):
+            upload_outbox.ack(ids)
+            logging.error(f"Server refused a queued batch of {len(activities)} activity log(s) (HTTP {response_json['http_status']}); "
+                          f"dropped it ({activities[0]['start_time'] if activities else '-'} to {activities[-1]['end_time'] if activities else '-'}).")
+        else:
+            logging.warning(f"Failed to upload activity logs or server error. {len(activities)} logs kept in the outbox. Server response: {response_json}")
+            return False
+
+    for entry_id, filepath, timestamp_str, fmt in upload_outbox.screenshots(getattr(config, 'OUTBOX_DRAIN_MAX_SCREENSHOTS', 20)):
+        try:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            logging.error(f"Queued screenshot {filepath} is unreadable, dropping it: {e}")
+            upload_outbox.ack([entry_id])
+            continue
+        response_json = upload_screenshot(data, datetime.datetime.fromisoformat(timestamp_str), fmt)
+        if response_json and response_json.get("status") == "ok":
+            upload_outbox.ack([entry_id])
+            logging.info(f"Uploaded queued screenshot taken at {timestamp_str}.")
+        elif is_refused(response_json):
+            upload_outbox.ack([entry_id])
+            logging.error(f"Server refused the queued screenshot taken at {timestamp_str} (HTTP {response_json['http_status']}); dropped it.")
+        else:
+            logging.warning(f"Queued screenshot upload failed; kept in outbox. Response: {response_json}")
+            return False
+    return True
+
+
 def activity_log_uploader_worker():
     global current_activities
     logging.info("Activity log uploader worker thread started.")
+    failed_drains = 0
+    next_drain_at = 0
     while True:
         upload_interval = config.ACTIVITY_LOG_INTERVAL_SECONDS
         logging.debug(f"Activity uploader sleeping for {upload_interval} seconds.")
         time.sleep(upload_interval)
 
-        activities_to_send = []
-        with activity_lock:
-            if current_activities:
+        try:
+            with activity_lock:
                 activities_to_send = list(current_activities) # Shallow copy
-                current_activities.clear() 
-        
-        if activities_to_send:
-            logging.info(f"Preparing to upload {len(activities_to_send)} activity log(s).")
-            payload = {
-                'employee_id': config.EMPLOYEE_ID,
-                'activities': activities_to_send # This is a list of dicts
-            }
-            # For extremely verbose debugging of the exact payload:
-            # import json
-            # logging.debug(f"Full payload for /api/log/activity: {json.dumps(payload, indent=2)}")
-            response_json = send_data('/api/log/activity', data=payload)
-            
-            if response_json and response_json.get("status") == "ok":
-                logging.info(f"Successfully uploaded {len(activities_to_send)} activity logs. Server msg: {response_json.get('message')}")
+                current_activities.clear()
+            # Persisted before any network call, so a failed or interrupted upload loses nothing
+            upload_outbox.put_activities(activities_to_send)
+            if time.monotonic() < next_drain_at:
+                continue # Backing off after failed drains
+            if drain_outbox():
+                failed_drains = 0
+                logging.debug("Outbox drained.")
             else:
-                logging.warning(f"Failed to upload activity logs or server error. {len(activities_to_send)} logs were attempted. Server response: {response_json}. Data not re-queued.")
-                # Robust implementation: Save activities_to_send to a local file for retry.
-        else:
-             logging.debug("No new activities to upload in this cycle.")
+                failed_drains += 1
+                delay = backoff_delay(failed_drains - 1, upload_interval, getattr(config, 'RETRY_MAX_DELAY', 300))
+                next_drain_at = time.monotonic() + delay
+                logging.info(f"Outbox backlog (entries, items, bytes) by kind: {upload_outbox.stats()}. Next drain in {delay:.0f}s.")
+        except Exception as e:
+            logging.error(f"Error in activity_log_uploader_worker: {e}", exc_info=True)
 
 
 def heartbeat_worker():
@@ -329,7 +733,10 @@ def heartbeat_worker():
                 'employee_id': config.EMPLOYEE_ID,
                 'hostname': socket.gethostname() if 'socket' in globals() else config.EMPLOYEE_ID # Send current hostname
             }
-            send_data('/api/heartbeat', data=payload)
+            response_json = send_data('/api/heartbeat', data=payload)
+            if response_json and response_json.get("status") == "ok":
+                note_server_formats(response_json)
+            logging.info(f"Transport stats: {transport.stats()}; pending upload retries: {upload_scheduler.pending()}")
         except Exception as e:
             logging.error(f"Error in heartbeat_worker: {e}", exc_info=True)
         
@@ -24,6 +24,64 @@ except ImportError:
 SCREENSHOT_INTERVAL_SECONDS = 60 * 5  # Every 5 minutes
 ACTIVITY_LOG_INTERVAL_SECONDS = 60 * 1 # Every 1 minute
 IDLE_THRESHOLD_SECONDS = 60 * 3 # 3 minutes of no activity = idle
+IDLE_SOURCE = "auto" # idle.py: "windows" (GetLastInputInfo) or "x11" (python-xlib screensaver extension)
+IDLE_POLL_SECONDS = 5 # Window polling interval while idle; screenshots are skipped until input resumes
+
+# Request body compression for JSON uploads: "gzip", "zstd" (needs the zstandard module, falls back to gzip) or None
+REQUEST_COMPRESSION = "gzip"
+REQUEST_COMPRESSION_MIN_BYTES = 1024 # Smaller bodies are sent as-is
+REQUEST_COMPRESSION_LEVEL = 3 # zstd level
+
+# Activity batch wire format: "msgpack" (needs the msgpack module; falls back to JSON if the server rejects it) or "json"
+ACTIVITY_WIRE_FORMAT = "msgpack"
+# Activity batches carry a string table (each title/process name sent once) and start/duration deltas,
+# once the server has advertised them (activity_formats in its heartbeat reply); plain batches until then.
+# Adjacent identical segments separated by at most ACTIVITY_COALESCE_GAP_SECONDS are merged before upload,
+# up to the monitor's long-activity split (ACTIVITY_LOG_INTERVAL_SECONDS * 10).
+ACTIVITY_DICTIONARY_ENCODING = True
+ACTIVITY_COALESCE_GAP_SECONDS = 2
+
+# Screenshots are uploaded in chunks that resume from the last acknowledged byte after a dropped connection
+# (falls back to a single multipart POST on servers without the chunked upload endpoints)
+CHUNKED_SCREENSHOT_UPLOADS = True
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+# Active window probe (window_probe.py): "auto" picks "windows" (pywin32) or "x11" (python-xlib, needs DISPLAY)
+WINDOW_PROBE = "auto"
+
+# Screenshot encoding, done in memory; a file is written to TEMP_DIR only when an upload has to be deferred.
+# SCREENSHOT_FORMAT: "webp", "jpeg" or "png" (lossless, slowest and largest). Quality applies to webp/jpeg.
+SCREENSHOT_FORMAT = "webp"
+SCREENSHOT_QUALITY = 70
+SCREENSHOT_MAX_DIMENSION = 1920 # Longest side in pixels after downscaling; None keeps full resolution
+SCREENSHOT_ACTIVE_MONITOR_ONLY = False # Capture only the monitor showing the foreground window (Windows)
+
+# Unchanged screens (lock screen, idle desktop) are not uploaded: a 64-bit difference hash of each frame is compared
+# with the last uploaded one and frames differing in at most SCREENSHOT_CHANGE_THRESHOLD bits are sent as a small
+# "unchanged since" record. A full frame is still uploaded at least every SCREENSHOT_FORCE_FULL_SECONDS.
+SCREENSHOT_SKIP_UNCHANGED = True
+SCREENSHOT_CHANGE_THRESHOLD = 3
+SCREENSHOT_FORCE_FULL_SECONDS = 60 * 60
+
+# HTTP transport: one keep-alive session with up to HTTP_POOL_SIZE connections to SERVER_URL. Failed screenshot
+# uploads are retried off the capture thread with exponential backoff (RETRY_BASE_DELAY doubling up to
+# RETRY_MAX_DELAY seconds, with jitter), MAX_UPLOAD_RETRIES attempts in total, then moved to the outbox.
+# An encoded frame is written to the outbox before its first attempt. Frames still waiting for that attempt are
+# held in memory as bitmaps, at most MAX_PENDING_UPLOADS of them (more go straight to the outbox): that is the
+# most a crash can lose.
+HTTP_POOL_SIZE = 4
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 300
+MAX_UPLOAD_RETRIES = 4
+MAX_PENDING_UPLOADS = 20
+
+# Durable outbox (SQLite under TEMP_DIR/outbox): activity batches and screenshots are queued before upload
+# and kept until delivered. It is drained oldest-first, in batches of up to OUTBOX_DRAIN_MAX_ACTIVITIES activities;
+# past OUTBOX_MAX_BYTES / OUTBOX_MAX_ENTRIES the oldest entries are dropped.
+OUTBOX_MAX_BYTES = 200 * 1024 * 1024
+OUTBOX_MAX_ENTRIES = 50000
+OUTBOX_DRAIN_MAX_ACTIVITIES = 5000
+OUTBOX_DRAIN_MAX_SCREENSHOTS = 20 # Per drain cycle, so a backlog doesn't hold up activity uploads
 
 # --- Internal Use ---
 # Get temporary directory for storing screenshots before upload
@@ -0,0 +1,109 @@
+# /root/EMS/agent/idle.py
+import datetime
+import logging
+import os
+
+try:
+    from Xlib import display as xdisplay # Optional: python-xlib, MIT-SCREEN-SAVER extension for X11 idle time
+except ImportError:
+    xdisplay = None
+
+# Input-idle detection. A source reports seconds since the last keyboard/mouse input; IdleDetector turns
+# that into idle/active transitions against IDLE_THRESHOLD_SECONDS. An idle span starts at the last input
+# (not when the threshold was crossed) and is reported once, as a single segment, when input resumes.
+
+
+class IdleSource:
+    name = 'none'
+
+    def idle_seconds(self):
+        return 0.0 # Never idle: used where no platform source is available
+
+
+class WindowsIdleSource(IdleSource):
+    name = 'windows'
+
+    def __init__(self):
+        import win32api
+        self._win32api = win32api
+
+    def idle_seconds(self):
+        # Both are GetTickCount milliseconds; the mask handles the 49.7-day wraparound
+        elapsed_ms = (self._win32api.GetTickCount() - self._win32api.GetLastInputInfo()) & 0xFFFFFFFF
+        return elapsed_ms / 1000.0
+
+
+class X11IdleSource(IdleSource):
+    name = 'x11'
+
+    def __init__(self):
+        if xdisplay is None:
+            raise RuntimeError("python-xlib is not installed")
+        self._display = xdisplay.Display()
+        if not self._display.has_extension('MIT-SCREEN-SAVER'):
+            raise RuntimeError("X server lacks the MIT-SCREEN-SAVER extension")
+        self._root = self._display.screen().root
+
+    def idle_seconds(self):
+        return self._root.screensaver_query_info().idle / 1000.0
+
+
+class FakeIdleSource(IdleSource):
+    """Test source: idle time is whatever was last set."""
+    name = 'fake'
+
+    def __init__(self, idle=0.0):
+        self.idle = idle
+
+    def set_idle(self, seconds):
+        self.idle = seconds
+
+    def idle_seconds(self):
+        return self.idle
+
+
+def create_idle_source(backend='auto'):
+    if backend == 'auto':
+        if os.name == 'nt':
+            backend = 'windows'
+        elif os.environ.get('DISPLAY'):
+            backend = 'x11'
+    try:
+        if backend == 'windows':
+            return WindowsIdleSource()
+        if backend == 'x11':
+            return X11IdleSource()
+    except Exception as e:
+        logging.error(f"Could not start the '{backend}' idle source: {e}")
+    logging.warning("No input-idle source for this platform; the user is always reported active.")
+    return IdleSource()
+
+
+class IdleDetector:
+    def __init__(self, source, threshold_seconds):
+        self.source = source
+        self.threshold_seconds = threshold_seconds
+        self.is_idle = False
+        self.idle_since = None # datetime of the last input while idle
+        self.last_input_at = None
+
+    def poll(self, now=None):
+        """
+        Samples the source. Returns None, ("idle", idle_since) when the user just went idle, or
+        ("active", idle_since, resumed_at) when input resumed after an idle span.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        try:
+            idle_seconds = self.source.idle_seconds()
+        except Exception as e:
+            logging.error(f"Idle source '{self.source.name}' failed: {e}")
+            idle_seconds = 0.0
+        self.last_input_at = now - datetime.timedelta(seconds=idle_seconds)
+        if not self.is_idle and idle_seconds >= self.threshold_seconds:
+            self.is_idle = True
+            self.idle_since = self.last_input_at
+            return ("idle", self.idle_since)
+        if self.is_idle and idle_seconds < self.threshold_seconds:
+            self.is_idle = False
+            return ("active", self.idle_since, self.last_input_at)
+        return None
@@ -0,0 +1,147 @@
+# /root/EMS/agent/outbox.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Durable local queue for everything the agent uploads. Activity batches and encoded screenshots are
+# written here before any network call (a screenshot is a file in the outbox directory referenced by
+# its entry). The uploader drains it oldest-first in large batches once the server answers, so an
+# outage or a laptop coming back online costs a few big requests instead of lost data.
+# A screenshot whose upload job is still retrying it is claimed, so the drain doesn't send it twice;
+# claims live in memory only, so after a restart everything is drained again.
+# Size is capped; past the caps the oldest entries are evicted (and their screenshot files deleted).
+
+KIND_ACTIVITY = 'activity'
+KIND_SCREENSHOT = 'screenshot'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    item_count INTEGER NOT NULL,  -- activities in the batch; 1 for a screenshot
+    size INTEGER NOT NULL,        -- payload bytes, plus the file size for screenshots
+    payload TEXT NOT NULL         -- JSON: activity list, or {path, timestamp, format}
+);
+CREATE INDEX IF NOT EXISTS outbox_kind_id ON outbox (kind, id);
+"""
+
+
+class Outbox:
+    def __init__(self, directory, max_bytes=200 * 1024 * 1024, max_entries=50000, database=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._claimed = set() # Screenshot entry ids an upload job is still working on
+        # One connection shared by the capture and uploader threads, serialized by the lock
+        self._conn = sqlite3.connect(database or os.path.join(directory, 'outbox.sqlite3'), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # WAL + NORMAL survives process crashes; fsync on checkpoint
+        self._conn.executescript(_SCHEMA)
+
+    def _insert(self, kind, item_count, size, payload, claim=False):
+        with self._lock:
+            entry_id = self._conn.execute(
+                "INSERT INTO outbox (kind, created_at, item_count, size, payload) VALUES (?, ?, ?, ?, ?)",
+                (kind, time.time(), item_count, size, payload)
+            ).lastrowid
+            if claim:
+                self._claimed.add(entry_id)
+            self._evict()
+        return entry_id
+
+    def put_activities(self, activities):
+        """Stores an activity batch (list of dicts) for upload."""
+        if activities:
+            payload = json.dumps(activities)
+            self._insert(KIND_ACTIVITY, len(activities), len(payload), payload)
+
+    def put_screenshot(self, data, timestamp, fmt, ext, claim=False):
+        """
+        Writes an encoded screenshot to the outbox directory and queues it. With claim, screenshots() skips
+        it until release() (or ack()). Returns (entry id, file path).
+        """
+        path = os.path.join(self.directory, f"screenshot_{timestamp.strftime('%Y%m%d_%H%M%S%f')}{ext}")
+        with open(path, 'wb') as f:
+            f.write(data)
+        payload = json.dumps({"path": path, "timestamp": timestamp.isoformat(), "format": fmt})
+        return self._insert(KIND_SCREENSHOT, 1, len(payload) + len(data), payload, claim=claim), path
+
+    def _evict(self):
+        """Drops the oldest entries while the outbox is over its caps. Called with the lock held."""
+        count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outbox").fetchone()
+        while count > self.max_entries or size > self.max_bytes:
+            row = self._conn.execute("SELECT id, kind, size, item_count, payload FROM outbox ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                break
+            entry_id, kind, entry_size, item_count, payload = row
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+            self._claimed.discard(entry_id) # A claiming job still has the bytes in memory
+            if kind == KIND_SCREENSHOT:
+                _remove_file(json.loads(payload)["path"])
+            logging.warning(f"Outbox full: evicted oldest {kind} entry ({item_count} item(s), {entry_size} bytes).")
+            count -= 1
+            size -= entry_size
+
+    def activity_batch(self, max_activities):
+        """Oldest queued activity batches merged into one list. Returns (entry ids, activities)."""
+        ids, activities = [], []
+        with self._lock:
+            rows = self._conn.execute("SELECT id, item_count, payload FROM outbox WHERE kind = ? ORDER BY id",
+                                      (KIND_ACTIVITY,))
+            for entry_id, item_count, payload in rows:
+                if ids and len(activities) + item_count > max_activities:
+                    break
+                ids.append(entry_id)
+                activities.extend(json.loads(payload))
+        return ids, activities
+
+    def screenshots(self, limit):
+        """Oldest queued screenshots not claimed by an upload job: [(entry id, path, timestamp iso, format)]."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, payload FROM outbox WHERE kind = ? ORDER BY id LIMIT ?",
+                                      (KIND_SCREENSHOT, limit + len(self._claimed))).fetchall()
+            rows = [row for row in rows if row[0] not in self._claimed][:limit]
+        result = []
+        for entry_id, payload in rows:
+            meta = json.loads(payload)
+            result.append((entry_id, meta["path"], meta["timestamp"], meta["format"]))
+        return result
+
+    def ack(self, ids):
+        """Removes delivered entries (and their screenshot files)."""
+        if not ids:
+            return
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT kind, payload FROM outbox WHERE id IN ({placeholders})", list(ids)).fetchall()
+            self._conn.execute(f"DELETE FROM outbox WHERE id IN ({placeholders})", list(ids))
+            self._claimed.difference_update(ids)
+        for kind, payload in rows:
+            if kind == KIND_SCREENSHOT:
+                _remove_file(json.loads(payload)["path"])
+
+    def release(self, ids):
+        """Hands claimed screenshots over to the drain (their upload job gave up)."""
+        with self._lock:
+            self._claimed.difference_update(ids)
+
+    def stats(self):
+        """{kind: (entries, items, bytes)} for logging."""
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, COUNT(*), SUM(item_count), SUM(size) FROM outbox GROUP BY kind").fetchall()
+        return {kind: (entries, items, size) for kind, entries, items, size in rows}
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.error(f"Could not remove outbox file {path}: {e}")
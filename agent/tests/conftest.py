@@ -0,0 +1,22 @@
+# /root/EMS/agent/tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Run from agent/ (python -m pytest tests), apart from the server's tests: both sides have a top-level config module.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))) # Agent modules import as top-level modules
+# config.py puts TEMP_DIR (log file, outbox) under $TEMP; keep the test run's out of the real agent's
+os.environ['TEMP'] = tempfile.mkdtemp(prefix='ems_agent_tests_')
+
+from outbox import Outbox # noqa: E402
+
+
+@pytest.fixture
+def agent(monkeypatch, tmp_path):
+    """agent.py with a fresh outbox and no advertised server formats; nothing is sent unless a test fakes send_data."""
+    import agent
+    monkeypatch.setattr(agent, 'upload_outbox', Outbox(str(tmp_path / "outbox")))
+    monkeypatch.setattr(agent, 'server_activity_formats', set())
+    return agent
@@ -0,0 +1,71 @@
+# /root/EMS/agent/tests/test_activity_batches.py
+import datetime
+import importlib.util
+import os
+
+import pytest
+
+START = datetime.datetime(2025, 3, 3, 9, 0, tzinfo=datetime.timezone.utc)
+
+
+def segment(title, start_s, end_s, process="app.exe", is_active=True):
+    start, end = START + datetime.timedelta(seconds=start_s), START + datetime.timedelta(seconds=end_s)
+    return {"window_title": title, "process_name": process, "start_time": start.isoformat(), "end_time": end.isoformat(),
+            "duration_seconds": int(round(end_s - start_s)), "is_active": is_active}
+
+
+@pytest.fixture(scope='module')
+def server_wire():
+    """The server's utils/wire.py, loaded by path (the server's modules clash with the agent's by name)."""
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'server', 'utils', 'wire.py')
+    spec = importlib.util.spec_from_file_location('server_wire', path)
+    wire = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(wire)
+    return wire
+
+
+def test_coalesce_merges_same_window_across_a_short_gap(agent):
+    merged = agent.coalesce_activities([segment("Mail", 0, 30), segment("Mail", 31.5, 60), segment("Docs", 60, 90)], max_gap_seconds=2)
+    assert [(a["window_title"], a["start_time"], a["end_time"], a["duration_seconds"]) for a in merged] == [
+        ("Mail", segment("Mail", 0, 60)["start_time"], segment("Mail", 0, 60)["end_time"], 60),
+        ("Docs", segment("Docs", 60, 90)["start_time"], segment("Docs", 60, 90)["end_time"], 30),
+    ]
+
+
+@pytest.mark.parametrize('second', [
+    segment("Mail", 35, 60), # Gap beyond max_gap_seconds
+    segment("Mail", 30, 60, process="other.exe"),
+    segment("Mail", 30, 60, is_active=False),
+    segment("Mail", 29, 60), # Overlap
+])
+def test_coalesce_keeps_distinct_segments(agent, second):
+    assert len(agent.coalesce_activities([segment("Mail", 0, 30), second], max_gap_seconds=2)) == 2
+
+
+def test_coalesce_respects_the_long_activity_split(agent):
+    activities = [segment("Mail", 0, 300), segment("Mail", 300, 600)]
+    assert len(agent.coalesce_activities(activities, max_gap_seconds=2, max_duration_seconds=300)) == 2
+    assert len(agent.coalesce_activities(activities, max_gap_seconds=2, max_duration_seconds=600)) == 1
+
+
+def test_coalesce_leaves_the_input_untouched(agent):
+    activities = [segment("Mail", 0, 30), segment("Mail", 31, 60)]
+    agent.coalesce_activities(activities)
+    assert activities[0]["end_time"] == segment("Mail", 0, 30)["end_time"]
+
+
+def test_dictionary_batch_round_trip(agent, server_wire):
+    activities = [segment("Inbox - Outlook", 0, 12.25, "OUTLOOK.EXE"), segment("Q3 - Excel", 12.25, 80.5, "EXCEL.EXE"),
+                  segment("Idle", 81, 400.125, "idle", is_active=False), segment("Inbox - Outlook", 400.125, 401.999, "OUTLOOK.EXE"),
+                  segment("Zoë's notes – 📝", 402, 403, "notepad.exe")]
+    encoded = agent.encode_dictionary_batch({"employee_id": "emp-1", "activities": activities})
+    assert len(encoded["t"]) == 8 # Repeated titles and processes are sent once
+
+    expanded = server_wire.expand_dictionary_batch(encoded)
+    assert expanded["employee_id"] == "emp-1"
+    parsed = [server_wire.parse_activity_item(item, 'dict') for item in expanded["activities"]]
+    for original, (title, process, start, end, duration, is_active) in zip(activities, parsed, strict=True):
+        assert (title, process, is_active) == (original["window_title"], original["process_name"], original["is_active"])
+        assert start == datetime.datetime.fromisoformat(original["start_time"])
+        assert end == datetime.datetime.fromisoformat(original["end_time"])
+        assert duration == original["duration_seconds"]
@@ -0,0 +1,40 @@
+# /root/EMS/agent/tests/test_idle.py
+import datetime
+
+from idle import FakeIdleSource, IdleDetector
+
+NOW = datetime.datetime(2025, 3, 3, 9, 0, tzinfo=datetime.timezone.utc)
+
+
+def at(seconds):
+    return NOW + datetime.timedelta(seconds=seconds)
+
+
+def test_idle_span_starts_at_last_input_and_is_reported_once_input_resumes():
+    source = FakeIdleSource()
+    detector = IdleDetector(source, threshold_seconds=60)
+    assert detector.poll(at(0)) is None
+    source.set_idle(59)
+    assert detector.poll(at(59)) is None and not detector.is_idle
+
+    source.set_idle(61)
+    assert detector.poll(at(61)) == ("idle", at(0))
+    assert detector.is_idle
+    source.set_idle(600)
+    assert detector.poll(at(600)) is None # Still the same span
+
+    source.set_idle(2)
+    assert detector.poll(at(700)) == ("active", at(0), at(698))
+    assert not detector.is_idle
+    assert detector.last_input_at == at(698)
+
+
+def test_failing_source_counts_as_input():
+    class BrokenSource(FakeIdleSource):
+        def idle_seconds(self):
+            raise OSError("display went away")
+
+    detector = IdleDetector(FakeIdleSource(idle=120), threshold_seconds=60)
+    assert detector.poll(at(120))[0] == "idle"
+    detector.source = BrokenSource()
+    assert detector.poll(at(130)) == ("active", at(0), at(130))
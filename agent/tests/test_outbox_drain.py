@@ -0,0 +1,90 @@
+# /root/EMS/agent/tests/test_outbox_drain.py
+import datetime
+
+import pytest
+from PIL import Image
+
+REFUSED = {"status": "error", "http_status": 400}
+TAKEN = datetime.datetime(2025, 3, 3, 9, 0, tzinfo=datetime.timezone.utc)
+
+
+def activity(title, minute):
+    start = TAKEN + datetime.timedelta(minutes=minute)
+    return {"window_title": title, "process_name": "app.exe", "start_time": start.isoformat(),
+            "end_time": (start + datetime.timedelta(seconds=30)).isoformat(), "duration_seconds": 30, "is_active": True}
+
+
+@pytest.fixture
+def sent(agent, monkeypatch):
+    """Fakes send_data: refuses any activity batch containing a 'bad' window, accepts everything else."""
+    requests = []
+
+    def send_data(endpoint, data=None, files=None, body_format='json'):
+        titles = [a["window_title"] for a in data["activities"]]
+        requests.append(titles)
+        return REFUSED if "bad" in titles else {"status": "ok"}
+
+    monkeypatch.setattr(agent, 'send_data', send_data)
+    return requests
+
+
+def test_refused_merged_batch_is_resent_one_by_one(agent, sent):
+    for n, title in enumerate(["first", "bad", "third", "fourth"]):
+        agent.upload_outbox.put_activities([activity(title, n)])
+    assert agent.drain_outbox()
+    assert sent == [["first", "bad", "third", "fourth"], ["first"], ["bad"], ["third"], ["fourth"]]
+    assert agent.upload_outbox.stats() == {}
+
+
+def test_isolation_ends_with_the_refused_batch(agent, sent, monkeypatch):
+    for n, title in enumerate(["bad", "second"]):
+        agent.upload_outbox.put_activities([activity(title, n)])
+    monkeypatch.setattr(agent.config, 'OUTBOX_DRAIN_MAX_ACTIVITIES', 2)
+    assert agent.drain_outbox()
+    agent.upload_outbox.put_activities([activity("later", 5)])
+    agent.upload_outbox.put_activities([activity("latest", 6)])
+    assert agent.drain_outbox()
+    assert sent == [["bad", "second"], ["bad"], ["second"], ["later", "latest"]] # Merged again after isolating
+
+
+def test_unreachable_server_keeps_everything(agent, monkeypatch):
+    monkeypatch.setattr(agent, 'send_data', lambda *args, **kwargs: None)
+    agent.upload_outbox.put_activities([activity("kept", 0)])
+    assert not agent.drain_outbox()
+    assert agent.upload_outbox.stats()["activity"][:2] == (1, 1)
+
+
+def frame():
+    return Image.new('RGB', (320, 200), (40, 90, 160))
+
+
+def test_screenshot_is_written_ahead_and_claimed_while_its_job_retries(agent, monkeypatch):
+    uploads = []
+    monkeypatch.setattr(agent, 'upload_screenshot', lambda data, timestamp, fmt: uploads.append(timestamp) or None)
+    job, give_up = agent.screenshot_upload_job(frame(), TAKEN, frame_hash=None)
+    assert job() is False
+    assert agent.upload_outbox.stats()["screenshot"][0] == 1 # On disk before the attempt failed
+    assert agent.upload_outbox.screenshots(10) == [] # ...but left to the job
+    assert job() is False and agent.upload_outbox.stats()["screenshot"][0] == 1 # Retries reuse the entry
+
+    give_up()
+    queued = agent.upload_outbox.screenshots(10)
+    assert [entry[2] for entry in queued] == [TAKEN.isoformat()]
+
+    monkeypatch.setattr(agent, 'upload_screenshot', lambda data, timestamp, fmt: {"status": "ok", "filename": "ab/cd/x.webp"})
+    assert agent.drain_outbox()
+    assert agent.upload_outbox.stats() == {}
+
+
+def test_delivered_screenshot_leaves_the_outbox(agent, monkeypatch):
+    monkeypatch.setattr(agent, 'upload_screenshot', lambda data, timestamp, fmt: {"status": "ok", "filename": "ab/cd/x.webp"})
+    job, _ = agent.screenshot_upload_job(frame(), TAKEN, frame_hash=None)
+    assert job() is True
+    assert agent.upload_outbox.stats() == {}
+
+
+def test_frame_rejected_by_a_full_queue_is_spilled(agent, monkeypatch):
+    monkeypatch.setattr(agent, 'send_data', lambda *args, **kwargs: pytest.fail("nothing is sent"))
+    _, give_up = agent.screenshot_upload_job(frame(), TAKEN, frame_hash=1, reference=(TAKEN, "ab/cd/ref.webp"))
+    give_up() # As RetryScheduler.submit does when its queue is full
+    assert [entry[2] for entry in agent.upload_outbox.screenshots(10)] == [TAKEN.isoformat()]
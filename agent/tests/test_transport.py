@@ -0,0 +1,50 @@
+# /root/EMS/agent/tests/test_transport.py
+import threading
+
+import transport
+from transport import RetryScheduler, backoff_delay
+
+
+def test_backoff_delay_doubles_up_to_the_cap_with_equal_jitter():
+    for attempt, expected in [(0, 5), (1, 10), (2, 20), (6, 300), (12, 300)]:
+        for _ in range(20):
+            assert expected / 2 <= backoff_delay(attempt, 5, 300) <= expected
+
+
+def test_failing_job_backs_off_then_gives_up(monkeypatch):
+    delays = []
+    monkeypatch.setattr(transport, 'backoff_delay', lambda attempt, base, cap: delays.append(attempt) or 0.01)
+    attempts, gave_up = [], threading.Event()
+    scheduler = RetryScheduler('TestRetryThread', base_delay=1, max_delay=2, max_attempts=3)
+    assert scheduler.submit("flaky", lambda: attempts.append(1) and False, on_give_up=gave_up.set)
+    assert gave_up.wait(5)
+    assert len(attempts) == 3
+    assert delays == [0, 1] # One backoff between each pair of attempts
+    assert scheduler.pending() == 0
+
+
+def test_delivered_job_is_not_retried():
+    attempts, delivered = [], threading.Event()
+    scheduler = RetryScheduler('TestRetryThread', base_delay=0.01, max_delay=0.01, max_attempts=3)
+
+    def job():
+        attempts.append(1)
+        delivered.set()
+        return True
+
+    scheduler.submit("ok", job, on_give_up=lambda: attempts.append("gave up"))
+    assert delivered.wait(5)
+    assert scheduler.pending() == 0
+    assert attempts == [1]
+
+
+def test_full_queue_gives_up_at_once():
+    running, release = threading.Event(), threading.Event()
+    scheduler = RetryScheduler('TestRetryThread', max_pending=1)
+    scheduler.submit("blocking", lambda: running.set() or release.wait(5))
+    assert running.wait(5) # Off the queue and running
+    assert scheduler.submit("queued", lambda: True)
+    gave_up = []
+    assert not scheduler.submit("overflow", lambda: True, on_give_up=lambda: gave_up.append(1))
+    assert gave_up == [1]
+    release.set()
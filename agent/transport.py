@@ -0,0 +1,151 @@
+# /root/EMS/agent/transport.py
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# HTTP transport for the agent. All uploads share one keep-alive requests.Session (one connection pool
+# per server), so a batch or screenshot no longer pays for a new TCP/TLS handshake. Every request is
+# timed and counted per endpoint. Nothing here sleeps on the caller's thread: failed sends are handed
+# to a RetryScheduler, which retries them on its own thread with exponential backoff and jitter.
+
+
+class EndpointStats:
+    __slots__ = ('requests', 'failures', 'total_ms', 'max_ms', 'last_status')
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_status = None
+
+    def as_dict(self):
+        return {
+            "requests": self.requests, "failures": self.failures,
+            "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else None,
+            "max_ms": round(self.max_ms, 1), "last_status": self.last_status,
+        }
+
+
+class Transport:
+    def __init__(self, base_url, headers, pool_size=4):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        # Retries are the scheduler's job, so urllib3 is told not to retry on its own
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, path, label=None, **kwargs):
+        """
+        Sends one request on the pooled session. label groups the counters (defaults to path; pass it for
+        paths carrying ids). Exceptions propagate to the caller after being counted as failures.
+        """
+        started = time.perf_counter()
+        status = None
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                stats = self._stats.setdefault(label or path, EndpointStats())
+                stats.requests += 1
+                stats.total_ms += elapsed_ms
+                stats.max_ms = max(stats.max_ms, elapsed_ms)
+                stats.last_status = status
+                if status is None or status >= 400:
+                    stats.failures += 1
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def stats(self):
+        """{endpoint: {requests, failures, avg_ms, max_ms, last_status}}"""
+        with self._lock:
+            return {label: stats.as_dict() for label, stats in self._stats.items()}
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with equal jitter: half the capped delay is fixed, the other half random."""
+    delay = min(max_delay, base_delay * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RetryScheduler:
+    """
+    Runs send jobs on a background thread. A job is a callable returning True once delivered; a falsy
+    result or an exception reschedules it with backoff_delay, until max_attempts, when on_give_up
+    (if any) is called instead. submit() never blocks on the network.
+    """
+
+    def __init__(self, name, base_delay=5, max_delay=300, max_attempts=6, max_pending=1000):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self._queue = [] # heap of (due, seq, label, job, attempt, on_give_up)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, label, job, on_give_up=None):
+        """Queues job for an immediate first attempt. Returns False (and gives up at once) if the queue is full."""
+        with self._cond:
+            if len(self._queue) >= self.max_pending:
+                full = True
+            else:
+                full = False
+                heapq.heappush(self._queue, (time.monotonic(), next(self._seq), label, job, 0, on_give_up))
+                self._cond.notify()
+        if full:
+            logging.warning(f"Retry queue full; not scheduling {label}.")
+            if on_give_up is not None:
+                on_give_up()
+            return False
+        return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    self._cond.wait(timeout=(self._queue[0][0] - time.monotonic()) if self._queue else None)
+                _, _, label, job, attempt, on_give_up = heapq.heappop(self._queue)
+            try:
+                delivered = job()
+            except Exception as e:
+                logging.error(f"Send job {label} raised: {e}", exc_info=True)
+                delivered = False
+            if delivered:
+                continue
+            attempt += 1
+            if attempt >= self.max_attempts:
+                logging.error(f"Giving up on {label} after {attempt} attempts.")
+                if on_give_up is not None:
+                    try:
+                        on_give_up()
+                    except Exception as e:
+                        logging.error(f"Give-up handler for {label} raised: {e}", exc_info=True)
+                continue
+            delay = backoff_delay(attempt - 1, self.base_delay, self.max_delay)
+            logging.info(f"Retrying {label} in {delay:.1f}s (attempt {attempt + 1}/{self.max_attempts}).")
+            with self._cond:
+                heapq.heappush(self._queue, (time.monotonic() + delay, next(self._seq), label, job, attempt, on_give_up))
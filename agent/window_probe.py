@@ -0,0 +1,191 @@
+# /root/EMS/agent/window_probe.py
+import logging
+import os
+
+import psutil
+
+try:
+    from Xlib import X, display as xdisplay # Optional: python-xlib for the Linux/X11 backend
+except ImportError:
+    X = xdisplay = None
+
+# Active-window probes for activity_monitor_worker. A backend answers two questions:
+#   foreground()        -> (window handle, title); called every tick, one cheap query
+#   window_pid(handle)  -> owning process id; only called when the foreground window changes
+# WindowProbe.sample() adds the process name, resolved once per (pid, create_time) and cached, so a
+# steady foreground window costs one query per tick and no psutil calls at all.
+
+NO_WINDOW = ("No Active Window", "System Desktop/Background")
+
+
+class ProcessNameCache:
+    """pid -> (create_time, name). create_time tells a reused pid apart from the process that had it before."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._names = {}
+
+    def resolve(self, pid):
+        if not pid:
+            return "System Idle/Background" # Idle process or system process without a clear owner
+        try:
+            process = psutil.Process(pid)
+            create_time = process.create_time()
+            cached = self._names.get(pid)
+            if cached is not None and cached[0] == create_time:
+                return cached[1]
+            name = process.name()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess) as e:
+            logging.warning(f"Psutil: Could not get process name for PID {pid}: {e}")
+            return f"Protected/Zombie Process (PID: {pid})"
+        if len(self._names) >= self.max_entries:
+            self._names.clear()
+        self._names[pid] = (create_time, name)
+        return name
+
+
+class WindowProbe:
+    name = 'base'
+
+    def __init__(self, names=None):
+        self.names = names or ProcessNameCache()
+        self._last_handle = None
+        self._last_process = None
+
+    def foreground(self):
+        raise NotImplementedError
+
+    def window_pid(self, handle):
+        raise NotImplementedError
+
+    def sample(self):
+        """Returns (window_title, process_name) for the current foreground window."""
+        handle, title = self.foreground()
+        if not handle:
+            self._last_handle = None
+            return NO_WINDOW
+        if handle != self._last_handle:
+            # Titles change within a window (browser tabs); the owning process doesn't
+            self._last_process = self.names.resolve(self.window_pid(handle))
+            self._last_handle = handle
+        return title or "No Title Window", self._last_process
+
+
+class WindowsProbe(WindowProbe):
+    name = 'windows'
+
+    def __init__(self, names=None):
+        super().__init__(names)
+        import win32gui # Imported once here rather than on every tick
+        import win32process
+        self._win32gui = win32gui
+        self._win32process = win32process
+
+    def foreground(self):
+        hwnd = self._win32gui.GetForegroundWindow()
+        return (hwnd, self._win32gui.GetWindowText(hwnd)) if hwnd else (None, None)
+
+    def window_pid(self, handle):
+        try:
+            return self._win32process.GetWindowThreadProcessId(handle)[1]
+        except Exception as e:
+            logging.error(f"Error getting PID for HWND {handle}: {e}")
+            return 0
+
+
+class X11Probe(WindowProbe):
+    """EWMH window managers: _NET_ACTIVE_WINDOW on the root window, _NET_WM_NAME / _NET_WM_PID on the client."""
+    name = 'x11'
+
+    def __init__(self, names=None):
+        super().__init__(names)
+        if xdisplay is None:
+            raise RuntimeError("python-xlib is not installed")
+        self._display = xdisplay.Display()
+        self._root = self._display.screen().root
+        self._active_atom = self._display.intern_atom('_NET_ACTIVE_WINDOW')
+        self._name_atom = self._display.intern_atom('_NET_WM_NAME')
+        self._pid_atom = self._display.intern_atom('_NET_WM_PID')
+
+    def _window(self, window_id):
+        return self._display.create_resource_object('window', window_id)
+
+    def foreground(self):
+        prop = self._root.get_full_property(self._active_atom, X.AnyPropertyType)
+        window_id = prop.value[0] if prop is not None and len(prop.value) else 0
+        if not window_id:
+            return None, None
+        window = self._window(window_id)
+        name = window.get_full_property(self._name_atom, X.AnyPropertyType)
+        title = name.value if name is not None else window.get_wm_name()
+        if isinstance(title, bytes):
+            title = title.decode('utf-8', 'replace')
+        return window_id, title
+
+    def window_pid(self, handle):
+        prop = self._window(handle).get_full_property(self._pid_atom, X.AnyPropertyType)
+        return int(prop.value[0]) if prop is not None and len(prop.value) else 0
+
+
+class ScriptedProbe(WindowProbe):
+    """
+    Fake backend for tests and benchmarks: replays (handle, title, pid) samples, cycling at the end.
+    process_names maps pid -> name so no real processes are looked up.
+    """
+    name = 'scripted'
+
+    def __init__(self, samples, process_names=None):
+        super().__init__(names=_StaticNames(process_names or {}))
+        self.samples = list(samples)
+        self.position = 0
+        self.foreground_calls = 0
+        self.pid_calls = 0
+
+    def foreground(self):
+        self.foreground_calls += 1
+        handle, title, _ = self.samples[self.position % len(self.samples)]
+        self.position += 1
+        return handle, title
+
+    def window_pid(self, handle):
+        self.pid_calls += 1
+        for sample_handle, _, pid in self.samples:
+            if sample_handle == handle:
+                return pid
+        return 0
+
+
+class _StaticNames:
+    def __init__(self, names):
+        self.names = names
+        self.lookups = 0
+
+    def resolve(self, pid):
+        self.lookups += 1
+        return self.names.get(pid, "unknown_process")
+
+
+class UnsupportedProbe(WindowProbe):
+    name = 'unsupported'
+
+    def sample(self):
+        return "Unsupported OS Window", "Unsupported OS Process"
+
+
+def create_probe(backend='auto'):
+    """Builds the configured backend ('auto', 'windows', 'x11'); falls back to UnsupportedProbe."""
+    if backend == 'auto':
+        if os.name == 'nt':
+            backend = 'windows'
+        elif os.environ.get('DISPLAY'):
+            backend = 'x11'
+    try:
+        if backend == 'windows':
+            return WindowsProbe()
+        if backend == 'x11':
+            return X11Probe()
+    except Exception as e:
+        logging.error(f"Could not start the '{backend}' window probe: {e}")
+        return UnsupportedProbe()
+    logging.warning("Active window detection not implemented for this platform.")
+    return UnsupportedProbe()
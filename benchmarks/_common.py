@@ -0,0 +1,163 @@
+# /root/EMS/benchmarks/_common.py
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+# Shared helpers for the scripts in this folder. Each script runs on its own
+# (python benchmarks/<script>.py --help), imports the server or agent modules it measures
+# and prints one table. Scripts that need MongoDB use a throwaway database on
+# MONGO_BENCH_URI and exit with a message when nothing answers there.
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SERVER_DIR = os.path.join(ROOT, 'server')
+AGENT_DIR = os.path.join(ROOT, 'agent')
+MONGO_BENCH_URI = os.environ.get('MONGO_BENCH_URI') or 'mongodb://localhost:27017'
+
+
+def use_server():
+    """Makes the server modules importable as top-level packages (models, utils), as server/app.py sees them."""
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+
+
+def use_agent():
+    """
+    Makes the agent modules importable. Importing agent.py opens its outbox under TEMP_DIR and starts the
+    (idle) upload retry thread; the benchmarks only call its encoding helpers, so nothing is sent.
+    """
+    if AGENT_DIR not in sys.path:
+        sys.path.insert(0, AGENT_DIR)
+
+
+def measure(fn, repeat=5, warmup=1):
+    """Calls fn warmup + repeat times. Returns wall and CPU milliseconds per call over the timed runs."""
+    for _ in range(warmup):
+        fn()
+    wall, cpu = [], []
+    for _ in range(repeat):
+        wall_started, cpu_started = time.perf_counter(), time.process_time()
+        fn()
+        wall.append((time.perf_counter() - wall_started) * 1000)
+        cpu.append((time.process_time() - cpu_started) * 1000)
+    return {"median_ms": statistics.median(wall), "min_ms": min(wall), "cpu_ms": statistics.median(cpu)}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def print_table(headers, rows):
+    rows = [[_cell(value) for value in row] for row in rows]
+    widths = [max(len(str(h)), *(len(row[i]) for row in rows)) if rows else len(str(h)) for i, h in enumerate(headers)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(value.rjust(w) if i else value.ljust(w) for i, (value, w) in enumerate(zip(row, widths))))
+
+
+def _cell(value):
+    if isinstance(value, float):
+        return f"{value:,.3f}" if abs(value) < 10 else f"{value:,.1f}"
+    if isinstance(value, int):
+        return f"{value:,}"
+    return str(value)
+
+
+def mongo_database(uri=MONGO_BENCH_URI, prefix='ems_bench', **client_options):
+    """Returns (client, db) for a throwaway database; exits when no MongoDB answers at uri. Drop it with drop_database."""
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+    client = MongoClient(uri, serverSelectionTimeoutMS=2000, **client_options)
+    try:
+        client.admin.command('ping')
+    except PyMongoError as e:
+        client.close()
+        sys.exit(f"No MongoDB at {uri} ({e}). Set MONGO_BENCH_URI to run this benchmark.")
+    return client, client[f"{prefix}_{uuid.uuid4().hex[:8]}"]
+
+
+def drop_database(client, db):
+    client.drop_database(db.name)
+    client.close()
+
+
+# Alt-tabbing between a handful of windows, as activity_monitor_worker records it. Titles are the
+# kind of strings agents actually send: long, repetitive and mostly shared within a batch.
+_WINDOWS = [
+    ("Inbox - jane.doe@example.com - Outlook", "OUTLOOK.EXE"),
+    ("Q3 forecast v7 (final) - Excel", "EXCEL.EXE"),
+    ("#ops-alerts | Example Corp - Slack", "slack.exe"),
+    ("Pull request #4182: Fix ingest retries - Google Chrome", "chrome.exe"),
+    ("JIRA-2291 Checkout fails on Safari - Google Chrome", "chrome.exe"),
+    ("agent.py - EMS - Visual Studio Code", "Code.exe"),
+    ("Command Prompt", "cmd.exe"),
+    ("Meeting with Finance | Microsoft Teams", "ms-teams.exe"),
+    ("Untitled - Notepad", "notepad.exe"),
+    ("File Explorer", "explorer.exe"),
+    ("Weekly report.docx - Word", "WINWORD.EXE"),
+    ("Remote Desktop Connection", "mstsc.exe"),
+]
+
+
+def synthetic_activities(count, seed=0, windows=len(_WINDOWS), start=None, idle_every=40):
+    """
+    Agent-format activity dicts (agent/agent.py record_activity): segments of 1 s to a few minutes over
+    `windows` distinct windows, returning to recent ones often, with the occasional idle span.
+    """
+    rng = random.Random(seed)
+    pool = _WINDOWS[:windows]
+    cursor = start or datetime.datetime(2025, 3, 3, 8, 0, tzinfo=datetime.timezone.utc)
+    recent = []
+    activities = []
+    repeat = None
+    for n in range(count):
+        if idle_every and n and n % idle_every == 0:
+            title, process, is_active, seconds = "Idle", "idle", False, rng.randint(180, 1200)
+        else:
+            if repeat is not None:
+                title, process = repeat
+            else:
+                previous = (activities[-1]["window_title"], activities[-1]["process_name"]) if activities else None
+                candidates = [w for w in recent if w != previous]
+                if candidates and rng.random() < 0.7:
+                    title, process = rng.choice(candidates)
+                else:
+                    title, process = rng.choice([w for w in pool if w != previous])
+                    recent = (recent + [(title, process)])[-3:]
+            is_active, seconds = True, int(rng.expovariate(1 / 40)) + 1
+        end = cursor + datetime.timedelta(seconds=seconds, milliseconds=rng.randint(0, 999))
+        activities.append({
+            "window_title": title, "process_name": process,
+            "start_time": cursor.isoformat(), "end_time": end.isoformat(),
+            "duration_seconds": int(round((end - cursor).total_seconds())), "is_active": is_active,
+        })
+        # Switches are back-to-back, except where the monitor dropped a sub-second visit to another window
+        # in between; only those leave two segments of the same window next to each other.
+        repeat = (title, process) if is_active and rng.random() < 0.25 else None
+        cursor = end + datetime.timedelta(milliseconds=rng.choice((400, 900, 1500)) if repeat else 0)
+    return activities
+
+
+def synthetic_screenshot(rng, size=(1920, 1080)):
+    """A desktop-like frame: flat background, a few windows with title bars and text, one photo-like area."""
+    from PIL import Image, ImageDraw # Here, so the activity benchmarks don't need Pillow
+    image = Image.new('RGB', size, tuple(rng.randint(20, 90) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(2, 4)):
+        x0, y0 = rng.randint(0, size[0] // 2), rng.randint(0, size[1] // 2)
+        x1, y1 = x0 + rng.randint(500, 1200), y0 + rng.randint(300, 700)
+        draw.rectangle((x0, y0, x1, y1), fill=(250, 250, 250), outline=(120, 120, 120))
+        draw.rectangle((x0, y0, x1, y0 + 28), fill=(45, 95, 180))
+        draw.text((x0 + 8, y0 + 8), f"Window {rng.randint(1, 99)} - Document", fill=(255, 255, 255))
+        for line in range(y0 + 40, y1 - 14, 16):
+            words = " ".join(rng.choice(["lorem", "ipsum", "quarterly", "report", "total", "=SUM(B2:B9)", "12,480.00"])
+                             for _ in range(rng.randint(3, 12)))
+            draw.text((x0 + 10, line), words, fill=(30, 30, 30))
+    photo = Image.effect_noise((rng.randint(200, 480), rng.randint(150, 320)), rng.randint(20, 60)).convert('RGB')
+    image.paste(photo, (rng.randint(0, size[0] - photo.width), rng.randint(0, size[1] - photo.height)))
+    draw.rectangle((0, size[1] - 40, size[0], size[1]), fill=(20, 20, 30)) # Taskbar
+    return image
@@ -0,0 +1,90 @@
+# /root/EMS/benchmarks/activity_wire_formats.py
+"""
+Activity batches per wire format, with and without the agent's coalescing: payload bytes (raw and
+as sent, after compress_body) and the server-side cost of the body. Decode is utils/wire.py
+read_activity_payload (which also expands dictionary batches); validate adds parse_activity_item on
+every entry; ingest further builds the activity_logs documents and BSON-encodes them, as log_activity
+and insert_many do before the write itself.
+
+    python benchmarks/activity_wire_formats.py --activities 10000
+"""
+import argparse
+
+from _common import measure, print_table, synthetic_activities, use_agent, use_server
+
+# The agent and the server each have a top-level config module; the agent is imported first so
+# agent.py binds its own.
+use_agent()
+import agent # noqa: E402
+use_server()
+import bson # noqa: E402
+from flask import Flask # noqa: E402
+from utils import wire # noqa: E402
+
+app = Flask(__name__)
+
+
+def body_formats():
+    """Formats both sides support, in the agent's naming (encode_body / accepted_activity_formats)."""
+    formats = ['json', 'json+dict']
+    if agent.msgpack is not None and wire.msgpack is not None:
+        formats += ['msgpack', 'msgpack+dict']
+    return formats
+
+
+def encode(payload, body_format):
+    """agent.encode_body as it runs against a server advertising exactly body_format."""
+    base, _, dictionary = body_format.partition('+')
+    agent.server_activity_formats.clear()
+    if dictionary:
+        agent.server_activity_formats.add(body_format)
+    raw, content_type, used = agent.encode_body(payload, base)
+    assert used == body_format, f"encode_body sent {used} instead of {body_format}"
+    return raw, content_type
+
+
+def decode(body, content_type):
+    with app.test_request_context('/api/log/activity', method='POST', data=body, content_type=content_type):
+        from flask import request
+        return wire.read_activity_payload(request)
+
+
+def decode_and_validate(body, content_type):
+    data, wire_format = decode(body, content_type)
+    return [wire.parse_activity_item(act_data, wire_format) for act_data in data["activities"]]
+
+
+def ingest(body, content_type):
+    items = decode_and_validate(body, content_type)
+    for window_title, process_name, start_time, end_time, duration_s, is_active in items:
+        bson.encode({"employee_id": "bench-emp", "timestamp": start_time, "window_title": window_title,
+                     "process_name": process_name, "start_time": start_time, "end_time": end_time,
+                     "duration_seconds": duration_s, "is_active": is_active, "log_type": "activity"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--activities', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    activities = synthetic_activities(args.activities)
+    batches = [("as recorded", activities),
+               ("coalesced", agent.coalesce_activities(activities, getattr(agent.config, 'ACTIVITY_COALESCE_GAP_SECONDS', 2),
+                                                       agent.LONG_ACTIVITY_SPLIT_SECONDS))]
+    rows = []
+    for batch_label, batch in batches:
+        payload = {"employee_id": "bench-emp", "activities": batch}
+        for body_format in body_formats():
+            body, content_type = encode(payload, body_format)
+            wire_body, _ = agent.compress_body(body)
+            timings = [measure(lambda fn=fn: fn(body, content_type), repeat=args.repeat)["median_ms"]
+                       for fn in (decode, decode_and_validate, ingest)]
+            rows.append([batch_label, body_format, len(batch), len(body), len(wire_body), *timings])
+    agent.server_activity_formats.clear()
+    print_table(["batch", "format", "activities", "body bytes", "wire bytes", "decode ms", "decode+validate ms", "ingest ms"], rows)
+    print(f"Wire bytes use REQUEST_COMPRESSION={agent.config.REQUEST_COMPRESSION!r}; ingest excludes the MongoDB round trip.")
+
+
+if __name__ == '__main__':
+    main()
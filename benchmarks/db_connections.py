@@ -0,0 +1,100 @@
+# /root/EMS/benchmarks/db_connections.py
+"""
+Per-request database overhead: the old get_db (a new MongoClient, an ismaster round trip and the
+collection/index check on every request) against the pooled client in models/db.py.
+
+    python benchmarks/db_connections.py --requests 200 --threads 1 8
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from _common import MONGO_BENCH_URI, drop_database, mongo_database, percentile, print_table, use_server
+
+use_server()
+from flask import Flask # noqa: E402
+from models import db as db_module # noqa: E402
+
+
+def legacy_request(app):
+    """models/db.py get_db before the pooled client, followed by the request's one query."""
+    from pymongo import MongoClient
+    client = MongoClient(app.config['MONGO_URI'], serverSelectionTimeoutMS=5000)
+    try:
+        client.admin.command('ismaster')
+        db = client[app.config['MONGO_DB_NAME']]
+        existing = db.list_collection_names()
+        for coll in ('users', 'activity_logs', 'employees'):
+            if coll not in existing:
+                db.create_collection(coll)
+        db.activity_logs.create_index([("employee_id", 1), ("timestamp", -1)])
+        db.employees.find_one({"employee_id": "emp-1"})
+    finally:
+        client.close() # The old close_db never closed it; closing here only flatters the old path
+
+
+def pooled_request(app):
+    with app.app_context():
+        db_module.get_db().employees.find_one({"employee_id": "emp-1"})
+
+
+def run(app, request_fn, requests, threads):
+    """Runs requests calls of request_fn spread over threads. Returns per-request latencies (ms) and wall time."""
+    latencies = []
+    lock = threading.Lock()
+    per_thread = max(1, requests // threads)
+
+    def worker():
+        local = []
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            request_fn(app)
+            local.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return latencies, time.perf_counter() - started
+
+
+def connections_created(client):
+    return client.admin.command('serverStatus')['connections'].get('totalCreated')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=MONGO_BENCH_URI)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    args = parser.parse_args()
+
+    admin_client, bench_db = mongo_database(args.uri)
+    bench_db.employees.insert_many([{"employee_id": f"emp-{i}", "display_name": f"User {i}"} for i in range(100)])
+    app = Flask(__name__)
+    app.config.update(MONGO_URI=args.uri, MONGO_DB_NAME=bench_db.name)
+    db_module.init_db(app)
+
+    rows = []
+    try:
+        for threads in args.threads:
+            for label, request_fn in (("per-request client", legacy_request), ("pooled client", pooled_request)):
+                request_fn(app) # Warm-up
+                created_before = connections_created(admin_client)
+                latencies, wall = run(app, request_fn, args.requests, threads)
+                created = connections_created(admin_client) - created_before
+                rows.append([label, threads, len(latencies), statistics.median(latencies), percentile(latencies, 95),
+                             len(latencies) / wall, created])
+    finally:
+        db_module.close_client()
+        drop_database(admin_client, bench_db)
+    print_table(["path", "threads", "requests", "median ms", "p95 ms", "req/s", "connections opened"], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# /root/EMS/benchmarks/employee_search.py
+"""
+Users-list search over synthetic employees: the old case-insensitive $regex on display_name /
+employee_id against the search_tokens index (models/search.py). Each search runs what list_users
+does, count_documents plus the first sorted page, and reports the documents the plan examined.
+
+    python benchmarks/employee_search.py --employees 100000
+"""
+import argparse
+import datetime
+import random
+
+from _common import MONGO_BENCH_URI, drop_database, measure, mongo_database, print_table, use_server
+
+use_server()
+from models.indexes import ensure_indexes # noqa: E402
+from models.search import search_filter, search_tokens # noqa: E402
+
+USERS_PER_PAGE = 15 # routes/users.py
+FIRST_NAMES = ["Maria", "José", "John", "Aisha", "Wei", "Olga", "Liam", "Fatima", "Noah", "Chloé", "Ravi", "Sven",
+               "Yuki", "Amara", "Diego", "Ingrid", "Omar", "Priya", "Lucas", "Zoë"]
+LAST_NAMES = ["García", "Smith", "Nguyen", "Müller", "Okafor", "Kowalski", "Rossi", "Haddad", "Tanaka", "Silva",
+              "Johansson", "Patel", "Dubois", "Ivanova", "O'Brien", "Khan", "Schmidt", "Lopez", "Chen", "Novak"]
+QUERIES = ["jo", "smith", "maria gar", "desk-04", "zz-no-match"]
+
+
+def seed(db, count, rng):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    batch = []
+    for i in range(count):
+        display_name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        employee_id = f"{rng.choice(['desk', 'lap', 'vm'])}-{i:05d}"
+        batch.append({"employee_id": employee_id, "display_name": display_name,
+                      "status": rng.choice(["active", "active", "active", "inactive", "pending_rename"]),
+                      "last_seen": now, "search_tokens": search_tokens(display_name, employee_id)})
+        if len(batch) == 5000:
+            db.employees.insert_many(batch)
+            batch = []
+    if batch:
+        db.employees.insert_many(batch)
+
+
+def legacy_filter(query):
+    """routes/users.py list_users before the search index."""
+    regex_query = {"$regex": query, "$options": "i"}
+    return {"$or": [{"display_name": regex_query}, {"employee_id": regex_query}]}
+
+
+def token_filter(query):
+    return {"$or": [search_filter(query) or {"_id": None}]}
+
+
+def list_page(db, criteria):
+    total = db.employees.count_documents(criteria)
+    page = list(db.employees.find(criteria).sort([("status", 1), ("display_name", 1)]).limit(USERS_PER_PAGE))
+    return total, page
+
+
+def docs_examined(db, criteria):
+    explain = db.employees.find(criteria).sort([("status", 1), ("display_name", 1)]).limit(USERS_PER_PAGE).explain()
+    return explain["executionStats"]["totalDocsExamined"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=MONGO_BENCH_URI)
+    parser.add_argument('--employees', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--query', action='append', help="Search term (repeatable); defaults to a fixed set")
+    args = parser.parse_args()
+
+    client, db = mongo_database(args.uri)
+    rows = []
+    try:
+        seed(db, args.employees, random.Random(0))
+        ensure_indexes(db, log=lambda *a, **k: None)
+        for query in args.query or QUERIES:
+            for label, criteria in (("regex", legacy_filter(query)), ("search_tokens", token_filter(query))):
+                total, _ = list_page(db, criteria)
+                timing = measure(lambda: list_page(db, criteria), repeat=args.repeat)
+                rows.append([query, label, total, docs_examined(db, criteria), timing["median_ms"], timing["min_ms"]])
+    finally:
+        drop_database(client, db)
+    print_table(["query", "filter", "matches", "docs examined", "median ms", "min ms"], rows)
+    print("regex matches substrings anywhere; search_tokens matches word prefixes, so match counts can differ.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# /root/EMS/benchmarks/request_compression.py
+"""
+Request body compression for activity batches: body size on the wire and the CPU it costs to encode
+(agent compress_body) and decode (server utils/compression.py decode_body, as the middleware runs it).
+
+    python benchmarks/request_compression.py --activities 100 1000 5000
+"""
+import argparse
+import io
+import json
+
+from _common import measure, print_table, synthetic_activities, use_agent, use_server
+
+# The agent and the server each have a top-level config module; the agent is imported first so
+# agent.py binds its own.
+use_agent()
+import agent # noqa: E402
+use_server()
+from utils import compression # noqa: E402
+
+ENCODINGS = ('identity', 'gzip', 'zstd')
+
+
+def bodies(activities):
+    payload = {"employee_id": "bench-emp", "activities": activities}
+    yield 'json', json.dumps(payload).encode('utf-8')
+    if agent.msgpack is not None:
+        yield 'msgpack', agent.encode_activity_batch(payload)
+
+
+def compress(raw, encoding):
+    """agent.compress_body with REQUEST_COMPRESSION set to encoding and no size threshold."""
+    saved = agent.config.REQUEST_COMPRESSION, agent.config.REQUEST_COMPRESSION_MIN_BYTES
+    agent.config.REQUEST_COMPRESSION, agent.config.REQUEST_COMPRESSION_MIN_BYTES = encoding, 0
+    try:
+        return agent.compress_body(raw)
+    finally:
+        agent.config.REQUEST_COMPRESSION, agent.config.REQUEST_COMPRESSION_MIN_BYTES = saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--activities', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = []
+    for count in args.activities:
+        for body_format, raw in bodies(synthetic_activities(count)):
+            for encoding in ENCODINGS:
+                if encoding == 'identity':
+                    rows.append([f"{count} {body_format}", encoding, len(raw), len(raw), "1.0x", "-", "-"])
+                    continue
+                if encoding == 'zstd' and agent.zstandard is None:
+                    continue
+                body, used = compress(raw, encoding)
+                assert used == encoding and compression.decode_body(io.BytesIO(body), used, len(raw)) == raw
+                encode = measure(lambda: compress(raw, encoding), repeat=args.repeat)
+                decode = measure(lambda: compression.decode_body(io.BytesIO(body), used, len(raw)), repeat=args.repeat)
+                rows.append([f"{count} {body_format}", encoding, len(raw), len(body), f"{len(raw) / len(body):.1f}x",
+                             encode["cpu_ms"], decode["cpu_ms"]])
+    print_table(["batch", "encoding", "raw bytes", "wire bytes", "ratio", "encode cpu ms", "decode cpu ms"], rows)
+    if agent.zstandard is None:
+        print("zstandard is not installed; zstd rows skipped.")
+
+
+if __name__ == '__main__':
+    main()
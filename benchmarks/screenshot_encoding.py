@@ -0,0 +1,88 @@
+# /root/EMS/benchmarks/screenshot_encoding.py
+"""
+Agent screenshot encoding: capture-to-bytes time and output size for each SCREENSHOT_FORMAT /
+SCREENSHOT_QUALITY / SCREENSHOT_MAX_DIMENSION setting, through agent.py encode_screenshot, plus the
+frame_dhash change check every capture runs. Frames are synthetic desktops unless --grab is given,
+which captures the real screen (ImageGrab) and adds the grab time.
+
+    python benchmarks/screenshot_encoding.py --size 1920x1080 --repeat 5
+"""
+import argparse
+import random
+import statistics
+import time
+
+from _common import print_table, synthetic_screenshot, use_agent
+
+use_agent()
+import agent # noqa: E402
+
+SETTINGS = [
+    # (format, quality, max_dimension)
+    ('png', None, None),
+    ('png', None, 1920),
+    ('jpeg', 70, None),
+    ('jpeg', 70, 1920),
+    ('jpeg', 50, 1280),
+    ('webp', 90, None),
+    ('webp', 70, None),
+    ('webp', 70, 1920),
+    ('webp', 50, 1280),
+]
+
+
+def frames(args, rng):
+    """Yields (image, grab_ms) pairs; grab_ms is None for synthetic frames."""
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    if not args.grab:
+        sources = [synthetic_screenshot(rng, (width, height)) for _ in range(args.frames)]
+        while True:
+            for image in sources:
+                yield image, None
+    while True:
+        started = time.perf_counter()
+        image, _ = agent.grab_screen()
+        if image is None:
+            raise SystemExit("Screen capture failed; run without --grab for synthetic frames.")
+        yield image, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', default='1920x1080', help="Synthetic frame size, e.g. 3840x1080 for two monitors")
+    parser.add_argument('--frames', type=int, default=3, help="Distinct synthetic frames to cycle through")
+    parser.add_argument('--repeat', type=int, default=5, help="Encodes per setting")
+    parser.add_argument('--grab', action='store_true', help="Capture the real screen instead of synthetic frames")
+    args = parser.parse_args()
+
+    source = frames(args, random.Random(0))
+    rows = []
+    for fmt, quality, max_dimension in SETTINGS:
+        timings, grabs, sizes = [], [], []
+        for _ in range(args.repeat):
+            image, grab_ms = next(source)
+            image = image.copy() # encode_screenshot downscales in place
+            started = time.perf_counter()
+            data = agent.encode_screenshot(image, fmt, quality=quality or 70, max_dimension=max_dimension)
+            timings.append((time.perf_counter() - started) * 1000)
+            sizes.append(len(data))
+            if grab_ms is not None:
+                grabs.append(grab_ms)
+        encode_ms = statistics.median(timings)
+        total_ms = encode_ms + statistics.median(grabs) if grabs else encode_ms
+        rows.append([fmt, quality if quality is not None else "-", max_dimension or "full",
+                     int(statistics.median(sizes)), encode_ms, total_ms])
+
+    hashes = []
+    for _ in range(args.repeat):
+        image, _ = next(source)
+        started = time.perf_counter()
+        agent.frame_dhash(image)
+        hashes.append((time.perf_counter() - started) * 1000)
+    print_table(["format", "quality", "max dimension", "bytes", "encode ms", "capture-to-bytes ms"], rows)
+    print(f"frame_dhash: {statistics.median(hashes):.2f} ms per frame"
+          + ("" if args.grab else " (synthetic frames: capture-to-bytes excludes the screen grab)"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# /root/EMS/benchmarks/screenshot_storage.py
+"""
+Screenshot storage tiers on synthetic desktop screenshots: the current layout (one lossless PNG per
+screenshot, content-addressed under UPLOAD_FOLDER) against the cold tier of models/screenshot_packs.py
+(transcode_image, one pack file per employee-day, read back through PackReader's memory maps).
+Reports bytes on disk, transcode time and per-image read latency.
+
+    python benchmarks/screenshot_storage.py --screenshots 60 --formats webp avif
+"""
+import argparse
+import datetime
+import hashlib
+import io
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from _common import percentile, print_table, synthetic_screenshot, use_server
+
+use_server()
+from models import screenshot_packs # noqa: E402
+
+
+def write_loose(upload_folder, image):
+    """Saves a PNG the way screenshot_store lays files out ('3f/a2/3fa2...png'). Returns the relative path."""
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    data = buffer.getvalue()
+    digest = hashlib.sha256(data).hexdigest()
+    relpath = f"{digest[:2]}/{digest[2:4]}/{digest}.png"
+    path = os.path.join(upload_folder, *relpath.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return relpath
+
+
+def read_latencies(reads):
+    """Calls each read once, in the given order. Returns per-read latencies in microseconds."""
+    latencies = []
+    for read in reads:
+        started = time.perf_counter()
+        read()
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return latencies
+
+
+def read_loose(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--screenshots', type=int, default=60, help="Screenshots in the employee-day")
+    parser.add_argument('--formats', nargs='+', default=['webp', 'avif'], choices=sorted(screenshot_packs.TIER_FORMATS))
+    parser.add_argument('--quality', type=int, default=80)
+    parser.add_argument('--reads', type=int, default=2000, help="Random reads per layout")
+    parser.add_argument('--workdir', help="Directory for the generated files (default: a temporary directory)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    workdir = tempfile.mkdtemp(prefix='ems_bench_', dir=args.workdir)
+    upload_folder = os.path.join(workdir, 'uploads')
+    try:
+        relpaths = [write_loose(upload_folder, synthetic_screenshot(rng)) for _ in range(args.screenshots)]
+        sources = [os.path.join(upload_folder, *p.split('/')) for p in relpaths]
+        original_bytes = sum(os.path.getsize(s) for s in sources)
+        picks = [rng.randrange(len(sources)) for _ in range(args.reads)]
+
+        loose = read_latencies([lambda s=sources[i]: read_loose(s) for i in picks])
+        rows = [["png (loose files)", len(sources), original_bytes, "1.0x", "-", statistics.median(loose), percentile(loose, 95)]]
+
+        for fmt in dict.fromkeys(screenshot_packs.resolve_format(f, log=print) for f in args.formats):
+            started = time.perf_counter()
+            encoded = [(p, screenshot_packs.transcode_image(s, fmt, args.quality), os.path.getsize(s))
+                       for p, s in zip(relpaths, sources)]
+            transcode_ms = (time.perf_counter() - started) * 1000 / len(encoded)
+            pack_folder = os.path.join(workdir, f'packs-{fmt}')
+            pack_relpath, entries = screenshot_packs._write_pack(pack_folder, 'bench-emp', datetime.datetime(2025, 3, 3), encoded)
+            pack_path = os.path.join(pack_folder, *pack_relpath.split('/'))
+            reader = screenshot_packs.PackReader()
+            packed = read_latencies([lambda e=entries[i]: reader.read(pack_path, e["offset"], e["length"]) for i in picks])
+            pack_bytes = os.path.getsize(pack_path)
+            rows.append([f"{fmt} (1 pack)", 1, pack_bytes, f"{original_bytes / pack_bytes:.1f}x", transcode_ms,
+                         statistics.median(packed), percentile(packed, 95)])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_table(["layout", "files", "bytes", "ratio", "transcode ms/img", "read median us", "read p95 us"], rows)
+    print("Reads hit the page cache for both layouts (the files were just written).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# /root/EMS/benchmarks/window_probe_ticks.py
+"""
+Per-tick cost of activity_monitor_worker's window sampling, with window_probe.py's ScriptedProbe
+standing in for the platform API. The old path resolved the owning process with psutil on every tick;
+WindowProbe.sample() asks for the pid only when the foreground window changes and resolves names
+through ProcessNameCache. Process lookups hit real processes (this one and its parent), so psutil
+costs are real; the foreground query itself is the fake backend's.
+
+    python benchmarks/window_probe_ticks.py --ticks 20000
+"""
+import argparse
+import os
+import time
+
+import psutil
+
+from _common import print_table, use_agent
+
+use_agent()
+from window_probe import ProcessNameCache, ScriptedProbe # noqa: E402
+
+
+def scenarios():
+    """name -> samples replayed one per tick: (handle, title, pid)."""
+    own, parent = os.getpid(), os.getppid()
+    return {
+        "steady window": [(101, "Q3 forecast v7 (final) - Excel", own)],
+        "browser tab changes": [(202, f"Tab {n % 12} - Google Chrome", own) for n in range(12)],
+        "alt-tab every 10 ticks": [(101, "Q3 forecast v7 (final) - Excel", own)] * 10 + [(303, "Inbox - Outlook", parent)] * 10,
+        "alt-tab every tick": [(101, "Q3 forecast v7 (final) - Excel", own), (303, "Inbox - Outlook", parent)],
+    }
+
+
+def legacy_tick(probe):
+    """agent.py get_active_window_info before the probe backends: a psutil lookup on every tick."""
+    handle, title = probe.foreground()
+    if not handle:
+        return "No Active Window", "System Desktop/Background"
+    pid = probe.window_pid(handle)
+    try:
+        return title or "No Title Window", psutil.Process(pid).name()
+    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+        return title or "No Title Window", f"Protected/Zombie Process (PID: {pid})"
+
+
+class CountingNames(ProcessNameCache):
+    def __init__(self):
+        super().__init__()
+        self.lookups = 0
+
+    def resolve(self, pid):
+        self.lookups += 1
+        return super().resolve(pid)
+
+
+def run(samples, ticks, legacy):
+    probe = ScriptedProbe(samples)
+    probe.names = names = CountingNames()
+    tick = (lambda: legacy_tick(probe)) if legacy else probe.sample
+    started = time.process_time()
+    for _ in range(ticks):
+        tick()
+    cpu_us = (time.process_time() - started) * 1e6 / ticks
+    # legacy_tick looks up every pid it is given; the cache still calls psutil (create_time) on each resolve
+    lookups = probe.pid_calls if legacy else names.lookups
+    return cpu_us, probe.foreground_calls / ticks, probe.pid_calls / ticks, lookups / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ticks', type=int, default=20000)
+    args = parser.parse_args()
+
+    rows = []
+    for name, samples in scenarios().items():
+        for label, legacy in (("psutil every tick", True), ("WindowProbe.sample", False)):
+            cpu_us, foreground, pid_queries, lookups = run(samples, args.ticks, legacy)
+            rows.append([name, label, cpu_us, foreground, pid_queries, lookups])
+    print_table(["scenario", "path", "cpu us/tick", "foreground/tick", "pid queries/tick", "psutil lookups/tick"], rows)
+
+
+if __name__ == '__main__':
+    main()
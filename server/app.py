@@ -1,9 +1,16 @@
 # /root/EMS/server/app.py  (or /opt/employee/EMS/server/app.py based on your logs)
 from flask import Flask, session, g, render_template, redirect, url_for, current_app, request # <-- ADD request HERE
 from config import Config
-from models.db import close_db, get_db
+from models.db import close_db, close_client, get_db, init_db
+from utils.ingest import activity_ingest
+from utils.compression import RequestDecompressionMiddleware
+from commands import register_commands
+from models.presence import presence
+from utils.cache import dashboard_cache, session_user_cache
+from utils.thumbnails import thumbnails
 import os
 import logging
+import atexit
 
 # Import Blueprints
 from routes.auth import auth_bp
@@ -16,6 +23,11 @@ from routes.settings import settings_bp
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    # Agents may send gzip/zstd request bodies; decode them before Flask parses the request.
+    app.wsgi_app = RequestDecompressionMiddleware(
+        app.wsgi_app, path_prefixes=('/api/',),
+        max_decoded_bytes=app.config.get('MAX_DECOMPRESSED_CONTENT_LENGTH') or app.config['MAX_CONTENT_LENGTH']
+    )
 
     try:
         os.makedirs(app.instance_path, exist_ok=True)
@@ -32,12 +44,19 @@ def create_app():
     def teardown_db(exception=None):
         close_db(exception)
 
-    with app.app_context():
-        try:
-            get_db()
-            app.logger.info("Database check/initialization completed during app startup.")
-        except Exception as e:
-            app.logger.critical(f"FATAL: Could not initialize database connection during startup: {e}")
+    try:
+        init_db(app)
+        app.logger.info("Database check/initialization completed during app startup.")
+    except Exception as e:
+        app.logger.critical(f"FATAL: Could not initialize database connection during startup: {e}")
+    atexit.register(close_client)
+    # Registered after close_client so the atexit drain runs while the client is still open.
+    activity_ingest.init_app(app)
+    presence.init_app(app)
+    dashboard_cache.init_app(app)
+    session_user_cache.init_app(app)
+    thumbnails.init_app(app)
+    atexit.register(thumbnails.shutdown)
 
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(dashboard_bp)
@@ -45,6 +64,7 @@ def create_app():
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(reports_bp, url_prefix='/reports')
     app.register_blueprint(settings_bp, url_prefix='/settings')
+    register_commands(app)
 
     @app.route('/')
     def index():
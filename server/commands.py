@@ -0,0 +1,203 @@
+# /root/EMS/server/commands.py
+import datetime
+
+import click
+
+from models.db import get_db
+
+
+def _parse_day(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+
+
+def register_commands(app):
+    """Maintenance commands, run with `flask --app app <command>` from the server directory."""
+
+    @app.cli.command('backfill-rollups')
+    @click.option('--start', 'start_str', help="First day to rebuild (YYYY-MM-DD). Defaults to the oldest activity log.")
+    @click.option('--end', 'end_str', help="Day to stop before (YYYY-MM-DD, exclusive). Defaults to the end of the current hour.")
+    def backfill_rollups(start_str, end_str):
+        """Builds the hourly activity rollups from existing activity_logs, one day at a time."""
+        from models.rollups import rebuild_rollups
+        from utils.cache import dashboard_cache
+        db = get_db()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if start_str:
+            start = _parse_day(start_str)
+        else:
+            oldest = db.activity_logs.find_one({"log_type": "activity"}, {"timestamp": 1}, sort=[("timestamp", 1)])
+            if not oldest:
+                click.echo("No activity logs found; nothing to backfill.")
+                return
+            start = oldest["timestamp"].replace(tzinfo=datetime.timezone.utc, hour=0, minute=0, second=0, microsecond=0)
+        end = _parse_day(end_str) if end_str else now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+
+        day = start
+        total = 0
+        while day < end:
+            day_end = min(day + datetime.timedelta(days=1), end)
+            written = rebuild_rollups(db, day, day_end)
+            total += written
+            click.echo(f"{day.strftime('%Y-%m-%d')}: {written} rollup document(s)")
+            day = day_end
+        # Reaches the workers with DASHBOARD_CACHE_BACKEND='shared'; 'memory' caches expire past ranges on their own
+        dashboard_cache.invalidate_all()
+        click.echo(f"Done. {total} rollup document(s) written for {start.isoformat()} .. {end.isoformat()}.")
+
+    @app.cli.command('cache-server')
+    @click.option('--address', default=None, help="host:port to listen on. Defaults to DASHBOARD_CACHE_ADDRESS.")
+    @click.option('--max-entries', default=4096, show_default=True, type=int)
+    def cache_server(address, max_entries):
+        """Runs the shared dashboard cache used when DASHBOARD_CACHE_BACKEND='shared'."""
+        from utils.cache import serve_cache, parse_address
+        address = parse_address(address or app.config['DASHBOARD_CACHE_ADDRESS'])
+        click.echo(f"Shared dashboard cache listening on {address[0]}:{address[1]} ({max_entries} entries).")
+        serve_cache(address, app.config['SECRET_KEY'].encode('utf-8'), max_entries=max_entries)
+
+    @app.cli.command('backfill-search-tokens')
+    def backfill_search_tokens_command():
+        """Computes the users-list search tokens for employees created before search_tokens existed."""
+        from models.search import backfill_search_tokens
+        updated = backfill_search_tokens(get_db())
+        click.echo(f"Done. {updated} employee(s) updated.")
+
+    @app.cli.command('migrate-screenshots')
+    @click.option('--dry-run', is_flag=True, help="Only count the flat files that would be moved.")
+    def migrate_screenshots(dry_run):
+        """Moves screenshots from the flat UPLOAD_FOLDER into the sharded, content-addressed store."""
+        from models.screenshot_store import migrate_flat_folder
+        summary = migrate_flat_folder(get_db(), app.config['UPLOAD_FOLDER'], dry_run=dry_run, log=click.echo)
+        click.echo(f"{'Would migrate' if dry_run else 'Migrated'} {summary['migrated']} file(s); "
+                   f"{summary['deduplicated']} duplicate(s), {summary['bytes_freed']} bytes freed, "
+                   f"{summary['orphans']} unreferenced file(s) left in place.")
+
+    @app.cli.command('backfill-thumbnails')
+    @click.option('--start', 'start_str', help="Only screenshots from this day on (YYYY-MM-DD).")
+    @click.option('--batch', default=200, show_default=True, type=int, help="Screenshots queued per batch.")
+    def backfill_thumbnails(start_str, batch):
+        """Renders missing report thumbnails for existing screenshots on the thumbnail process pool."""
+        from utils.thumbnails import thumbnails
+        if not thumbnails.enabled:
+            raise SystemExit("Pillow is not installed; thumbnails are disabled.")
+        query = {"log_type": "screenshot", "screenshot_path": {"$exists": True}}
+        if start_str:
+            query["timestamp"] = {"$gte": _parse_day(start_str)}
+        rendered = failed = 0
+        futures = []
+        seen = set() # Deduplicated screenshots share one file (and one thumbnail)
+
+        def drain():
+            nonlocal rendered, failed
+            for future in futures:
+                try:
+                    rendered += future.result() is not None
+                except Exception as e:
+                    failed += 1
+                    click.echo(f"Failed: {e}")
+            futures.clear()
+
+        for doc in get_db().activity_logs.find(query, {"screenshot_path": 1, "_id": 0}).batch_size(1000):
+            path = doc["screenshot_path"]
+            if path in seen:
+                continue
+            seen.add(path)
+            future = thumbnails.enqueue(path)
+            if future is not None:
+                futures.append(future)
+            if len(futures) >= batch:
+                drain()
+                click.echo(f"{rendered} thumbnail(s) rendered so far...")
+        drain()
+        thumbnails.shutdown()
+        click.echo(f"Done. {rendered} thumbnail(s) rendered, {failed} failed.")
+
+    @app.cli.command('purge-stale-uploads')
+    @click.option('--hours', default=None, type=int, help="Age in hours. Defaults to STALE_UPLOAD_HOURS.")
+    def purge_stale_uploads_command(hours):
+        """Removes chunked screenshot uploads (and their part files) abandoned by agents."""
+        from models.screenshot_store import purge_stale_uploads
+        hours = hours or app.config.get('STALE_UPLOAD_HOURS', 24)
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=hours)
+        removed = purge_stale_uploads(get_db(), app.config['UPLOAD_FOLDER'], cutoff)
+        click.echo(f"Removed {removed} upload(s) idle for more than {hours}h.")
+
+    @app.cli.command('tier-screenshots')
+    @click.option('--older-than-days', default=None, type=int, help="Defaults to SCREENSHOT_TIER_AFTER_DAYS.")
+    @click.option('--format', 'fmt', default=None, type=click.Choice(['webp', 'avif']), help="Defaults to SCREENSHOT_TIER_FORMAT.")
+    @click.option('--workers', default=2, show_default=True, type=int, help="Transcoding processes.")
+    def tier_screenshots_command(older_than_days, fmt, workers):
+        """Re-encodes aging screenshots and packs them into one archive per employee-day."""
+        from models.screenshot_packs import tier_screenshots
+        from utils.thumbnails import thumbnails
+        total = tier_screenshots(
+            get_db(), app.config['UPLOAD_FOLDER'], app.config['PACK_FOLDER'],
+            older_than_days if older_than_days is not None else app.config['SCREENSHOT_TIER_AFTER_DAYS'],
+            fmt=fmt or app.config['SCREENSHOT_TIER_FORMAT'], quality=app.config['SCREENSHOT_TIER_QUALITY'],
+            workers=workers, thumbnails=thumbnails if thumbnails.enabled else None, log=click.echo
+        )
+        thumbnails.shutdown()
+        ratio = f"{total['bytes_before'] / total['bytes_after']:.2f}x" if total['bytes_after'] else "n/a"
+        click.echo(f"Done. {total['screenshots']} screenshot(s) in {total['packs']} pack(s); "
+                   f"{total['bytes_before']} -> {total['bytes_after']} bytes ({ratio}).")
+
+    @app.cli.command('screenshot-storage-report')
+    @click.option('--samples', default=50, show_default=True, type=int)
+    def screenshot_storage_report(samples):
+        """Compression ratio of the packed tier and sampled read latency, loose files vs. packs."""
+        from models.screenshot_packs import storage_report
+        report = storage_report(get_db(), app.config['UPLOAD_FOLDER'], app.config['PACK_FOLDER'], samples=samples)
+        for key, value in report.items():
+            click.echo(f"{key}: {value if value is not None else 'n/a'}")
+
+    @app.cli.command('migrate-indexes')
+    @click.option('--dry-run', is_flag=True, help="Only list the indexes that would be built.")
+    def migrate_indexes(dry_run):
+        """Builds the indexes declared in models/indexes.py that are missing from the database."""
+        from models.indexes import missing_indexes, unregistered_indexes, obsolete_indexes, ensure_indexes
+        from models.search import backfill_search_tokens
+        db = get_db()
+        missing = missing_indexes(db)
+        obsolete = obsolete_indexes(db)
+        if not missing:
+            click.echo("All registered indexes exist.")
+        for coll, name, spec in obsolete:
+            click.echo(f"Obsolete: {coll}.{name} - {spec.reason}")
+        for coll, specs in missing.items():
+            for spec in specs:
+                click.echo(f"Missing: {coll} {spec.keys} {spec.options or ''} - {spec.reason}")
+        if (missing or obsolete) and not dry_run:
+            created = ensure_indexes(db, background=True, log=click.echo)
+            click.echo(f"Done. {len(created)} index(es) built.")
+        if not dry_run:
+            # The search_tokens index answers the users-list search only for employees that have tokens
+            backfilled = backfill_search_tokens(db, missing_only=True)
+            if backfilled:
+                click.echo(f"Computed search tokens for {backfilled} employee(s).")
+        for coll, name in unregistered_indexes(db):
+            click.echo(f"Not in registry (review and drop manually if unused): {coll}.{name}")
+
+    @app.cli.command('check-query-plans')
+    @click.option('--employee-id', default=None, help="Employee to use in per-employee queries. Defaults to the first one found.")
+    @click.option('--max-ratio', default=10, show_default=True, type=int, help="Max keys/docs examined per returned document.")
+    @click.option('--min-examined', default=1000, show_default=True, type=int, help="Ignore the ratio below this many examined keys/docs.")
+    def check_query_plans_command(employee_id, max_ratio, min_examined):
+        """Explains every route query shape and exits non-zero on a COLLSCAN or an excessive scan ratio."""
+        from models.indexes import check_query_plans
+        db = get_db()
+        if not employee_id:
+            employee = db.employees.find_one({}, {"employee_id": 1})
+            employee_id = employee["employee_id"] if employee else "probe-employee"
+        screenshot = db.activity_logs.find_one({"employee_id": employee_id, "log_type": "screenshot", "screenshot_path": {"$exists": True}},
+                                              {"screenshot_path": 1})
+        results = check_query_plans(db, employee_id, screenshot.get("screenshot_path") if screenshot else None,
+                                    max_ratio=max_ratio, min_examined=min_examined)
+        failures = 0
+        for name, result, problem in results:
+            status = "FAIL" if problem else "ok"
+            click.echo(f"[{status:4}] {name}: {'/'.join(result['stages']) or '-'} "
+                       f"keys={result['keys_examined']} docs={result['docs_examined']} returned={result['returned']}"
+                       + (f" ({problem})" if problem else ""))
+            failures += bool(problem)
+        if failures:
+            raise SystemExit(f"{failures} query shape(s) failed the plan check.")
+        click.echo("All query shapes use indexes.")
@@ -29,12 +29,97 @@ class Config:
          MONGO_URI = f"mongodb://{MONGO_HOSTNAME}:{MONGO_PORT}/{MONGO_DB_NAME}"
     # --- END UPDATED SECTION ---
 
+    # MongoDB connection pool (one MongoClient per process)
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE') or 100)
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE') or 0)
+    MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS') or 60000)
+    MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS') or 5000)
+    MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS') or 30000)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS') or 5000)
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS') or 5000)
+
     # Agent Config
     AGENT_API_KEY = os.environ.get('AGENT_API_KEY')
 
+    # Activity ingest (write-behind queue for /api/log/activity)
+    # INGEST_DURABILITY: 'flushed' (ack once written), 'queued' (ack once queued), 'sync' (insert inside the request).
+    # Acknowledged batches whose flush gives up are spilled to INGEST_SPILL_FOLDER and replayed every
+    # INGEST_SPILL_RETRY_SECONDS; 'queued' still loses whatever is in memory if a worker is killed.
+    INGEST_DURABILITY = os.environ.get('INGEST_DURABILITY') or 'flushed'
+    INGEST_SPILL_FOLDER = os.environ.get('INGEST_SPILL_FOLDER') or os.path.join(basedir, 'uploads', 'ingest_spill')
+    INGEST_SPILL_RETRY_SECONDS = float(os.environ.get('INGEST_SPILL_RETRY_SECONDS') or 60)
+    INGEST_QUEUE_MAX_BATCHES = int(os.environ.get('INGEST_QUEUE_MAX_BATCHES') or 10000)
+    INGEST_FLUSH_MAX_DOCS = int(os.environ.get('INGEST_FLUSH_MAX_DOCS') or 5000)
+    INGEST_FLUSH_INTERVAL_SECONDS = float(os.environ.get('INGEST_FLUSH_INTERVAL_SECONDS') or 1.0)
+    INGEST_FLUSHER_THREADS = int(os.environ.get('INGEST_FLUSHER_THREADS') or 2)
+    INGEST_FLUSH_RETRIES = int(os.environ.get('INGEST_FLUSH_RETRIES') or 3)
+    INGEST_FLUSH_WAIT_TIMEOUT_SECONDS = float(os.environ.get('INGEST_FLUSH_WAIT_TIMEOUT_SECONDS') or 10)
+
+    # Presence tracking (last_seen/hostname buffered in memory, flushed in bulk)
+    PRESENCE_FLUSH_INTERVAL_SECONDS = float(os.environ.get('PRESENCE_FLUSH_INTERVAL_SECONDS') or 15)
+    ACTIVE_EMPLOYEE_THRESHOLD_MINUTES = int(os.environ.get('ACTIVE_EMPLOYEE_THRESHOLD_MINUTES') or 5)
+
+    # Dashboard reads working time / top apps / work hours from the hourly rollups
+    # (run 'flask backfill-rollups' once after enabling on a database with existing activity)
+    DASHBOARD_USE_ROLLUPS = (os.environ.get('DASHBOARD_USE_ROLLUPS') or 'true').lower() in ('1', 'true', 'yes')
+
+    # Threads shared by the dashboard's independent queries (panels and employee lookups run concurrently)
+    # Keep below MONGO_MAX_POOL_SIZE so concurrent dashboards don't starve ingest of connections
+    DASHBOARD_QUERY_THREADS = int(os.environ.get('DASHBOARD_QUERY_THREADS') or 8)
+
+    # Dashboard panel cache: 'memory' (per-process LRU), 'shared' (run 'flask cache-server') or 'none'
+    DASHBOARD_CACHE_BACKEND = os.environ.get('DASHBOARD_CACHE_BACKEND') or 'memory'
+    DASHBOARD_CACHE_ADDRESS = os.environ.get('DASHBOARD_CACHE_ADDRESS') or '127.0.0.1:6399'
+    DASHBOARD_CACHE_MAX_ENTRIES = int(os.environ.get('DASHBOARD_CACHE_MAX_ENTRIES') or 1024)
+    DASHBOARD_CACHE_TODAY_TTL_SECONDS = int(os.environ.get('DASHBOARD_CACHE_TODAY_TTL_SECONDS') or 60)
+    # Past ranges are also dropped when past-dated activity is written; this bounds what another process's cache keeps
+    DASHBOARD_CACHE_PAST_TTL_SECONDS = int(os.environ.get('DASHBOARD_CACHE_PAST_TTL_SECONDS') or 3600)
+
+    # login_required caches the admin's user document per process for this long (0 disables).
+    # Password changes invalidate immediately on the worker that handled them; other workers within the TTL.
+    SESSION_USER_CACHE_TTL_SECONDS = int(os.environ.get('SESSION_USER_CACHE_TTL_SECONDS') or 30)
+    SESSION_USER_CACHE_MAX_ENTRIES = int(os.environ.get('SESSION_USER_CACHE_MAX_ENTRIES') or 256)
+
+    # Report totals are only counted when asked for ('Show total'), then cached for this long
+    REPORT_COUNT_CACHE_TTL_SECONDS = int(os.environ.get('REPORT_COUNT_CACHE_TTL_SECONDS') or 300)
+
+    # Activity export (/reports/activity_log/export): cursor batch size and gzip level when gzip=1 is requested
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE') or 2000)
+    EXPORT_GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL') or 6)
+
     # Uploads folder
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads', 'screenshots')
+    # Report grid previews (utils/thumbnails.py), rendered on a process pool after each upload
+    THUMBNAIL_FOLDER = os.environ.get('THUMBNAIL_FOLDER') or os.path.join(basedir, 'uploads', 'thumbnails')
+    THUMBNAIL_FORMAT = os.environ.get('THUMBNAIL_FORMAT') or 'webp' # 'webp' or 'jpeg'
+    THUMBNAIL_MAX_SIZE = int(os.environ.get('THUMBNAIL_MAX_SIZE') or 320)
+    THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY') or 70)
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS') or 2)
+    THUMBNAIL_WAIT_SECONDS = float(os.environ.get('THUMBNAIL_WAIT_SECONDS') or 5)
+
+    # Cold tier (models/screenshot_packs.py): 'flask tier-screenshots' re-encodes screenshots older than
+    # SCREENSHOT_TIER_AFTER_DAYS and packs them per employee-day under PACK_FOLDER
+    PACK_FOLDER = os.environ.get('PACK_FOLDER') or os.path.join(basedir, 'uploads', 'packs')
+    SCREENSHOT_TIER_AFTER_DAYS = int(os.environ.get('SCREENSHOT_TIER_AFTER_DAYS') or 30)
+    SCREENSHOT_TIER_FORMAT = os.environ.get('SCREENSHOT_TIER_FORMAT') or 'webp' # 'webp' or 'avif'
+    SCREENSHOT_TIER_QUALITY = int(os.environ.get('SCREENSHOT_TIER_QUALITY') or 80)
+
+    # Screenshot/thumbnail serving. Files are immutable, so browsers cache them for a year (ETag revalidation).
+    # Set the *_ACCEL_REDIRECT_PREFIX values to an nginx 'internal' location aliased to UPLOAD_FOLDER /
+    # THUMBNAIL_FOLDER to let nginx send the bytes; or set USE_X_SENDFILE for Apache/lighttpd.
+    SCREENSHOT_CACHE_MAX_AGE = int(os.environ.get('SCREENSHOT_CACHE_MAX_AGE') or 31536000)
+    SCREENSHOT_ACCEL_REDIRECT_PREFIX = os.environ.get('SCREENSHOT_ACCEL_REDIRECT_PREFIX') # e.g. '/protected/screenshots'
+    THUMBNAIL_ACCEL_REDIRECT_PREFIX = os.environ.get('THUMBNAIL_ACCEL_REDIRECT_PREFIX') # e.g. '/protected/thumbnails'
+    USE_X_SENDFILE = (os.environ.get('USE_X_SENDFILE') or 'false').lower() in ('1', 'true', 'yes')
+    # Screenshot paths already authorized against activity_logs are remembered this long per process
+    SCREENSHOT_AUTH_CACHE_TTL_SECONDS = int(os.environ.get('SCREENSHOT_AUTH_CACHE_TTL_SECONDS') or 600)
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024 # Example: 16MB limit for uploads
+    # Chunked screenshot uploads: per-PUT chunk limit and total declared size limit
+    SCREENSHOT_UPLOAD_CHUNK_BYTES = int(os.environ.get('SCREENSHOT_UPLOAD_CHUNK_BYTES') or 1024 * 1024)
+    MAX_SCREENSHOT_UPLOAD_BYTES = int(os.environ.get('MAX_SCREENSHOT_UPLOAD_BYTES') or 64 * 1024 * 1024)
+    STALE_UPLOAD_HOURS = int(os.environ.get('STALE_UPLOAD_HOURS') or 24)
+    # Upper bound for a gzip/zstd-encoded agent request body after decoding (decompression bomb guard)
+    MAX_DECOMPRESSED_CONTENT_LENGTH = int(os.environ.get('MAX_DECOMPRESSED_CONTENT_LENGTH') or MAX_CONTENT_LENGTH)
 
     # Create upload folder if it doesn't exist
     if not os.path.exists(UPLOAD_FOLDER):
@@ -0,0 +1,96 @@
+# /root/EMS/server/models/dashboard_queries.py
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared pool for independent dashboard queries. pymongo's Database/Collection objects are
+# thread-safe and each query borrows its own socket from the client pool.
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+    global _executor, _executor_pid
+    if _executor is not None and _executor_pid == os.getpid():
+        return _executor
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="DashboardQuery")
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run_concurrently(tasks, logger, label="Dashboard", max_workers=8):
+    """
+    Runs independent queries ({name: callable}) on the shared pool and waits for all of them.
+    Returns {name: result}; a failed query maps to its exception so callers can fall back per panel.
+    Per-panel timings are logged in one line.
+    """
+    executor = _get_executor(max_workers)
+    started = time.perf_counter()
+    futures = {name: executor.submit(_timed, fn) for name, fn in tasks.items()}
+    results, timings = {}, []
+    for name, future in futures.items():
+        try:
+            results[name], elapsed_ms = future.result()
+            timings.append(f"{name}={elapsed_ms:.1f}ms")
+        except Exception as e:
+            results[name] = e
+            timings.append(f"{name}=error")
+            logger.error(f"{label} query '{name}' failed: {e}")
+    wall_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"{label} queries finished in {wall_ms:.1f}ms wall ({', '.join(timings)})")
+    return results
+
+
+def activity_facet_pipeline(start_date, end_date, employee_id=None):
+    """
+    Working time, Top 5 and work hours share the same $match over activity_logs,
+    so they run as one aggregation with a $facet per panel.
+    """
+    # Idle spans (is_active False, recorded by the agent's idle detector) don't count as working time
+    match = {"timestamp": {"$gte": start_date, "$lte": end_date}, "duration_seconds": {"$exists": True, "$gt": 0},
+             "is_active": {"$ne": False}}
+    if employee_id:
+        match["employee_id"] = employee_id
+    return [
+        {"$match": match},
+        {"$facet": {
+            "working_time": [
+                {"$group": {"_id": None, "total_duration": {"$sum": "$duration_seconds"}}}
+            ],
+            "top_sites": [
+                {"$match": {"$or": [{"window_title": {"$exists": True, "$ne": ""}}, {"process_name": {"$exists": True, "$ne": ""}}]}},
+                {"$project": {"activity_name": {"$ifNull": ["$window_title", "$process_name"]}, "duration_seconds": 1}},
+                {"$group": {"_id": "$activity_name", "total_duration": {"$sum": "$duration_seconds"}}},
+                {"$sort": {"total_duration": -1}}, {"$limit": 5}
+            ],
+            "work_hours": [
+                {"$group": {"_id": "$employee_id", "total_seconds": {"$sum": "$duration_seconds"}, "unique_days": {"$addToSet": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp", "timezone": "UTC"}}}}},
+                {"$lookup": {"from": "employees", "localField": "_id", "foreignField": "employee_id", "as": "employee_info"}},
+                {"$unwind": {"path": "$employee_info", "preserveNullAndEmptyArrays": True}},
+                {"$project": {"_id": 0, "employee_id": "$_id", "display_name": "$employee_info.display_name", "total_seconds": 1, "man_days": {"$size": "$unique_days"}}},
+                {"$sort": {"display_name": 1}}
+            ],
+        }}
+    ]
+
+
+def avg_start_pipeline(start_date, end_date, employee_id=None):
+    avg_start_match = {"start_time": {"$gte": start_date, "$lte": end_date}, "is_active": {"$ne": False}} # Filter by activity start time
+    if employee_id:
+        avg_start_match["employee_id"] = employee_id
+    return [
+        {"$match": avg_start_match},
+        {"$group": {"_id": {"employee_id": "$employee_id", "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$start_time", "timezone": "UTC"}}}, "first_activity_time": {"$min": "$start_time"}}},
+        {"$project": {"_id": 0, "start_hour": {"$hour": {"date": "$first_activity_time", "timezone": "UTC"}}, "start_minute": {"$minute": {"date": "$first_activity_time", "timezone": "UTC"}}}},
+        {"$group": {"_id": None, "avg_hour": {"$avg": "$start_hour"}, "avg_minute": {"$avg": "$start_minute"}}}
+    ]
@@ -3,38 +3,82 @@ from pymongo.errors import ConnectionFailure
 from flask import current_app, g
 import bcrypt # For password hashing
 import datetime
+import os
+import threading
+
+from models.indexes import ensure_indexes
+from models.search import backfill_search_tokens, search_tokens
+
+# One pooled MongoClient per process. MongoClient is thread-safe and keeps its own
+# connection pool, so requests only borrow a socket instead of opening a connection.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_schema_initialized = False
+
+def get_client(app=None):
+    """Returns the process-wide MongoClient, creating it on first use (or after a fork)."""
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    app = app or current_app
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            # A client inherited across fork() must not be reused by the child; build a fresh one.
+            cfg = app.config
+            _client = MongoClient(
+                cfg['MONGO_URI'],
+                maxPoolSize=cfg.get('MONGO_MAX_POOL_SIZE', 100),
+                minPoolSize=cfg.get('MONGO_MIN_POOL_SIZE', 0),
+                maxIdleTimeMS=cfg.get('MONGO_MAX_IDLE_TIME_MS', 60000),
+                connectTimeoutMS=cfg.get('MONGO_CONNECT_TIMEOUT_MS', 5000),
+                socketTimeoutMS=cfg.get('MONGO_SOCKET_TIMEOUT_MS', 30000),
+                serverSelectionTimeoutMS=cfg.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+                waitQueueTimeoutMS=cfg.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000),
+            )
+            _client_pid = os.getpid()
+            app.logger.info(f"Created pooled MongoClient for pid {_client_pid} (maxPoolSize={cfg.get('MONGO_MAX_POOL_SIZE', 100)}).")
+    return _client
+
+def init_db(app):
+    """Connects once at startup and runs the schema/index bootstrap. Safe to call more than once."""
+    global _schema_initialized
+    if _schema_initialized:
+        return
+    client = get_client(app)
+    try:
+        # The ping command is cheap and does not require auth.
+        client.admin.command('ping')
+    except ConnectionFailure as e:
+        app.logger.error(f"Could not connect to MongoDB: {e}")
+        raise ConnectionFailure(f"Could not connect to MongoDB: {e}")
+    with _client_lock:
+        if not _schema_initialized:
+            initialize_db(client[app.config['MONGO_DB_NAME']])
+            _schema_initialized = True
+    app.logger.info(f"Successfully connected to MongoDB: {app.config['MONGO_DB_NAME']}")
 
 def get_db():
-    """Opens a new database connection if there is none yet for the current application context."""
+    """Returns a database handle on the pooled client for the current application context."""
     if 'db' not in g:
-        try:
-            client = MongoClient(
-                current_app.config['MONGO_URI'],
-                serverSelectionTimeoutMS=5000 # 5 second timeout
-            )
-            # The ismaster command is cheap and does not require auth.
-            client.admin.command('ismaster')
-            g.db = client[current_app.config['MONGO_DB_NAME']]
-            print(f"Successfully connected to MongoDB: {current_app.config['MONGO_DB_NAME']}")
-            # --- Database and Collection Check/Creation ---
-            initialize_db(g.db)
-            # --- End Check/Creation ---
-        except ConnectionFailure as e:
-            print(f"Could not connect to MongoDB: {e}")
-            # Decide how to handle connection failure (e.g., raise error, return None)
-            # For now, let's raise it so the app fails visibly during development
-            raise ConnectionFailure(f"Could not connect to MongoDB: {e}")
-        except Exception as e:
-            print(f"An error occurred during DB connection: {e}")
-            raise e
+        if not _schema_initialized:
+            # Startup bootstrap failed (e.g. Mongo was down); retry it once the server is reachable.
+            init_db(current_app._get_current_object())
+        g.db = get_client()[current_app.config['MONGO_DB_NAME']]
     return g.db
 
 def close_db(e=None):
-    """Closes the database connection at the end of the request."""
-    db_client = g.pop('db_client', None) # Assuming client stored in g.db_client if needed
-    if db_client is not None:
-        db_client.close()
-        print("MongoDB connection closed.")
+    """Drops the per-context handle. The pooled client stays open for the next request."""
+    g.pop('db', None)
+
+def close_client():
+    """Closes the process-wide client (called at interpreter exit)."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
 
 def initialize_db(db):
     """Check if essential collections exist and create an initial admin user if needed."""
@@ -49,14 +93,15 @@ def initialize_db(db):
                 # Create a default admin user if the users collection was just created
                 print("Users collection created. Creating default admin user...")
                 create_default_admin(db)
-            if coll == 'employees':
-                 # Index employee ID for faster lookups
-                db.employees.create_index("employee_id", unique=True)
-                print("Created index on employees.employee_id")
 
 
-    # Optionally add indexes here
-    db.activity_logs.create_index([("employee_id", 1), ("timestamp", -1)])
+    # Indexes are declared in models/indexes.py; only missing ones are built.
+    # On large existing collections run `flask migrate-indexes` before deploying instead.
+    ensure_indexes(db)
+    # Employees created before search_tokens existed aren't found by the users-list search until they have them
+    backfilled = backfill_search_tokens(db, missing_only=True)
+    if backfilled:
+        print(f"Computed search tokens for {backfilled} employee(s).")
     print("Checked/Created essential DB collections and indexes.")
 
 
@@ -77,25 +122,35 @@ def create_default_admin(db):
         print("Admin user already exists.")
 
 # --- User Helper Functions ---
+def get_or_create_employee(db, employee_id, initial_name=None):
+    """
+    Fetches an employee, creating the record if the agent is new.
+    New agents cost one upsert; existing ones one upsert (no-op) plus a find_one.
+    Returns (employee_doc, created).
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    display_name = initial_name or f"New User ({employee_id})" # Default name
+    employee_data = {
+        "employee_id": employee_id,
+        "display_name": display_name,
+        "search_tokens": search_tokens(display_name, employee_id), # users list search (models/search.py)
+        "status": "pending_rename", # Flag for admin
+        "first_seen": now,
+        "last_seen": now,
+        # Add other fields like 'team', 'department' etc. later
+    }
+    result = db.employees.update_one({"employee_id": employee_id}, {"$setOnInsert": employee_data}, upsert=True)
+    if result.upserted_id is not None:
+        return {"_id": result.upserted_id, **employee_data}, True
+    employee = db.employees.find_one(
+        {"employee_id": employee_id},
+        {"_id": 1, "employee_id": 1, "display_name": 1, "status": 1, "last_seen": 1}
+    )
+    return employee, False
+
 def create_employee(db, employee_id, initial_name=None):
-    """Creates a new employee record when an agent first connects."""
-    if not db.employees.find_one({"employee_id": employee_id}):
-        employee_data = {
-            "employee_id": employee_id,
-            "display_name": initial_name or f"New User ({employee_id})", # Default name
-            "status": "pending_rename", # Flag for admin
-            "first_seen": datetime.datetime.now(datetime.timezone.utc),
-            "last_seen": datetime.datetime.now(datetime.timezone.utc),
-            # Add other fields like 'team', 'department' etc. later
-        }
-        result = db.employees.insert_one(employee_data)
+    """Creates a new employee record when an agent first connects. last_seen is maintained by models.presence."""
+    employee, created = get_or_create_employee(db, employee_id, initial_name=initial_name)
+    if created:
         print(f"Created new employee record for {employee_id}")
-        return result.inserted_id
-    else:
-        # Update last seen if employee already exists
-        db.employees.update_one(
-            {"employee_id": employee_id},
-            {"$set": {"last_seen": datetime.datetime.now(datetime.timezone.utc)}}
-        )
-        print(f"Employee {employee_id} already exists, updated last_seen.")
-        return db.employees.find_one({"employee_id": employee_id})['_id']
\ No newline at end of file
+    return employee["_id"]
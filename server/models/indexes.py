@@ -0,0 +1,248 @@
+# /root/EMS/server/models/indexes.py
+import datetime
+from collections import namedtuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+# Every index the application relies on, with the query shape that needs it.
+# initialize_db() and `flask migrate-indexes` build whatever is missing; `flask check-query-plans`
+# explains the shapes in QUERY_SHAPES against the live database and fails on collection scans.
+IndexSpec = namedtuple('IndexSpec', ['collection', 'keys', 'options', 'reason'])
+
+INDEXES = [
+    # employees
+    IndexSpec('employees', [("employee_id", ASCENDING)], {"unique": True},
+              "agent upserts, login pending-rename check, edit_user"),
+    IndexSpec('employees', [("status", ASCENDING), ("display_name", ASCENDING)], {},
+              "users list sort, pending_rename / tracked counts"),
+    IndexSpec('employees', [("display_name", ASCENDING)], {},
+              "employee filter dropdowns (dashboard, reports)"),
+    IndexSpec('employees', [("search_tokens", ASCENDING), ("status", ASCENDING), ("display_name", ASCENDING)], {},
+              "users list search and its count (models/search.py)"),
+    IndexSpec('employees', [("last_seen", DESCENDING)], {},
+              "dashboard latest seen, presence active snapshot"),
+    # users
+    IndexSpec('users', [("username", ASCENDING)], {"unique": True}, "login"),
+    # activity_logs
+    IndexSpec('activity_logs', [("employee_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {},
+              "activity log report keyset pages, per-employee dashboard aggregations"),
+    IndexSpec('activity_logs', [("employee_id", ASCENDING), ("log_type", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {},
+              "screenshot report keyset pages"),
+    IndexSpec('activity_logs', [("timestamp", DESCENDING)], {},
+              "team-wide dashboard aggregations on raw logs (non hour-aligned ranges)"),
+    IndexSpec('activity_logs', [("log_type", ASCENDING), ("timestamp", ASCENDING)], {},
+              "backfill-rollups oldest activity lookup and rebuild ranges"),
+    IndexSpec('activity_logs', [("start_time", ASCENDING)], {},
+              "dashboard average start time (all employees)"),
+    IndexSpec('activity_logs', [("employee_id", ASCENDING), ("start_time", ASCENDING)], {},
+              "dashboard average start time (one employee)"),
+    IndexSpec('activity_logs', [("screenshot_path", ASCENDING)], {"sparse": True},
+              "view_screenshot authorization lookup"),
+    # activity_rollups_hourly (models/rollups.py)
+    IndexSpec('activity_rollups_hourly', [("employee_id", ASCENDING), ("hour", ASCENDING), ("bucket", ASCENDING)], {"unique": True},
+              "rollup $inc upserts / $merge key, per-employee dashboard ranges"),
+    IndexSpec('activity_rollups_hourly', [("hour", ASCENDING)], {},
+              "team-wide dashboard ranges"),
+    # screenshot_uploads (models/screenshot_store.py chunked uploads)
+    IndexSpec('screenshot_uploads', [("employee_id", ASCENDING), ("sha256", ASCENDING), ("timestamp", ASCENDING)], {"unique": True},
+              "resuming an upload by frame, one upload per employee, content and timestamp"),
+    IndexSpec('screenshot_uploads', [("updated_at", ASCENDING)], {},
+              "purge-stale-uploads"),
+    # screenshot_pack_entries (models/screenshot_packs.py)
+    IndexSpec('screenshot_pack_entries', [("pack", ASCENDING)], {},
+              "release_entry: deleting a pack once no entry points into it"),
+]
+
+
+# Indexes the registry used to declare that now get in the way (a unique key since widened). ensure_indexes
+# drops them instead of leaving them to unregistered_indexes' manual review.
+OBSOLETE_INDEXES = [
+    IndexSpec('screenshot_uploads', [("employee_id", ASCENDING), ("sha256", ASCENDING)], {"unique": True},
+              "merged identical frames uploading at the same time; replaced by the per-timestamp key"),
+]
+
+
+def _key_tuple(keys):
+    return tuple((field, int(direction)) for field, direction in keys)
+
+
+def missing_indexes(db):
+    """Returns {collection: [IndexSpec, ...]} for registry entries not present in the database."""
+    missing = {}
+    existing_by_coll = {}
+    for spec in INDEXES:
+        if spec.collection not in existing_by_coll:
+            info = db[spec.collection].index_information() if spec.collection in db.list_collection_names() else {}
+            existing_by_coll[spec.collection] = {_key_tuple(idx["key"]) for idx in info.values()}
+        if _key_tuple(spec.keys) not in existing_by_coll[spec.collection]:
+            missing.setdefault(spec.collection, []).append(spec)
+    return missing
+
+
+def unregistered_indexes(db):
+    """Indexes present in the database but absent from the registry (candidates for a manual drop)."""
+    registered = {(spec.collection, _key_tuple(spec.keys)) for spec in INDEXES}
+    extra = []
+    existing_collections = db.list_collection_names()
+    for coll in sorted({spec.collection for spec in INDEXES}):
+        if coll not in existing_collections:
+            continue
+        for name, idx in db[coll].index_information().items():
+            if name != "_id_" and (coll, _key_tuple(idx["key"])) not in registered:
+                extra.append((coll, name))
+    return extra
+
+
+def obsolete_indexes(db):
+    """[(collection, index name, IndexSpec)] for OBSOLETE_INDEXES still present in the database."""
+    found = []
+    existing_collections = db.list_collection_names()
+    for spec in OBSOLETE_INDEXES:
+        if spec.collection not in existing_collections:
+            continue
+        for name, idx in db[spec.collection].index_information().items():
+            if _key_tuple(idx["key"]) == _key_tuple(spec.keys):
+                found.append((spec.collection, name, spec))
+    return found
+
+
+def ensure_indexes(db, background=False, log=print):
+    """
+    Drops OBSOLETE_INDEXES, then builds every registered index that doesn't exist yet. Failures (e.g.
+    duplicates blocking a unique index) are logged and skipped so one bad index doesn't stop the rest.
+    Returns the names of the indexes created.
+    """
+    for coll, name, spec in obsolete_indexes(db):
+        try:
+            db[coll].drop_index(name)
+            log(f"Dropped obsolete index {coll}.{name} ({spec.reason})")
+        except OperationFailure as e:
+            log(f"Could not drop obsolete index {coll}.{name}: {e}")
+    created = []
+    for coll, specs in missing_indexes(db).items():
+        for spec in specs:
+            options = dict(spec.options)
+            if background:
+                options["background"] = True # Ignored by MongoDB 4.2+, which always builds without a global lock
+            try:
+                created.extend(db[coll].create_indexes([IndexModel(spec.keys, **options)]))
+                log(f"Created index on {coll} {spec.keys} ({spec.reason})")
+            except OperationFailure as e:
+                log(f"Could not create index on {coll} {spec.keys}: {e}")
+    return created
+
+
+# --- Query plan checks ---
+
+QueryShape = namedtuple('QueryShape', ['name', 'collection', 'kind', 'query', 'sort'])
+
+
+def query_shapes(employee_id, screenshot_path=None):
+    """
+    The filters the routes issue, with representative values. 'find' shapes are (filter, sort);
+    'aggregate' shapes are a pipeline whose leading $match is what the planner sees.
+    """
+    from models import dashboard_queries, rollups # Imported here; both import pymongo helpers only
+    from models.search import search_filter
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    week_start = (now - datetime.timedelta(days=6)).replace(hour=0, minute=0, second=0, microsecond=0)
+    day_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+    ts_range = {"$gte": week_start, "$lte": day_end}
+    keyset = [("timestamp", -1), ("_id", -1)]
+    return [
+        QueryShape('employees.by_employee_id', 'employees', 'find', {"employee_id": employee_id}, None),
+        QueryShape('employees.filter_list', 'employees', 'find', {}, [("display_name", 1)]),
+        QueryShape('employees.pending_renames', 'employees', 'find', {"status": "pending_rename"}, None),
+        QueryShape('employees.tracked', 'employees', 'find', {"status": {"$nin": ["inactive", "disabled"]}}, None),
+        QueryShape('employees.list_users', 'employees', 'find', {}, [("status", 1), ("display_name", 1)]),
+        QueryShape('employees.search', 'employees', 'find', search_filter("new user"), [("status", 1), ("display_name", 1)]),
+        QueryShape('employees.latest_seen', 'employees', 'find', {"last_seen": {"$exists": True}}, [("last_seen", -1)]),
+        QueryShape('users.by_username', 'users', 'find', {"username": "admin"}, None),
+        QueryShape('reports.activity_log', 'activity_logs', 'find',
+                   {"timestamp": ts_range, "employee_id": employee_id, "log_type": {"$ne": "screenshot"}}, keyset),
+        QueryShape('reports.screenshots', 'activity_logs', 'find',
+                   {"timestamp": ts_range, "log_type": "screenshot", "screenshot_path": {"$exists": True}, "employee_id": employee_id}, keyset),
+        QueryShape('reports.export_all', 'activity_logs', 'find',
+                   {"timestamp": ts_range, "log_type": {"$ne": "screenshot"}}, [("timestamp", 1)]),
+        QueryShape('api.unchanged_screenshot', 'activity_logs', 'find',
+                   {"employee_id": employee_id, "log_type": "screenshot", "unchanged_since": week_start, "timestamp": {"$gte": week_start}}, None),
+        QueryShape('reports.view_screenshot', 'activity_logs', 'find',
+                   {"screenshot_path": screenshot_path or "probe.png", "log_type": "screenshot"}, None),
+        QueryShape('dashboard.avg_start', 'activity_logs', 'aggregate',
+                   dashboard_queries.avg_start_pipeline(week_start, day_end), None),
+        QueryShape('dashboard.avg_start_employee', 'activity_logs', 'aggregate',
+                   dashboard_queries.avg_start_pipeline(week_start, day_end, employee_id), None),
+        QueryShape('dashboard.raw_facets', 'activity_logs', 'aggregate',
+                   dashboard_queries.activity_facet_pipeline(week_start, now), None),
+        QueryShape('dashboard.raw_facets_employee', 'activity_logs', 'aggregate',
+                   dashboard_queries.activity_facet_pipeline(week_start, now, employee_id), None),
+        QueryShape('dashboard.rollup_facets', rollups.ROLLUP_COLLECTION, 'aggregate',
+                   rollups.activity_facet_pipeline(week_start, day_end), None),
+        QueryShape('dashboard.rollup_facets_employee', rollups.ROLLUP_COLLECTION, 'aggregate',
+                   rollups.activity_facet_pipeline(week_start, day_end, employee_id), None),
+    ]
+
+
+def _find_stages(plan, found):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            found.append(plan["stage"])
+        for value in plan.values():
+            _find_stages(value, found)
+    elif isinstance(plan, list):
+        for item in plan:
+            _find_stages(item, found)
+    return found
+
+
+def _execution_stats(explain):
+    """executionStats sits at the top level for find and under the first $cursor stage for aggregate."""
+    if "executionStats" in explain:
+        return explain["executionStats"]
+    for stage in explain.get("stages", []):
+        if "$cursor" in stage and "executionStats" in stage["$cursor"]:
+            return stage["$cursor"]["executionStats"]
+    return {}
+
+
+def explain_shape(db, shape):
+    if shape.kind == 'aggregate':
+        # Only the leading $match reaches the query planner; later stages don't affect index use
+        command = {"aggregate": shape.collection, "pipeline": shape.query[:1], "cursor": {}}
+    else:
+        command = {"find": shape.collection, "filter": shape.query}
+        if shape.sort:
+            command["sort"] = dict(shape.sort)
+    explain = db.command("explain", command, verbosity="executionStats")
+    planner = explain.get("queryPlanner") or {}
+    if not planner:
+        for stage in explain.get("stages", []):
+            planner = stage.get("$cursor", {}).get("queryPlanner", planner)
+    stats = _execution_stats(explain)
+    return {
+        "stages": _find_stages(planner.get("winningPlan", {}), []),
+        "keys_examined": stats.get("totalKeysExamined", 0),
+        "docs_examined": stats.get("totalDocsExamined", 0),
+        "returned": stats.get("nReturned", 0),
+    }
+
+
+def check_query_plans(db, employee_id, screenshot_path=None, max_ratio=10, min_examined=1000):
+    """
+    Explains every query shape. A shape fails if its winning plan contains a COLLSCAN, or if it
+    examined more than max_ratio keys (or documents) per returned document once past min_examined.
+    Returns [(shape name, result dict, problem or None), ...].
+    """
+    results = []
+    for shape in query_shapes(employee_id, screenshot_path):
+        result = explain_shape(db, shape)
+        problem = None
+        examined = max(result["keys_examined"], result["docs_examined"])
+        if "COLLSCAN" in result["stages"]:
+            problem = "collection scan"
+        elif examined > min_examined and examined > max_ratio * max(result["returned"], 1):
+            problem = f"examined {examined} for {result['returned']} returned"
+        results.append((shape.name, result, problem))
+    return results
@@ -0,0 +1,208 @@
+# /root/EMS/server/models/presence.py
+import atexit
+import datetime
+import os
+import threading
+import time
+
+from pymongo import UpdateOne
+
+from models.db import get_or_create_employee
+
+ACTIVE_STATUSES = ("active", "pending_rename")
+
+
+class PresenceTracker:
+    """
+    Keeps last_seen / hostname for every agent in memory and writes them to the
+    employees collection as one unordered bulk_write every PRESENCE_FLUSH_INTERVAL_SECONDS.
+    Unknown employees are still created immediately (a single upsert on first sight); an employee whose
+    record was deleted meanwhile is noticed by the flush (no match) and created again on its next touch.
+    The same flush cycle refreshes a snapshot of active employees so the sidebar poll
+    (/api/active_employees) never touches Mongo, and still sees agents served by other workers.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._known = {}      # employee_id -> {"_id", "display_name", "status", "last_seen"}
+        self._pending = {}    # employee_id -> {"last_seen": datetime, "hostname": str|None}
+        self._snapshot = None # Active employees as of the last flush (all workers)
+        self._snapshot_at = 0.0 # time.monotonic() of the last snapshot refresh
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._stats = {"touches": 0, "flushes": 0, "employees_flushed": 0, "flush_errors": 0, "created": 0, "forgotten": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('PRESENCE_FLUSH_INTERVAL_SECONDS', 15)
+        self.active_threshold_minutes = app.config.get('ACTIVE_EMPLOYEE_THRESHOLD_MINUTES', 5)
+        app.extensions['presence'] = self
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="PresenceFlusher", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def touch(self, db, employee_id, hostname=None, seen_at=None, initial_name=None):
+        """Records that an agent was seen. Creates the employee record right away if it is new."""
+        seen_at = seen_at or datetime.datetime.now(datetime.timezone.utc)
+        self._ensure_started()
+        with self._lock:
+            known = self._known.get(employee_id)
+        if known is None:
+            employee, created = get_or_create_employee(db, employee_id, initial_name=initial_name)
+            last_seen = employee.get("last_seen")
+            if last_seen is not None and last_seen.tzinfo is None:
+                last_seen = last_seen.replace(tzinfo=datetime.timezone.utc)
+            known = {"_id": employee["_id"], "display_name": employee.get("display_name"),
+                     "status": employee.get("status"), "last_seen": last_seen}
+            if created:
+                self._bump("created")
+                self.app.logger.info(f"Presence: created new employee record for {employee_id}")
+        with self._lock:
+            self._known[employee_id] = known
+            if known["last_seen"] is None or seen_at > known["last_seen"]:
+                known["last_seen"] = seen_at
+            pending = self._pending.setdefault(employee_id, {"last_seen": seen_at, "hostname": None})
+            if seen_at > pending["last_seen"]:
+                pending["last_seen"] = seen_at
+            if hostname:
+                pending["hostname"] = hostname
+            self._stats["touches"] += 1
+        return known["_id"]
+
+    def update_employee(self, employee_id, **fields):
+        """Keeps cached display_name/status in step with admin edits."""
+        with self._lock:
+            known = self._known.get(employee_id)
+            if known is not None:
+                known.update({k: v for k, v in fields.items() if k in ("display_name", "status")})
+            if self._snapshot is not None:
+                for emp in self._snapshot:
+                    if emp["employee_id"] == employee_id:
+                        emp.update({k: v for k, v in fields.items() if k in ("display_name", "status")})
+
+    def _bump(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["pending"] = len(self._pending)
+            snapshot["known"] = len(self._known)
+        return snapshot
+
+    def active_employees(self, db=None, limit=15):
+        """Active employees for the sidebar, answered from memory."""
+        self._ensure_started() # A worker that only serves admin polls still needs the flusher to refresh the snapshot
+        if db is not None and (self._snapshot is None or time.monotonic() - self._snapshot_at > 2 * self.flush_interval):
+            # First call after startup, or the flusher's refreshes are failing: refresh inline
+            try:
+                self.refresh_snapshot(db)
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                self.app.logger.error(f"Presence snapshot refresh failed, answering from the stale snapshot: {e}")
+        threshold = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=self.active_threshold_minutes)
+        merged = {}
+        with self._lock:
+            for emp in self._snapshot or []:
+                if emp["last_seen"] >= threshold and emp.get("status") in ACTIVE_STATUSES:
+                    merged[emp["employee_id"]] = emp
+            for employee_id, known in self._known.items():
+                if known["last_seen"] and known["last_seen"] >= threshold and known.get("status") in ACTIVE_STATUSES:
+                    merged[employee_id] = {"_id": known["_id"], "employee_id": employee_id,
+                                           "display_name": known.get("display_name"), "last_seen": known["last_seen"]}
+        result = sorted(merged.values(), key=lambda e: (e.get("display_name") or ""))[:limit]
+        return [{"_id": str(e["_id"]), "employee_id": e["employee_id"], "display_name": e.get("display_name")} for e in result]
+
+    def refresh_snapshot(self, db):
+        threshold = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=self.active_threshold_minutes)
+        docs = list(db.employees.find(
+            {"last_seen": {"$gte": threshold}, "status": {"$in": list(ACTIVE_STATUSES)}},
+            {"_id": 1, "display_name": 1, "employee_id": 1, "status": 1, "last_seen": 1}
+        ))
+        for doc in docs:
+            if doc["last_seen"].tzinfo is None: # pymongo returns naive UTC datetimes unless tz_aware=True
+                doc["last_seen"] = doc["last_seen"].replace(tzinfo=datetime.timezone.utc)
+        with self._lock:
+            self._snapshot = docs
+            self._snapshot_at = time.monotonic()
+            for doc in docs:
+                known = self._known.get(doc["employee_id"])
+                if known is not None: # Pick up renames/status changes made through another worker
+                    known["display_name"] = doc.get("display_name")
+                    known["status"] = doc.get("status")
+
+    def flush(self, db):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            ops = []
+            for employee_id, p in pending.items():
+                update = {"$max": {"last_seen": p["last_seen"]}}
+                if p["hostname"]:
+                    update["$set"] = {"hostname": p["hostname"]}
+                ops.append(UpdateOne({"employee_id": employee_id}, update))
+            try:
+                result = db.employees.bulk_write(ops, ordered=False)
+                with self._lock:
+                    self._stats["flushes"] += 1
+                    self._stats["employees_flushed"] += result.matched_count
+                if result.matched_count < len(ops):
+                    self._forget_missing(db, list(pending))
+            except Exception as e:
+                self.app.logger.error(f"Presence flush failed for {len(ops)} employee(s): {e}")
+                with self._lock:
+                    self._stats["flush_errors"] += 1
+                    # Put the entries back unless newer ones arrived meanwhile.
+                    for employee_id, p in pending.items():
+                        current = self._pending.get(employee_id)
+                        if current is None:
+                            self._pending[employee_id] = p
+                        elif p["last_seen"] > current["last_seen"]:
+                            current["last_seen"] = p["last_seen"]
+        try:
+            self.refresh_snapshot(db)
+        except Exception as e:
+            self.app.logger.error(f"Presence snapshot refresh failed: {e}")
+
+    def _forget_missing(self, db, employee_ids):
+        """Drops cached employees whose record is gone (deleted by an admin), so the next touch re-creates it."""
+        existing = {doc["employee_id"] for doc in db.employees.find({"employee_id": {"$in": employee_ids}}, {"employee_id": 1})}
+        missing = [employee_id for employee_id in employee_ids if employee_id not in existing]
+        with self._lock:
+            for employee_id in missing:
+                self._known.pop(employee_id, None)
+            self._stats["forgotten"] += len(missing)
+        if missing:
+            self.app.logger.warning(f"Presence: {len(missing)} employee record(s) no longer exist and will be re-created when seen again: {', '.join(missing[:10])}")
+
+    def _run(self):
+        from models.db import get_db
+        with self.app.app_context():
+            db = get_db()
+            while not self._stop.wait(self.flush_interval):
+                self.flush(db)
+            self.flush(db) # Final flush on shutdown
+
+    def shutdown(self, timeout=5.0):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+
+presence = PresenceTracker()
@@ -0,0 +1,124 @@
+# /root/EMS/server/models/rollups.py
+import datetime
+
+from pymongo import UpdateOne
+
+# Hourly activity rollups, one document per (employee_id, hour, bucket):
+#   hour            - activity_logs.timestamp truncated to the hour (UTC), same field the dashboard filters on
+#   bucket          - window_title, or process_name when the title is missing (the dashboard's "activity name")
+#   total_seconds   - sum of duration_seconds (working time / work hours)
+#   listed_seconds  - the part of total_seconds that qualifies for the Top 5 panel (non-empty title or process)
+#   segments        - number of raw activity documents folded in
+ROLLUP_COLLECTION = 'activity_rollups_hourly'
+
+
+def _truncate_to_hour(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _is_listed(doc):
+    # Mirrors the raw Top 5 $match: a non-empty window_title or process_name
+    return bool(doc.get("window_title")) or bool(doc.get("process_name"))
+
+
+def apply_rollups(db, docs):
+    """Folds freshly inserted activity docs into the hourly rollups with one unordered bulk_write of $inc upserts."""
+    totals = {}
+    for doc in docs:
+        duration = doc.get("duration_seconds")
+        if doc.get("log_type") != "activity" or not duration or duration <= 0 or doc.get("is_active") is False:
+            continue
+        bucket = doc.get("window_title")
+        if bucket is None:
+            bucket = doc.get("process_name")
+        key = (doc["employee_id"], _truncate_to_hour(doc["timestamp"]), bucket)
+        entry = totals.setdefault(key, [0, 0, 0])
+        entry[0] += duration
+        entry[1] += duration if _is_listed(doc) else 0
+        entry[2] += 1
+    if not totals:
+        return 0
+    db[ROLLUP_COLLECTION].bulk_write([
+        UpdateOne(
+            {"employee_id": employee_id, "hour": hour, "bucket": bucket},
+            {"$inc": {"total_seconds": total, "listed_seconds": listed, "segments": segments}},
+            upsert=True
+        ) for (employee_id, hour, bucket), (total, listed, segments) in totals.items()
+    ], ordered=False)
+    return len(totals)
+
+
+def is_hour_aligned(start_date, end_date):
+    """True when [start_date, end_date] covers whole hours (end is inclusive, e.g. 23:59:59.999999)."""
+    end_exclusive = end_date + datetime.timedelta(microseconds=1)
+    return start_date == _truncate_to_hour(start_date) and end_exclusive == _truncate_to_hour(end_exclusive)
+
+
+def _rollup_match(start_date, end_date, employee_id=None):
+    match = {"hour": {"$gte": start_date, "$lte": end_date}}
+    if employee_id:
+        match["employee_id"] = employee_id
+    return match
+
+
+def activity_facet_pipeline(start_date, end_date, employee_id=None):
+    """Rollup counterpart of dashboard_queries.activity_facet_pipeline (same facet names and output shapes)."""
+    return [
+        {"$match": _rollup_match(start_date, end_date, employee_id)},
+        {"$facet": {
+            "working_time": [
+                {"$group": {"_id": None, "total_duration": {"$sum": "$total_seconds"}}}
+            ],
+            "top_sites": [
+                {"$match": {"listed_seconds": {"$gt": 0}}},
+                {"$group": {"_id": "$bucket", "total_duration": {"$sum": "$listed_seconds"}}},
+                {"$sort": {"total_duration": -1}}, {"$limit": 5}
+            ],
+            "work_hours": [
+                {"$group": {"_id": "$employee_id", "total_seconds": {"$sum": "$total_seconds"}, "unique_days": {"$addToSet": {"$dateToString": {"format": "%Y-%m-%d", "date": "$hour", "timezone": "UTC"}}}}},
+                {"$lookup": {"from": "employees", "localField": "_id", "foreignField": "employee_id", "as": "employee_info"}},
+                {"$unwind": {"path": "$employee_info", "preserveNullAndEmptyArrays": True}},
+                {"$project": {"_id": 0, "employee_id": "$_id", "display_name": "$employee_info.display_name", "total_seconds": 1, "man_days": {"$size": "$unique_days"}}},
+                {"$sort": {"display_name": 1}}
+            ],
+        }}
+    ]
+
+
+def rebuild_rollups(db, start_date, end_date):
+    """
+    Recomputes the rollups for hours in [start_date, end_date) from raw activity_logs, server-side.
+    Existing rollup documents in the range are replaced, so the command can be re-run safely.
+    Returns the number of rollup documents written.
+    """
+    db[ROLLUP_COLLECTION].delete_many({"hour": {"$gte": start_date, "$lt": end_date}})
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": start_date, "$lt": end_date}, "log_type": "activity", "duration_seconds": {"$gt": 0},
+                    "is_active": {"$ne": False}}}, # Idle spans reported by the agent aren't working time
+        {"$project": {
+            "employee_id": 1, "duration_seconds": 1,
+            "hour": {"$dateFromParts": {
+                "year": {"$year": "$timestamp"}, "month": {"$month": "$timestamp"},
+                "day": {"$dayOfMonth": "$timestamp"}, "hour": {"$hour": "$timestamp"}
+            }},
+            "bucket": {"$ifNull": ["$window_title", "$process_name"]},
+            "listed": {"$or": [
+                {"$ne": [{"$ifNull": ["$window_title", ""]}, ""]},
+                {"$ne": [{"$ifNull": ["$process_name", ""]}, ""]}
+            ]}
+        }},
+        {"$group": {
+            "_id": {"employee_id": "$employee_id", "hour": "$hour", "bucket": "$bucket"},
+            "total_seconds": {"$sum": "$duration_seconds"},
+            "listed_seconds": {"$sum": {"$cond": ["$listed", "$duration_seconds", 0]}},
+            "segments": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0, "employee_id": "$_id.employee_id", "hour": "$_id.hour", "bucket": "$_id.bucket",
+            "total_seconds": 1, "listed_seconds": 1, "segments": 1
+        }},
+        {"$merge": {"into": ROLLUP_COLLECTION, "on": ["employee_id", "hour", "bucket"],
+                    "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+    db.activity_logs.aggregate(pipeline, allowDiskUse=True)
+    return db[ROLLUP_COLLECTION].count_documents({"hour": {"$gte": start_date, "$lt": end_date}})
@@ -0,0 +1,273 @@
+# /root/EMS/server/models/screenshot_packs.py
+import datetime
+import io
+import mmap
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image # Needed by the tiering job only; reading packs works without it
+except ImportError:
+    Image = None
+
+from models import screenshot_store
+
+# Cold tier for screenshots. A tiering job re-encodes screenshots older than a cutoff to WebP/AVIF and
+# appends them to one pack file per employee-day under PACK_FOLDER:
+#   <employee>/<YYYY-MM-DD>-<id>.pack   - concatenated encoded images, no header
+# screenshot_pack_entries holds the index, keyed by the screenshot_path activity_logs already uses:
+#   {_id: screenshot_path, pack: '<employee>/<day>-<id>.pack', offset, length, mimetype, original_size}
+# so view_screenshot keeps its URLs and reads the bytes out of the pack through a memory map. The packed
+# screenshots' activity logs get screenshot_packed: True, which tells view_screenshot where to look, and
+# their blob documents get the entry too (screenshot_store.mark_packed), for logs deduplicated onto them later.
+PACK_ENTRY_COLLECTION = 'screenshot_pack_entries'
+TIER_FORMATS = {'webp': ('WEBP', 'image/webp'), 'avif': ('AVIF', 'image/avif')}
+
+
+def _safe_name(value):
+    return "".join(c if c.isalnum() or c in ['-', '_'] else "_" for c in value) or "unknown_emp"
+
+
+def transcode_image(source_path, fmt, quality):
+    """Runs in a pool process: returns the screenshot re-encoded as fmt (bytes), or None if the file is gone."""
+    if not os.path.isfile(source_path):
+        return None
+    with Image.open(source_path) as img:
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        out = io.BytesIO()
+        img.save(out, TIER_FORMATS[fmt][0], quality=quality)
+    return out.getvalue()
+
+
+def resolve_format(fmt, log=print):
+    """AVIF needs a Pillow build with AVIF support; falls back to WebP otherwise."""
+    if fmt == 'avif':
+        Image.init()
+        if 'AVIF' not in Image.SAVE:
+            log("This Pillow build cannot write AVIF; using WebP.")
+            return 'webp'
+    return fmt if fmt in TIER_FORMATS else 'webp'
+
+
+def _write_pack(pack_folder, employee_id, day, encoded):
+    """Writes [(screenshot_path, bytes, original_size)] to a new pack file. Returns (pack_relpath, entries)."""
+    pack_relpath = f"{_safe_name(employee_id)}/{day.strftime('%Y-%m-%d')}-{uuid.uuid4().hex[:8]}.pack"
+    pack_path = os.path.join(pack_folder, *pack_relpath.split('/'))
+    os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+    temp_path = pack_path + '.tmp'
+    entries = []
+    with open(temp_path, 'wb') as out:
+        for screenshot_path, data, original_size in encoded:
+            entries.append({"_id": screenshot_path, "pack": pack_relpath, "offset": out.tell(),
+                            "length": len(data), "original_size": original_size})
+            out.write(data)
+        out.flush()
+        os.fsync(out.fileno()) # The loose originals are deleted once the index is written
+    os.replace(temp_path, pack_path)
+    return pack_relpath, entries
+
+
+def _mark_packed(db, screenshot_paths):
+    """Flags the screenshots' activity logs so view_screenshot goes to the pack without probing the loose file."""
+    db.activity_logs.update_many(
+        {"screenshot_path": {"$in": list(screenshot_paths)}, "log_type": "screenshot", "screenshot_packed": {"$ne": True}},
+        {"$set": {"screenshot_packed": True}}
+    )
+
+
+def tier_day(db, upload_folder, pack_folder, day, fmt='webp', quality=80, pool=None, thumbnails=None, log=print):
+    """
+    Packs every not-yet-packed screenshot taken on `day` (UTC), one pack per employee.
+    Originals are removed only after the pack is fsynced and its index entries are stored.
+    Returns {"screenshots", "packs", "bytes_before", "bytes_after"}.
+    """
+    day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_end = day_start + datetime.timedelta(days=1)
+    by_employee = OrderedDict()
+    for doc in db.activity_logs.find(
+        {"log_type": "screenshot", "timestamp": {"$gte": day_start, "$lt": day_end}, "screenshot_path": {"$exists": True}},
+        {"employee_id": 1, "screenshot_path": 1, "_id": 0}
+    ).sort("timestamp", 1):
+        paths = by_employee.setdefault(doc["employee_id"], [])
+        if doc["screenshot_path"] not in paths:
+            paths.append(doc["screenshot_path"])
+
+    summary = {"screenshots": 0, "packs": 0, "bytes_before": 0, "bytes_after": 0}
+    mimetype = TIER_FORMATS[fmt][1]
+    for employee_id, paths in by_employee.items():
+        already_entries = list(db[PACK_ENTRY_COLLECTION].find({"_id": {"$in": paths}}))
+        already = {e["_id"] for e in already_entries}
+        if already:
+            # Packs written before activity_logs and blobs carried the marker, and logs deduplicated onto a
+            # packed blob since; an upload of that content may have put a loose copy back, which the pack replaces
+            _mark_packed(db, already)
+            screenshot_store.mark_packed(db, already_entries)
+            for path in already:
+                try:
+                    os.remove(os.path.join(upload_folder, *path.split('/')))
+                except FileNotFoundError:
+                    pass
+        todo = [p for p in paths if p not in already and os.path.isfile(os.path.join(upload_folder, *p.split('/')))]
+        if not todo:
+            continue
+        if thumbnails is not None:
+            # Thumbnails are rendered from the original, which is about to go away
+            for path, future in [(p, thumbnails.enqueue(p)) for p in todo]:
+                if future is not None:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        log(f"Thumbnail failed for {path}: {e}")
+        sources = [os.path.join(upload_folder, *p.split('/')) for p in todo]
+        results = (pool.map(transcode_image, sources, [fmt] * len(sources), [quality] * len(sources))
+                   if pool is not None else (transcode_image(src, fmt, quality) for src in sources))
+        encoded = []
+        for path, source, data in zip(todo, sources, results):
+            if data is None:
+                continue
+            encoded.append((path, data, os.path.getsize(source)))
+        if not encoded:
+            continue
+        pack_relpath, entries = _write_pack(pack_folder, employee_id, day_start, encoded)
+        for entry in entries:
+            entry["mimetype"] = mimetype
+            entry["packed_at"] = datetime.datetime.now(datetime.timezone.utc)
+        db[PACK_ENTRY_COLLECTION].insert_many(entries, ordered=False)
+        _mark_packed(db, [path for path, _, _ in encoded])
+        screenshot_store.mark_packed(db, entries) # Before the files go, so dedup never hands out a missing one unmarked
+        for path, data, original_size in encoded:
+            try:
+                os.remove(os.path.join(upload_folder, *path.split('/')))
+            except FileNotFoundError:
+                pass
+            summary["bytes_before"] += original_size
+            summary["bytes_after"] += len(data)
+        summary["screenshots"] += len(encoded)
+        summary["packs"] += 1
+        log(f"{day_start.strftime('%Y-%m-%d')} {employee_id}: {len(encoded)} screenshot(s) -> {pack_relpath}")
+    return summary
+
+
+def tier_screenshots(db, upload_folder, pack_folder, older_than_days, fmt='webp', quality=80, workers=2, thumbnails=None, log=print):
+    """Runs tier_day for every day from the oldest screenshot up to the cutoff. Returns the combined summary."""
+    if Image is None:
+        raise RuntimeError("Pillow is required to transcode screenshots")
+    fmt = resolve_format(fmt, log=log)
+    cutoff = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=older_than_days)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    oldest = db.activity_logs.find_one({"log_type": "screenshot"}, {"timestamp": 1}, sort=[("timestamp", 1)])
+    total = {"screenshots": 0, "packs": 0, "bytes_before": 0, "bytes_after": 0}
+    if not oldest:
+        return total
+    day = oldest["timestamp"].replace(tzinfo=datetime.timezone.utc, hour=0, minute=0, second=0, microsecond=0)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while day < cutoff:
+            summary = tier_day(db, upload_folder, pack_folder, day, fmt=fmt, quality=quality, pool=pool,
+                               thumbnails=thumbnails, log=log)
+            for key in total:
+                total[key] += summary[key]
+            day += datetime.timedelta(days=1)
+    return total
+
+
+class PackReader:
+    """Reads packed screenshots through a bounded set of memory-mapped pack files (LRU)."""
+
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self._maps = OrderedDict() # pack path -> (file, mmap)
+        self._lock = threading.Lock()
+
+    def read(self, pack_path, offset, length):
+        with self._lock: # Slicing under the lock so an eviction can't close a map mid-read
+            entry = self._maps.get(pack_path)
+            if entry is None:
+                f = open(pack_path, 'rb')
+                try:
+                    entry = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                except Exception:
+                    f.close()
+                    raise
+                self._maps[pack_path] = entry
+                while len(self._maps) > self.max_open:
+                    _, (old_file, old_map) = self._maps.popitem(last=False)
+                    old_map.close()
+                    old_file.close()
+            else:
+                self._maps.move_to_end(pack_path)
+            return entry[1][offset:offset + length]
+
+    def discard(self, pack_path):
+        """Unmaps a pack that is about to be deleted, so its disk space is freed."""
+        with self._lock:
+            entry = self._maps.pop(pack_path, None)
+            if entry is not None:
+                entry[1].close()
+                entry[0].close()
+
+
+pack_reader = PackReader()
+
+
+def find_entry(db, screenshot_path):
+    return db[PACK_ENTRY_COLLECTION].find_one({"_id": screenshot_path})
+
+
+def release_entry(db, pack_folder, screenshot_path):
+    """
+    Drops the pack entry of a screenshot nothing references any more (screenshot_store.release).
+    Packs are append-only, so the bytes are reclaimed once no entry points into the pack: the pack file
+    is deleted then. Without pack_folder only the entry goes. Returns True if a pack file was deleted.
+    """
+    entry = db[PACK_ENTRY_COLLECTION].find_one_and_delete({"_id": screenshot_path})
+    if entry is None or pack_folder is None or db[PACK_ENTRY_COLLECTION].find_one({"pack": entry["pack"]}, {"_id": 1}):
+        return False
+    pack_path = os.path.join(pack_folder, *entry["pack"].split('/'))
+    pack_reader.discard(pack_path)
+    try:
+        os.remove(pack_path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def storage_report(db, upload_folder, pack_folder, samples=50):
+    """Compression ratio of the packed tier and sampled read latency of loose files vs. packed entries."""
+    totals = list(db[PACK_ENTRY_COLLECTION].aggregate([
+        {"$group": {"_id": None, "count": {"$sum": 1}, "original": {"$sum": "$original_size"}, "packed": {"$sum": "$length"}}}
+    ]))
+    report = {"packed_screenshots": 0, "original_bytes": 0, "packed_bytes": 0, "ratio": None,
+              "loose_read_ms": None, "packed_read_ms": None}
+    if totals:
+        report.update(packed_screenshots=totals[0]["count"], original_bytes=totals[0]["original"], packed_bytes=totals[0]["packed"])
+        if totals[0]["packed"]:
+            report["ratio"] = round(totals[0]["original"] / totals[0]["packed"], 2)
+
+    loose = [b["path"] for b in db[screenshot_store.BLOB_COLLECTION].aggregate([
+        {"$match": {"pack": {"$exists": False}}}, {"$sample": {"size": samples}}, {"$project": {"path": 1}}])]
+    timings = []
+    for relpath in loose:
+        path = os.path.join(upload_folder, *relpath.split('/'))
+        if not os.path.isfile(path):
+            continue
+        started = time.perf_counter()
+        with open(path, 'rb') as f:
+            f.read()
+        timings.append((time.perf_counter() - started) * 1000)
+    if timings:
+        report["loose_read_ms"] = round(sum(timings) / len(timings), 3)
+
+    timings = []
+    reader = PackReader()
+    for entry in db[PACK_ENTRY_COLLECTION].aggregate([{"$sample": {"size": samples}}]):
+        started = time.perf_counter()
+        reader.read(os.path.join(pack_folder, *entry["pack"].split('/')), entry["offset"], entry["length"])
+        timings.append((time.perf_counter() - started) * 1000)
+    if timings:
+        report["packed_read_ms"] = round(sum(timings) / len(timings), 3)
+    return report
@@ -0,0 +1,345 @@
+# /root/EMS/server/models/screenshot_store.py
+import datetime
+import hashlib
+import os
+import shutil
+import uuid
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# Content-addressed screenshot storage under UPLOAD_FOLDER.
+# A file is named by the SHA-256 of its bytes and fanned out into two levels of shard
+# directories ('3f/a2/3fa2...e1.png'), so no directory grows past a few thousand entries and
+# identical frames (lock screens, idle desktops) are stored once. screenshot_blobs keeps one
+# document per file with the number of activity_logs entries that reference it.
+# activity_logs.screenshot_path holds the relative path, so view_screenshot serves it as before.
+# Once the cold tier (models/screenshot_packs.py) packs a blob and removes its file, the blob document
+# carries pack: {pack, offset, length, mimetype}, so new references know the bytes live in the pack.
+BLOB_COLLECTION = 'screenshot_blobs'
+INCOMING_DIR = '.incoming' # Temporary files while an upload is hashed; same filesystem as the shards
+CHUNK_SIZE = 1024 * 1024
+# Formats agents may upload (by format name or filename extension); anything else is stored as .png
+SCREENSHOT_EXTENSIONS = {'png': '.png', 'webp': '.webp', 'jpeg': '.jpg', 'jpg': '.jpg'}
+
+
+def screenshot_extension(value):
+    return SCREENSHOT_EXTENSIONS.get((value or '').lower().lstrip('.'), '.png')
+
+
+def blob_relpath(digest, ext='.png'):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_content_addressed(relpath):
+    parts = relpath.split('/')
+    return len(parts) == 3 and len(parts[0]) == 2 and len(parts[1]) == 2
+
+
+def blob_digest(relpath):
+    return os.path.splitext(relpath.split('/')[-1])[0]
+
+
+def _absolute(upload_folder, relpath):
+    return os.path.join(upload_folder, *relpath.split('/'))
+
+
+def _incoming_path(upload_folder):
+    incoming = os.path.join(upload_folder, INCOMING_DIR)
+    os.makedirs(incoming, exist_ok=True)
+    return os.path.join(incoming, uuid.uuid4().hex)
+
+
+def _place(upload_folder, temp_path, digest, ext):
+    """Moves a fully written temp file into its shard unless the content is already stored."""
+    relpath = blob_relpath(digest, ext)
+    final_path = _absolute(upload_folder, relpath)
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path) # Atomic; concurrent uploads of the same frame write identical bytes
+    return relpath, final_path
+
+
+def _add_reference(db, digest, relpath, size, count=1):
+    db[BLOB_COLLECTION].update_one(
+        {"_id": digest},
+        {"$inc": {"refcount": count},
+         "$setOnInsert": {"path": relpath, "size": size, "created_at": datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True
+    )
+
+
+def store_stream(db, upload_folder, stream, ext='.png'):
+    """
+    Stores an uploaded file (any object with .read(n)) and adds one reference to it.
+    The stream is hashed while being copied to a temp file, so memory use doesn't depend on its size.
+    Returns (relpath, digest, size, deduplicated).
+    """
+    temp_path = _incoming_path(upload_folder)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = hasher.hexdigest()
+        relpath = blob_relpath(digest, ext)
+        deduplicated = os.path.exists(_absolute(upload_folder, relpath))
+        _place(upload_folder, temp_path, digest, ext)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _add_reference(db, digest, relpath, size)
+    return relpath, digest, size, deduplicated
+
+
+def store_file(db, upload_folder, path, ext=None, count=1):
+    """Stores a file already on disk (copied/linked, the source is left in place). Returns (relpath, digest)."""
+    ext = ext if ext is not None else (os.path.splitext(path)[1].lower() or '.png')
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as src:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    relpath = blob_relpath(digest, ext)
+    final_path = _absolute(upload_folder, relpath)
+    if not os.path.exists(final_path):
+        temp_path = _incoming_path(upload_folder)
+        try:
+            os.link(path, temp_path)
+        except OSError: # Hard links unsupported (or cross-device); fall back to a copy
+            shutil.copy2(path, temp_path)
+        _place(upload_folder, temp_path, digest, ext)
+    if count:
+        _add_reference(db, digest, relpath, os.path.getsize(final_path), count=count)
+    return relpath, digest
+
+
+def mark_packed(db, entries):
+    """Records the pack entries (screenshot_packs) of tiered content-addressed screenshots on their blob documents."""
+    ops = [UpdateOne({"_id": blob_digest(entry["_id"]), "pack": {"$exists": False}},
+                     {"$set": {"pack": {key: entry[key] for key in ("pack", "offset", "length", "mimetype")}}})
+           for entry in entries if is_content_addressed(entry["_id"])]
+    if ops:
+        db[BLOB_COLLECTION].bulk_write(ops, ordered=False)
+
+
+def release(db, upload_folder, relpath, pack_folder=None):
+    """
+    Drops one reference; the file (and its pack entry, once tiered) and the blob document go away with the
+    last one. Returns True if deleted.
+    """
+    if not is_content_addressed(relpath):
+        return False
+    digest = blob_digest(relpath)
+    blob = db[BLOB_COLLECTION].find_one_and_update(
+        {"_id": digest}, {"$inc": {"refcount": -1}}, return_document=ReturnDocument.AFTER
+    )
+    if blob is None or blob.get("refcount", 0) > 0:
+        return False
+    # Only delete if nobody re-referenced it in between
+    if db[BLOB_COLLECTION].delete_one({"_id": digest, "refcount": {"$lte": 0}}).deleted_count:
+        try:
+            os.remove(_absolute(upload_folder, blob["path"]))
+        except FileNotFoundError:
+            pass
+        if blob.get("pack"):
+            from models.screenshot_packs import release_entry # screenshot_packs imports this module
+            release_entry(db, pack_folder, blob["path"])
+        return True
+    return False
+
+
+def migrate_flat_folder(db, upload_folder, dry_run=False, log=print):
+    """
+    Moves screenshots from the old flat UPLOAD_FOLDER layout into the content-addressed store.
+    Each file is linked into its shard first, then the activity_logs rows are repointed, then the
+    flat file is removed, so view_screenshot never sees a dangling path. Safe to re-run.
+    Files no activity log references are left in place and reported.
+    Returns a summary dict.
+    """
+    summary = {"migrated": 0, "deduplicated": 0, "orphans": 0, "bytes_freed": 0}
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            references = db.activity_logs.count_documents({"screenshot_path": entry.name, "log_type": "screenshot"})
+            if not references:
+                summary["orphans"] += 1
+                log(f"Skipping unreferenced file: {entry.name}")
+                continue
+            if dry_run:
+                summary["migrated"] += 1
+                continue
+            size = entry.stat().st_size
+            relpath, digest = store_file(db, upload_folder, entry.path, count=0)
+            # A blob document already exists when an earlier file had identical content
+            existed_before = db[BLOB_COLLECTION].find_one({"_id": digest}, {"_id": 1}) is not None
+            result = db.activity_logs.update_many(
+                {"screenshot_path": entry.name, "log_type": "screenshot"},
+                {"$set": {"screenshot_path": relpath, "screenshot_sha256": digest}}
+            )
+            _add_reference(db, digest, relpath, size, count=result.modified_count)
+            os.remove(entry.path)
+            summary["migrated"] += 1
+            if existed_before:
+                summary["deduplicated"] += 1
+                summary["bytes_freed"] += size
+    return summary
+
+
+# --- Resumable chunked uploads ---
+# init declares size and SHA-256; chunks are PUT at explicit offsets into '<final path>.part-<upload_id>'
+# inside the destination shard, so finalize is a rename rather than a copy. screenshot_uploads tracks
+# the last acknowledged offset; an agent that re-inits the same frame (employee, content, timestamp) gets
+# the same upload back, while identical frames taken at different times upload side by side.
+UPLOAD_COLLECTION = 'screenshot_uploads'
+
+
+class UploadError(Exception):
+    """Raised for chunked-upload protocol errors; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def _part_path(upload_folder, upload):
+    return f"{_absolute(upload_folder, upload['path'])}.part-{upload['_id']}"
+
+
+def add_existing_reference(db, digest):
+    """
+    Adds a reference to already-stored content. Returns its blob document ({path} plus pack once tiered,
+    in which case the new activity log must be marked screenshot_packed), or None if it isn't stored.
+    """
+    return db[BLOB_COLLECTION].find_one_and_update(
+        {"_id": digest, "refcount": {"$gt": 0}}, {"$inc": {"refcount": 1}},
+        projection={"path": 1, "pack": 1}, return_document=ReturnDocument.AFTER
+    )
+
+
+def begin_upload(db, employee_id, timestamp, size, digest, ext='.png'):
+    """
+    Starts (or resumes) a chunked upload. Returns (upload, None), or (None, blob) when the content is
+    already stored: a reference has then been added (see add_existing_reference) and no transfer is needed.
+    """
+    digest = digest.lower()
+    if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        raise UploadError("Invalid sha256")
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError("Invalid size")
+    existing = add_existing_reference(db, digest)
+    if existing:
+        return None, existing
+    now = datetime.datetime.now(datetime.timezone.utc)
+    # BSON dates keep milliseconds; truncated so a retry's timestamp matches the stored one
+    timestamp = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+    # One upload per frame: a retry after a dropped connection picks up the existing offset
+    for attempt in range(2):
+        try:
+            upload = db[UPLOAD_COLLECTION].find_one_and_update(
+                {"employee_id": employee_id, "sha256": digest, "timestamp": timestamp},
+                {"$setOnInsert": {"_id": uuid.uuid4().hex, "size": size, "offset": 0,
+                                  "path": blob_relpath(digest, ext), "created_at": now},
+                 "$set": {"updated_at": now}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+            return upload, None
+        except DuplicateKeyError:
+            if attempt: # Lost the upsert race twice; let the agent retry
+                raise UploadError("Concurrent upload init", status=409)
+
+
+def get_upload(db, upload_id):
+    upload = db[UPLOAD_COLLECTION].find_one({"_id": upload_id})
+    if upload is None:
+        raise UploadError("Unknown or expired upload", status=404)
+    return upload
+
+
+def write_chunk(db, upload_folder, upload_id, offset, stream, max_bytes):
+    """
+    Appends one chunk read straight from the request stream at the given offset.
+    The offset must equal the last acknowledged one (409 otherwise, with the expected offset).
+    Returns the new acknowledged offset.
+    """
+    upload = get_upload(db, upload_id)
+    if offset != upload["offset"]:
+        raise UploadError("Offset mismatch", status=409, offset=upload["offset"])
+    part_path = _part_path(upload_folder, upload)
+    if offset and not os.path.exists(part_path):
+        # Part file lost (e.g. purged); restart from zero
+        db[UPLOAD_COLLECTION].update_one({"_id": upload_id}, {"$set": {"offset": 0}})
+        raise UploadError("Upload data missing; restart from offset 0", status=409, offset=0)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    written = 0
+    with open(part_path, 'r+b' if os.path.exists(part_path) else 'wb') as out:
+        out.seek(offset)
+        out.truncate() # Drops bytes from an earlier chunk that was written but never acknowledged
+        while True:
+            chunk = stream.read(min(CHUNK_SIZE, max_bytes - written + 1))
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes or offset + written > upload["size"]:
+                out.truncate(offset)
+                raise UploadError("Chunk exceeds the declared size or chunk limit", status=413, offset=offset)
+            out.write(chunk)
+    new_offset = offset + written
+    # Conditional on the old offset so two concurrent PUTs for the same range can't both be acknowledged
+    result = db[UPLOAD_COLLECTION].update_one(
+        {"_id": upload_id, "offset": offset},
+        {"$set": {"offset": new_offset, "updated_at": datetime.datetime.now(datetime.timezone.utc)}}
+    )
+    if result.matched_count == 0:
+        raise UploadError("Concurrent chunk write", status=409, offset=get_upload(db, upload_id)["offset"])
+    return new_offset
+
+
+def finalize_upload(db, upload_folder, upload_id):
+    """
+    Verifies the assembled file against the declared size and SHA-256, renames it into place and adds
+    a blob reference. Returns (relpath, digest, size, upload). A hash mismatch discards the upload.
+    """
+    upload = get_upload(db, upload_id)
+    if upload["offset"] != upload["size"]:
+        raise UploadError("Upload incomplete", status=409, offset=upload["offset"])
+    part_path = _part_path(upload_folder, upload)
+    hasher = hashlib.sha256()
+    with open(part_path, 'rb') as src:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    if hasher.hexdigest() != upload["sha256"]:
+        os.remove(part_path)
+        db[UPLOAD_COLLECTION].delete_one({"_id": upload_id})
+        raise UploadError("Content hash mismatch; upload discarded", status=422)
+    final_path = _absolute(upload_folder, upload["path"])
+    if os.path.exists(final_path):
+        os.remove(part_path) # Same content arrived through another upload meanwhile
+    else:
+        os.replace(part_path, final_path)
+    _add_reference(db, upload["sha256"], upload["path"], upload["size"])
+    db[UPLOAD_COLLECTION].delete_one({"_id": upload_id})
+    return upload["path"], upload["sha256"], upload["size"], upload
+
+
+def purge_stale_uploads(db, upload_folder, older_than):
+    """Deletes uploads (and their part files) not touched since older_than. Returns the number removed."""
+    removed = 0
+    for upload in db[UPLOAD_COLLECTION].find({"updated_at": {"$lt": older_than}}):
+        try:
+            os.remove(_part_path(upload_folder, upload))
+        except FileNotFoundError:
+            pass
+        removed += db[UPLOAD_COLLECTION].delete_one({"_id": upload["_id"], "updated_at": upload["updated_at"]}).deleted_count
+    return removed
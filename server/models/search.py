@@ -0,0 +1,59 @@
+# /root/EMS/server/models/search.py
+import re
+import unicodedata
+
+from pymongo import UpdateOne
+
+# Employee search tokens. Each employee stores 'search_tokens': every prefix (edge n-gram) of every
+# word in display_name and employee_id, normalized (accents stripped, casefolded). A search term
+# matches when each of its words is a prefix of some word in the record, which the multikey
+# index on search_tokens answers without scanning the collection.
+MAX_PREFIX_LENGTH = 15 # Longer query words are truncated to this length
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def normalize_words(text):
+    """Splits text into lowercase, accent-free words ('José-PC_01' -> ['jose', 'pc', '01'])."""
+    if not text:
+        return []
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _WORD_RE.findall(stripped.casefold())
+
+
+def search_tokens(display_name, employee_id):
+    tokens = set()
+    for word in normalize_words(display_name) + normalize_words(employee_id):
+        for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+            tokens.add(word[:length])
+    return sorted(tokens)
+
+
+def search_filter(query):
+    """Mongo filter for a users-list search, or None when the query has no searchable words."""
+    words = normalize_words(query)
+    if not words:
+        return None
+    terms = sorted({word[:MAX_PREFIX_LENGTH] for word in words})
+    return {"search_tokens": {"$all": terms}}
+
+
+def backfill_search_tokens(db, batch_size=1000, missing_only=False):
+    """
+    (Re)computes search_tokens for every employee, or only those without any (missing_only, as the startup
+    bootstrap runs it: search matches nothing for an employee without tokens). Returns the number updated.
+    """
+    updated = 0
+    ops = []
+    query = {"search_tokens": {"$exists": False}} if missing_only else {}
+    for doc in db.employees.find(query, {"_id": 1, "display_name": 1, "employee_id": 1, "search_tokens": 1}):
+        tokens = search_tokens(doc.get("display_name"), doc.get("employee_id"))
+        if doc.get("search_tokens") != tokens:
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"search_tokens": tokens}}))
+        if len(ops) >= batch_size:
+            updated += db.employees.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += db.employees.bulk_write(ops, ordered=False).modified_count
+    return updated
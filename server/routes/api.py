@@ -3,11 +3,17 @@ from flask import (
     Blueprint, request, jsonify, current_app, abort,
     send_from_directory, session, flash, url_for, redirect # Added url_for, redirect
 )
-from models.db import get_db, create_employee
+from models.db import get_db
+from models.presence import presence
+from models.rollups import apply_rollups
+from models import screenshot_store
 from routes.auth import login_required # For securing admin-only API endpoints
+from utils.ingest import activity_ingest, IngestQueueFull
+from utils.cache import dashboard_cache
+from utils.thumbnails import thumbnails
+from utils.wire import read_activity_payload, parse_activity_item, accepted_activity_formats, UnsupportedWireFormat
 import datetime
 import os
-import uuid
 import logging # Explicitly import for direct use if needed, though current_app.logger is preferred
 
 api_bp = Blueprint('api', __name__)
@@ -32,7 +38,9 @@ def verify_api_key():
 @api_bp.before_request
 def before_api_request():
     """Verify API key for agent routes; ensure login for admin/internal API routes."""
-    agent_endpoints_requiring_key = ['api.heartbeat', 'api.log_activity', 'api.upload_screenshot']
+    agent_endpoints_requiring_key = ['api.heartbeat', 'api.log_activity', 'api.upload_screenshot',
+                                     'api.init_screenshot_upload', 'api.put_screenshot_chunk', 'api.finalize_screenshot_upload',
+                                     'api.record_unchanged_screenshot']
     
     if request.endpoint in agent_endpoints_requiring_key:
          verify_api_key()
@@ -59,26 +67,33 @@ def heartbeat():
         return jsonify({"status": "error", "message": "Missing employee_id"}), 400
 
     db = get_db()
-    # create_employee will also update last_seen if employee exists
+    # New employees are created immediately; last_seen/hostname are buffered and flushed in bulk.
     # Pass hostname from agent as the initial_name if creating new employee
-    create_employee(db, employee_id, initial_name=hostname if hostname != employee_id else None)
+    presence.touch(db, employee_id, hostname=hostname,
+                   initial_name=hostname if hostname != employee_id else None)
 
     current_app.logger.info(f"Heartbeat received and processed for: {employee_id} (Hostname: {hostname})")
-    return jsonify({"status": "ok", "message": "Heartbeat received"}), 200
+    # activity_formats tells the agent which batch encodings it may send (dictionary batches only once listed)
+    return jsonify({"status": "ok", "message": "Heartbeat received", "activity_formats": accepted_activity_formats()}), 200
 
 @api_bp.route('/log/activity', methods=['POST'])
 def log_activity():
     """Agent sends activity data (window title, duration, etc.)."""
     current_app.logger.info(f"Received request for /api/log/activity. X-API-KEY present: {'X-API-KEY' in request.headers}")
     try:
-        data = request.get_json()
+        # JSON (older agents) or msgpack with compact keys, selected by Content-Type
+        data, wire_format = read_activity_payload(request)
         if data is None:
             current_app.logger.error(f"/api/log/activity: Failed to decode JSON or empty payload. Content-Type: {request.content_type}")
             return jsonify({"status": "error", "message": "Invalid or empty JSON payload"}), 400
-        current_app.logger.debug(f"/api/log/activity: Raw data received (first 1000 chars): {str(data)[:1000]}")
+        current_app.logger.debug(f"/api/log/activity: Raw {wire_format} data received (first 1000 chars): {str(data)[:1000]}")
+    except UnsupportedWireFormat as e_fmt:
+        current_app.logger.warning(f"/api/log/activity: {e_fmt}. Content-Type: {request.content_type}")
+        return jsonify({"status": "error", "message": f"Unsupported payload format: {e_fmt}",
+                        "activity_formats": accepted_activity_formats()}), 415
     except Exception as e_json:
-        current_app.logger.error(f"/api/log/activity: Error accessing/decoding JSON: {e_json}", exc_info=True)
-        return jsonify({"status": "error", "message": "Malformed JSON payload"}), 400
+        current_app.logger.error(f"/api/log/activity: Error accessing/decoding payload: {e_json}", exc_info=True)
+        return jsonify({"status": "error", "message": "Malformed payload"}), 400
 
     employee_id = data.get('employee_id')
     activities_payload = data.get('activities')
@@ -107,48 +122,56 @@ def log_activity():
             continue
 
         try:
-            start_time_str = act_data.get("start_time")
-            end_time_str = act_data.get("end_time")
-            duration_s = act_data.get("duration_seconds")
-
-            if not all([start_time_str, end_time_str, duration_s is not None]): # Ensure all three are present
-                current_app.logger.warning(f"/api/log/activity: Missing time/duration fields in item {i} for {employee_id}: {act_data}")
-                malformed_count += 1
-                continue
-            
-            start_time = datetime.datetime.fromisoformat(start_time_str)
-            end_time = datetime.datetime.fromisoformat(end_time_str)
-
-            if not isinstance(duration_s, (int, float)) or duration_s < 0:
-                calculated_duration = (end_time - start_time).total_seconds()
-                if calculated_duration < 0:
-                    current_app.logger.warning(f"Negative calculated duration for item {i}, {employee_id}. Start: {start_time}, End: {end_time}. Skipping.")
-                    malformed_count += 1
-                    continue
-                duration_s = int(calculated_duration)
-                current_app.logger.debug(f"Used recalculated duration {duration_s}s for activity from {employee_id}")
-
+            window_title, process_name, start_time, end_time, duration_s, is_active = parse_activity_item(act_data, wire_format)
             doc = {
                 "employee_id": employee_id, "timestamp": server_batch_timestamp,
-                "window_title": act_data.get("window_title", "N/A"), "process_name": act_data.get("process_name", "N/A"),
-                "start_time": start_time, "end_time": end_time, "duration_seconds": int(duration_s),
-                "is_active": act_data.get("is_active", True), "log_type": "activity"
+                "window_title": window_title, "process_name": process_name,
+                "start_time": start_time, "end_time": end_time, "duration_seconds": duration_s,
+                "is_active": is_active, "log_type": "activity"
             }
             activity_docs_to_insert.append(doc)
             processed_count += 1
-            current_app.logger.debug(f"Prepared doc for insertion: P='{doc['process_name']}', T='{doc['window_title'][:30]}', Emp={employee_id}")
 
         except ValueError as ve: 
-            current_app.logger.warning(f"/api/log/activity: Invalid ISO time format in item {i} for {employee_id}. Error: {ve}. Data: {act_data}")
+            current_app.logger.warning(f"/api/log/activity: Invalid activity item {i} for {employee_id}. Error: {ve}. Data: {act_data}")
             malformed_count += 1
         except Exception as e_item:
             current_app.logger.error(f"/api/log/activity: Error processing item {i} for {employee_id}. Error: {e_item}. Data: {act_data}", exc_info=True)
             malformed_count += 1
 
+    if activity_docs_to_insert and activity_ingest.enabled:
+        malformed_msg = f" Skipped {malformed_count} malformed activities." if malformed_count > 0 else ""
+        try:
+            batch = activity_ingest.submit(employee_id, activity_docs_to_insert)
+        except IngestQueueFull as e_full:
+            # Back-pressure: don't drop the agent's data, fall through to a direct insert instead.
+            current_app.logger.warning(f"/api/log/activity: {e_full}. Writing {processed_count} activities for {employee_id} synchronously.")
+        else:
+            if not batch.wait(activity_ingest.wait_timeout):
+                msg = f"Accepted {processed_count} activities for {employee_id}; flush still pending." + malformed_msg
+                current_app.logger.warning(msg)
+                return jsonify({"status": "ok", "message": msg, "queued_count": processed_count, "malformed_count": malformed_count}), 202
+            if batch.error is not None:
+                current_app.logger.error(f"Queued activity_logs batch for {employee_id} failed to flush: {batch.error}")
+                return jsonify({"status": "error", "message": "Database error during bulk insert of activity logs"}), 500
+            presence.touch(db, employee_id, seen_at=server_batch_timestamp)
+            if activity_ingest.durability == 'queued':
+                msg = f"Queued {processed_count} activities for {employee_id}." + malformed_msg
+                current_app.logger.info(msg)
+                return jsonify({"status": "ok", "message": msg, "queued_count": processed_count, "malformed_count": malformed_count}), 202
+            msg = f"Logged {processed_count} activities for {employee_id}." + malformed_msg
+            current_app.logger.info(msg)
+            return jsonify({"status": "ok", "message": msg, "inserted_count": processed_count, "malformed_count": malformed_count}), 201
+
     if activity_docs_to_insert:
         try:
             result = db.activity_logs.insert_many(activity_docs_to_insert, ordered=False)
-            db.employees.update_one({"employee_id": employee_id}, {"$set": {"last_seen": server_batch_timestamp}})
+            try:
+                apply_rollups(db, activity_docs_to_insert)
+            except Exception as e_rollup:
+                current_app.logger.error(f"Hourly rollup update failed for {employee_id}: {e_rollup}")
+            dashboard_cache.invalidate_written(activity_docs_to_insert)
+            presence.touch(db, employee_id, seen_at=server_batch_timestamp)
             msg = f"Successfully logged {len(result.inserted_ids)} of {processed_count} activities for {employee_id}." + (f" Skipped {malformed_count} malformed activities." if malformed_count > 0 else "")
             current_app.logger.info(msg)
             return jsonify({"status": "ok", "message": msg, "inserted_count": len(result.inserted_ids), "malformed_count": malformed_count}), 201
@@ -162,6 +185,20 @@ def log_activity():
          current_app.logger.info(f"/api/log/activity: No activities were processed for insertion for {employee_id} (e.g., all skipped or list was effectively empty).")
          return jsonify({"status": "ok", "message": "No valid activities processed for insertion"}), 200
 
+def record_screenshot(db, employee_id, timestamp, filename, digest, packed=False):
+    """Logs a stored screenshot for the reports and queues its thumbnail. packed: the content is in the cold tier."""
+    log = {"employee_id": employee_id, "timestamp": timestamp,
+           "log_type": "screenshot", "screenshot_path": filename, "screenshot_sha256": digest}
+    if packed:
+        log["screenshot_packed"] = True
+    db.activity_logs.insert_one(log)
+    presence.touch(db, employee_id)
+    current_app.logger.info(f"Screenshot log created in DB for {filename}")
+    try:
+        thumbnails.enqueue(filename) # Report grid preview, rendered off the request path
+    except Exception as e_thumb:
+        current_app.logger.warning(f"Could not queue thumbnail for {filename}: {e_thumb}")
+
 @api_bp.route('/upload/screenshot', methods=['POST'])
 def upload_screenshot():
     if 'screenshot' not in request.files:
@@ -183,44 +220,154 @@ def upload_screenshot():
          return jsonify({"status": "error", "message": "Invalid timestamp format"}), 400
 
     db = get_db()
-    # Sanitize employee_id for filename to prevent path traversal or invalid characters
-    safe_employee_id = "".join(c if c.isalnum() or c in ['-', '_'] else "_" for c in employee_id)
-    if not safe_employee_id: safe_employee_id = "unknown_emp" # Fallback if sanitization results in empty
-
-    filename = f"{timestamp.strftime('%Y%m%d_%H%M%S_%f')}_{safe_employee_id}_{uuid.uuid4().hex[:8]}.png"
-    
     upload_folder = current_app.config.get('UPLOAD_FOLDER')
     if not upload_folder:
         current_app.logger.critical("/api/upload/screenshot: UPLOAD_FOLDER not configured in Flask app.")
         return jsonify({"status": "error", "message": "Server configuration error (upload path missing)"}), 500
-    
-    save_path = os.path.join(upload_folder, filename)
 
+    # Stored by content hash in a sharded layout (models/screenshot_store.py); identical frames share one file
+    filename = None
     try:
-        file.save(save_path)
-        current_app.logger.info(f"Screenshot saved to disk: {save_path} for {employee_id}")
-        db.activity_logs.insert_one({
-            "employee_id": employee_id, "timestamp": timestamp,
-            "log_type": "screenshot", "screenshot_path": filename,
-        })
-        db.employees.update_one({"employee_id": employee_id}, {"$set": {"last_seen": datetime.datetime.now(datetime.timezone.utc)}})
-        current_app.logger.info(f"Screenshot log created in DB for {filename}")
+        filename, digest, size, deduplicated = screenshot_store.store_stream(
+            db, upload_folder, file.stream, ext=screenshot_store.screenshot_extension(os.path.splitext(file.filename)[1]))
+        current_app.logger.info(f"Screenshot stored: {filename} for {employee_id} ({size} bytes{', duplicate' if deduplicated else ''})")
+        record_screenshot(db, employee_id, timestamp, filename, digest)
         return jsonify({"status": "ok", "message": "Screenshot uploaded successfully", "filename": filename}), 201
     except Exception as e:
-        current_app.logger.error(f"Error saving screenshot file or DB record for {employee_id} (Path: {save_path}): {e}", exc_info=True)
-        # Corrected try-except block for cleanup
-        if os.path.exists(save_path):
+        current_app.logger.error(f"Error saving screenshot file or DB record for {employee_id} (Path: {filename}): {e}", exc_info=True)
+        if filename:
+            # Drop the reference taken by store_stream; the file goes too if nothing else uses it
             try:
-                os.remove(save_path)
-                current_app.logger.info(f"Cleaned up partially saved screenshot: {save_path}")
-            except Exception as e_remove:
-                current_app.logger.error(f"Error removing partially saved screenshot {save_path}: {e_remove}")
+                screenshot_store.release(db, upload_folder, filename, current_app.config.get('PACK_FOLDER'))
+            except Exception as e_release:
+                current_app.logger.error(f"Error releasing screenshot {filename} after failed upload: {e_release}")
         return jsonify({"status": "error", "message": f"Could not save/log screenshot file: {str(e)}"}), 500
-    
+
     current_app.logger.error("/api/upload/screenshot: Reached end of function unexpectedly without explicit return.")
     return jsonify({"status": "error", "message": "Unknown file processing error"}), 500
 
 
+# Agents skip frames that look like the last uploaded one (difference hash) and send this record instead.
+# Consecutive unchanged frames after the same reference collapse into one activity_logs entry:
+#   {log_type: "screenshot", screenshot_path: <reference frame>, unchanged_since: <reference timestamp>,
+#    timestamp: <first unchanged frame>, unchanged_until: <latest unchanged frame>, unchanged_frames: N}
+# so the screenshots report shows the span once, with the reference frame and an "unchanged" badge.
+@api_bp.route('/upload/screenshot/unchanged', methods=['POST'])
+def record_unchanged_screenshot():
+    data = request.get_json(silent=True) or {}
+    employee_id, screenshot_path = data.get('employee_id'), data.get('screenshot_path')
+    try:
+        timestamp = datetime.datetime.fromisoformat(data.get('timestamp'))
+        since = datetime.datetime.fromisoformat(data.get('since'))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Missing or invalid timestamp/since"}), 400
+    if not employee_id or not screenshot_path:
+        return jsonify({"status": "error", "message": "Missing employee_id or screenshot_path"}), 400
+
+    db = get_db()
+    reference = db.activity_logs.find_one(
+        {"screenshot_path": screenshot_path, "log_type": "screenshot", "employee_id": employee_id},
+        {"screenshot_sha256": 1}
+    )
+    if not reference:
+        # Unknown or foreign reference frame: the agent uploads the full screenshot instead
+        return jsonify({"status": "error", "message": "Unknown reference screenshot"}), 409
+    try:
+        result = db.activity_logs.update_one(
+            {"employee_id": employee_id, "log_type": "screenshot", "unchanged_since": since, "timestamp": {"$gte": since}},
+            {"$setOnInsert": {"timestamp": timestamp, "screenshot_path": screenshot_path,
+                              "screenshot_sha256": reference.get("screenshot_sha256")},
+             "$max": {"unchanged_until": timestamp},
+             "$inc": {"unchanged_frames": 1}},
+            upsert=True
+        )
+        if result.upserted_id is not None and reference.get("screenshot_sha256"):
+            blob = screenshot_store.add_existing_reference(db, reference["screenshot_sha256"]) # The new entry references the frame too
+            if blob and blob.get("pack"):
+                db.activity_logs.update_one({"_id": result.upserted_id}, {"$set": {"screenshot_packed": True}})
+        presence.touch(db, employee_id)
+    except Exception as e:
+        current_app.logger.error(f"Error recording unchanged screenshot for {employee_id}: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": "Could not record screenshot"}), 500
+    return jsonify({"status": "ok", "message": "Unchanged screenshot recorded", "filename": screenshot_path}), 201
+
+# --- Chunked, resumable screenshot uploads (models/screenshot_store.py) ---
+# POST /upload/screenshot/init          {employee_id, timestamp, size, sha256, format} -> {upload_id, offset} or {complete, filename}
+# PUT  /upload/screenshot/<id>?offset=N raw bytes, streamed to disk            -> {offset}
+# POST /upload/screenshot/<id>/finalize                                         -> {filename}
+# A 409 carries the server's acknowledged offset so the agent resumes from there.
+
+def upload_error_response(e):
+    body = {"status": "error", "message": str(e)}
+    if e.offset is not None:
+        body["offset"] = e.offset
+    return jsonify(body), e.status
+
+@api_bp.route('/upload/screenshot/init', methods=['POST'])
+def init_screenshot_upload():
+    data = request.get_json(silent=True) or {}
+    employee_id, timestamp_str = data.get('employee_id'), data.get('timestamp')
+    size, digest = data.get('size'), data.get('sha256')
+    if not all([employee_id, timestamp_str, size, digest]):
+        return jsonify({"status": "error", "message": "Missing employee_id, timestamp, size or sha256"}), 400
+    try:
+        timestamp = datetime.datetime.fromisoformat(timestamp_str)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid timestamp format"}), 400
+    if isinstance(size, int) and size > current_app.config['MAX_SCREENSHOT_UPLOAD_BYTES']:
+        return jsonify({"status": "error", "message": "Screenshot too large"}), 413
+
+    db = get_db()
+    try:
+        upload, existing = screenshot_store.begin_upload(db, employee_id, timestamp, size, digest,
+                                                         ext=screenshot_store.screenshot_extension(data.get('format')))
+    except screenshot_store.UploadError as e:
+        return upload_error_response(e)
+    if existing:
+        # Identical frame already stored: record it without transferring any bytes
+        existing_path = existing["path"]
+        try:
+            record_screenshot(db, employee_id, timestamp, existing_path, digest.lower(), packed=bool(existing.get("pack")))
+        except Exception as e:
+            screenshot_store.release(db, current_app.config['UPLOAD_FOLDER'], existing_path, current_app.config.get('PACK_FOLDER'))
+            current_app.logger.error(f"Error recording deduplicated screenshot for {employee_id}: {e}", exc_info=True)
+            return jsonify({"status": "error", "message": "Could not record screenshot"}), 500
+        current_app.logger.info(f"Screenshot for {employee_id} matched stored content {existing_path}; no upload needed")
+        return jsonify({"status": "ok", "complete": True, "filename": existing_path}), 201
+    return jsonify({"status": "ok", "complete": False, "upload_id": upload["_id"], "offset": upload["offset"],
+                    "chunk_size": current_app.config['SCREENSHOT_UPLOAD_CHUNK_BYTES']}), 200
+
+@api_bp.route('/upload/screenshot/<upload_id>', methods=['PUT'])
+def put_screenshot_chunk(upload_id):
+    offset = request.args.get('offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({"status": "error", "message": "Missing or invalid offset"}), 400
+    try:
+        # request.stream is read directly: the chunk goes to the part file without being spooled first
+        new_offset = screenshot_store.write_chunk(get_db(), current_app.config['UPLOAD_FOLDER'], upload_id, offset,
+                                                  request.stream, current_app.config['SCREENSHOT_UPLOAD_CHUNK_BYTES'])
+    except screenshot_store.UploadError as e:
+        return upload_error_response(e)
+    return jsonify({"status": "ok", "offset": new_offset}), 200
+
+@api_bp.route('/upload/screenshot/<upload_id>/finalize', methods=['POST'])
+def finalize_screenshot_upload(upload_id):
+    db = get_db()
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    try:
+        filename, digest, size, upload = screenshot_store.finalize_upload(db, upload_folder, upload_id)
+    except screenshot_store.UploadError as e:
+        return upload_error_response(e)
+    try:
+        record_screenshot(db, upload["employee_id"], upload["timestamp"], filename, digest)
+    except Exception as e:
+        screenshot_store.release(db, upload_folder, filename, current_app.config.get('PACK_FOLDER'))
+        current_app.logger.error(f"Error recording chunked screenshot {filename}: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": "Could not record screenshot"}), 500
+    current_app.logger.info(f"Chunked screenshot upload {upload_id} finalized: {filename} ({size} bytes)")
+    return jsonify({"status": "ok", "message": "Screenshot uploaded successfully", "filename": filename}), 201
+
+
 @api_bp.route('/download/agent')
 @login_required
 def download_agent_exe():
@@ -244,22 +391,17 @@ def download_agent_exe():
 @api_bp.route('/active_employees', methods=['GET'])
 @login_required
 def get_active_employees():
-    db = get_db()
-    active_threshold_minutes = current_app.config.get('ACTIVE_EMPLOYEE_THRESHOLD_MINUTES', 5)
-    active_threshold = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=active_threshold_minutes)
+    # Answered from the presence tracker's in-memory view; no Mongo round-trip per poll.
     try:
-        active_emps_cursor = db.employees.find(
-            {"last_seen": {"$gte": active_threshold}, "status": {"$in": ["active", "pending_rename"]}},
-            {"_id": 1, "display_name": 1, "employee_id": 1}
-        ).sort("display_name", 1).limit(15)
-        
-        active_emps_list = []
-        for emp in active_emps_cursor:
-            emp['_id'] = str(emp['_id'])
-            active_emps_list.append(emp)
-        
+        active_emps_list = presence.active_employees(get_db(), limit=15)
         current_app.logger.debug(f"Returning {len(active_emps_list)} active employees for sidebar.")
         return jsonify(active_emps_list)
     except Exception as e:
         current_app.logger.error(f"Error fetching active_employees: {e}", exc_info=True)
-        return jsonify({"error": "Could not retrieve active employees list"}), 500
\ No newline at end of file
+        return jsonify({"error": "Could not retrieve active employees list"}), 500
+
+@api_bp.route('/metrics', methods=['GET'])
+@login_required
+def get_metrics():
+    """Internal counters for the admin (ingest queue depth, flush timings, ...)."""
+    return jsonify({"ingest": activity_ingest.stats(), "presence": presence.stats(), "dashboard_cache": dashboard_cache.stats()})
@@ -2,6 +2,7 @@
 
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app, g
 from models.db import get_db
+from utils.cache import session_user_cache
 import bcrypt
 from functools import wraps
 from bson import ObjectId
@@ -29,7 +30,8 @@ def login_required(f):
             session.clear()
             return redirect(url_for('auth.login'))
 
-        user = get_db().users.find_one({"_id": user_obj_id})
+        # Served from a short-TTL cache; settings.change_password invalidates it
+        user = session_user_cache.get_user(get_db(), user_obj_id)
 
         if not user:
             flash("User session not found. Please log in again.", "warning")
@@ -101,6 +103,8 @@ def login():
 @auth_bp.route('/logout')
 def logout():
     username = session.get('username', 'unknown user')
+    if 'user_id' in session:
+        session_user_cache.invalidate(session['user_id'])
     session.clear()
     current_app.logger.info(f"User '{username}' logged out.")
     flash('You have been successfully logged out.', 'info')
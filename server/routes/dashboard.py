@@ -2,6 +2,8 @@
 from flask import Blueprint, render_template, session, request, current_app
 from routes.auth import login_required # g might be implicitly used by this decorator
 from models.db import get_db
+from models import rollups, dashboard_queries
+from utils.cache import dashboard_cache
 import datetime
 from dateutil.relativedelta import relativedelta
 
@@ -48,6 +50,82 @@ def format_seconds(total_seconds):
     minutes, seconds = divmod(remainder, 60)
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
+def _query_threads():
+    return current_app.config.get('DASHBOARD_QUERY_THREADS', 8)
+
+def activity_panel_queries(db, start_date, end_date, selected_employee_id):
+    """
+    The activity_logs/rollup aggregations behind the dashboard panels, as {name: callable} for run_concurrently.
+    Working time, Top 5 and work hours share one $match and come back from a single $facet aggregation;
+    the average start time pipeline runs alongside it.
+    """
+    # Whole-hour ranges (every period this page offers) are answered from the hourly rollups,
+    # so cost scales with hours in range instead of raw activity volume.
+    use_rollups = current_app.config.get('DASHBOARD_USE_ROLLUPS', True) and rollups.is_hour_aligned(start_date, end_date)
+    if use_rollups:
+        activity_source = db[rollups.ROLLUP_COLLECTION]
+        facet_pipeline = rollups.activity_facet_pipeline(start_date, end_date, selected_employee_id)
+    else:
+        activity_source = db.activity_logs
+        facet_pipeline = dashboard_queries.activity_facet_pipeline(start_date, end_date, selected_employee_id)
+    avg_start_pipeline = dashboard_queries.avg_start_pipeline(start_date, end_date, selected_employee_id)
+    return {
+        "activity_facets": lambda: list(activity_source.aggregate(facet_pipeline)),
+        "avg_start": lambda: list(db.activity_logs.aggregate(avg_start_pipeline)),
+    }
+
+def build_activity_panels(results, selected_employee_id):
+    """
+    Turns the activity_panel_queries results into the panel values.
+    Returns (panels, complete); complete is False if any aggregation failed, so the result isn't cached.
+    """
+    logger = current_app.logger
+    complete = not any(isinstance(results[name], Exception) for name in ("activity_facets", "avg_start"))
+
+    # 2. Average Start Time (Filtered by selected_employee_id if provided)
+    avg_start_time_str = "N/A"
+    avg_start_result = results["avg_start"]
+    if not isinstance(avg_start_result, Exception):
+        if avg_start_result and avg_start_result[0].get('avg_hour') is not None:
+            avg_h = int(avg_start_result[0]['avg_hour'])
+            avg_m = int(avg_start_result[0]['avg_minute'])
+            avg_start_time_str = f"{avg_h:02d}:{avg_m:02d}"
+        else:
+             logger.info(f"Could not calculate average start time for selection (Employee: {selected_employee_id or 'All'}).")
+
+    working_time_str = "00:00:00"
+    top_websites_data = []
+    work_hours_data_list = []
+    facets = results["activity_facets"]
+    if not isinstance(facets, Exception):
+        facets = facets[0] if facets else {}
+
+        # 3. Working Time (Filtered by selected_employee_id if provided)
+        work_time_result = facets.get("working_time", [])
+        if work_time_result and work_time_result[0].get('total_duration'):
+            working_time_str = format_seconds(work_time_result[0].get('total_duration', 0))
+
+        # 5. Top 5 Websites/Applications (Filtered by selected_employee_id if provided)
+        top_websites_data = [{"name": item['_id'] if item['_id'] else "Unknown", "duration": item.get('total_duration',0)} for item in facets.get("top_sites", [])]
+        if not top_websites_data:
+            logger.info(f"No activity found for Top 5 Websites/Apps for selection (Employee: {selected_employee_id or 'All'}).")
+
+        # 6. Work Hours (Total) Table (Filtered by selected_employee_id if provided)
+        for item in facets.get("work_hours", []):
+             work_hours_data_list.append({
+                "name": item.get("display_name", item.get("employee_id", "Unknown")),
+                "employee_id": item.get("employee_id", "Unknown"),
+                "man_days": item.get("man_days", 0),
+                "work_hours": format_seconds(item.get('total_seconds',0))
+            })
+
+    return {
+        "avg_start_time": avg_start_time_str,
+        "team_working_time": working_time_str,
+        "top_websites": top_websites_data,
+        "work_hours_data": work_hours_data_list,
+    }, complete
+
 @dashboard_bp.route('/dashboard')
 @login_required
 def view_dashboard():
@@ -63,130 +141,60 @@ def view_dashboard():
     start_date, end_date = get_date_range(selected_period, custom_start_str, custom_end_str)
     current_app.logger.info(f"Dashboard: Period='{selected_period}', Employee='{selected_employee_id or 'All'}', Range: {start_date} to {end_date}")
 
-    filter_employees_list = []
-    pending_rename_count = 0
-    try:
-        filter_employees_list = list(db.employees.find({}, {"employee_id": 1, "display_name": 1, "_id": 0}).sort("display_name", 1))
-        pending_rename_count = db.employees.count_documents({"status": "pending_rename"})
-    except Exception as e:
-        current_app.logger.error(f"Error fetching base employee data for dashboard: {e}")
-        # Continue with empty list / 0 count
-
-    base_match_criteria = {"timestamp": {"$gte": start_date, "$lte": end_date}}
+    # Latest Activity Seen (Filtered by selected_employee_id if provided)
+    latest_seen_filter = {"last_seen": {"$exists": True}}
     if selected_employee_id:
-        base_match_criteria["employee_id"] = selected_employee_id
-
-    # 1. Member Counts (Overall, not filtered by selected_employee_id for these specific cards)
-    team_members_count = db.employees.count_documents({})
-    tracked_members_count = db.employees.count_documents({"status": {"$nin": ["inactive", "disabled"]}})
+        latest_seen_filter["employee_id"] = selected_employee_id
 
-    # 2. Average Start Time (Filtered by selected_employee_id if provided)
-    avg_start_match = {"start_time": {"$gte": start_date, "$lte": end_date}} # Filter by activity start time
-    if selected_employee_id:
-        avg_start_match["employee_id"] = selected_employee_id
-
-    avg_start_pipeline = [
-        {"$match": avg_start_match},
-        {"$group": {"_id": {"employee_id": "$employee_id", "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$start_time", "timezone": "UTC"}}}, "first_activity_time": {"$min": "$start_time"}}},
-        {"$project": {"_id": 0, "start_hour": {"$hour": {"date": "$first_activity_time", "timezone": "UTC"}}, "start_minute": {"$minute": {"date": "$first_activity_time", "timezone": "UTC"}}}},
-        {"$group": {"_id": None, "avg_hour": {"$avg": "$start_hour"}, "avg_minute": {"$avg": "$start_minute"}}}
-    ]
-    avg_start_time_str = "N/A"
-    try:
-        avg_start_result = list(db.activity_logs.aggregate(avg_start_pipeline))
-        if avg_start_result and avg_start_result[0].get('avg_hour') is not None:
-            avg_h = int(avg_start_result[0]['avg_hour'])
-            avg_m = int(avg_start_result[0]['avg_minute'])
-            avg_start_time_str = f"{avg_h:02d}:{avg_m:02d}"
-        else:
-             current_app.logger.info(f"Could not calculate average start time for selection (Employee: {selected_employee_id or 'All'}).")
-    except Exception as e:
-        current_app.logger.error(f"Error in Avg Start Time aggregation: {e}")
+    # 2, 3, 5, 6. Activity panels, cached per (period, start, end, employee). On a miss their aggregations join
+    # the employee lookups in one batch on the query pool, so the page waits for the slowest query only.
+    panels_cache_entry, panels = dashboard_cache.lookup(selected_period, start_date, end_date, selected_employee_id)
+    queries = {
+        "filter_list": lambda: list(db.employees.find({}, {"employee_id": 1, "display_name": 1, "_id": 0}).sort("display_name", 1)),
+        "pending_renames": lambda: db.employees.count_documents({"status": "pending_rename"}),
+        "team_members": lambda: db.employees.count_documents({}),
+        "tracked_members": lambda: db.employees.count_documents({"status": {"$nin": ["inactive", "disabled"]}}),
+        "latest_seen": lambda: db.employees.find_one(latest_seen_filter, {"last_seen": 1}, sort=[("last_seen", -1)]),
+    }
+    if panels is None:
+        queries.update(activity_panel_queries(db, start_date, end_date, selected_employee_id))
+    query_results = dashboard_queries.run_concurrently(queries, current_app.logger, label="Dashboard", max_workers=_query_threads())
+    if panels is None:
+        panels, complete = build_activity_panels(query_results, selected_employee_id)
+        dashboard_cache.store(panels_cache_entry, panels, complete)
+
+    def employee_result(name, default):
+        # Failed lookups are already logged by run_concurrently; fall back to an empty value
+        result = query_results[name]
+        return default if isinstance(result, Exception) else result
+
+    filter_employees_list = employee_result("filter_list", [])
+    pending_rename_count = employee_result("pending_renames", 0)
 
+    # 1. Member Counts (Overall, not filtered by selected_employee_id for these specific cards)
+    team_members_count = employee_result("team_members", 0)
+    tracked_members_count = employee_result("tracked_members", 0)
 
-    # 3. Working Time (Filtered by selected_employee_id if provided)
-    working_time_match = {**base_match_criteria, "duration_seconds": {"$exists": True, "$gt": 0}}
-    work_time_pipeline = [
-        {"$match": working_time_match},
-        {"$group": {"_id": None, "total_duration": {"$sum": "$duration_seconds"}}}
-    ]
-    working_time_str = "00:00:00"
     team_working_time_label = "Team Working Time" if not selected_employee_id else "Selected User Working Time"
-    try:
-        work_time_result = list(db.activity_logs.aggregate(work_time_pipeline))
-        if work_time_result and work_time_result[0].get('total_duration'):
-            working_time_str = format_seconds(work_time_result[0].get('total_duration', 0))
-    except Exception as e:
-        current_app.logger.error(f"Error in Working Time aggregation: {e}")
 
-
-    # 4. Latest Activity Seen (Filtered by selected_employee_id if provided)
-    latest_seen_filter = {"last_seen": {"$exists": True}}
-    if selected_employee_id:
-        latest_seen_filter["employee_id"] = selected_employee_id
-    
+    # 4. Latest Activity Seen
     latest_activity_seen_str = "N/A"
-    try:
-        latest_seen_employee = db.employees.find_one(latest_seen_filter, sort=[("last_seen", -1)])
-        if latest_seen_employee and latest_seen_employee.get('last_seen'):
-            # Check if the latest activity is within the currently viewed date range for relevance
-            if start_date <= latest_seen_employee['last_seen'] <= end_date:
-                 latest_activity_seen_str = latest_seen_employee['last_seen'].strftime("%H:%M")
-    except Exception as e:
-        current_app.logger.error(f"Error fetching Latest Activity Seen: {e}")
-
-
-    # 5. Top 5 Websites/Applications (Filtered by selected_employee_id if provided)
-    top_sites_match = {**base_match_criteria, "duration_seconds": {"$exists": True, "$gt": 0}, "$or": [{"window_title": {"$exists": True, "$ne": ""}}, {"process_name": {"$exists": True, "$ne": ""}}]}
-    top_sites_pipeline = [
-        {"$match": top_sites_match},
-        {"$project": {"activity_name": {"$ifNull": ["$window_title", "$process_name"]}, "duration_seconds": 1}},
-        {"$group": {"_id": "$activity_name", "total_duration": {"$sum": "$duration_seconds"}}},
-        {"$sort": {"total_duration": -1}}, {"$limit": 5}
-    ]
-    top_websites_data = []
-    try:
-        top_sites_result = list(db.activity_logs.aggregate(top_sites_pipeline))
-        top_websites_data = [{"name": item['_id'] if item['_id'] else "Unknown", "duration": item.get('total_duration',0)} for item in top_sites_result]
-        if not top_websites_data:
-            current_app.logger.info(f"No activity found for Top 5 Websites/Apps for selection (Employee: {selected_employee_id or 'All'}).")
-    except Exception as e:
-        current_app.logger.error(f"Error in Top Websites aggregation: {e}")
-
-    # 6. Work Hours (Total) Table (Filtered by selected_employee_id if provided)
-    work_hours_match = {**base_match_criteria, "duration_seconds": {"$exists": True, "$gt": 0}}
-    work_hours_pipeline = [
-        {"$match": work_hours_match},
-        {"$group": {"_id": "$employee_id", "total_seconds": {"$sum": "$duration_seconds"}, "unique_days": {"$addToSet": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp", "timezone": "UTC"}}}}},
-        {"$lookup": {"from": "employees", "localField": "_id", "foreignField": "employee_id", "as": "employee_info"}},
-        {"$unwind": {"path": "$employee_info", "preserveNullAndEmptyArrays": True}},
-        {"$project": {"_id": 0, "employee_id": "$_id", "display_name": "$employee_info.display_name", "total_seconds": 1, "man_days": {"$size": "$unique_days"}}},
-        {"$sort": {"display_name": 1}}
-    ]
-    work_hours_data_list = []
-    try:
-        work_hours_result = list(db.activity_logs.aggregate(work_hours_pipeline))
-        for item in work_hours_result:
-             work_hours_data_list.append({
-                "name": item.get("display_name", item.get("employee_id", "Unknown")),
-                "employee_id": item.get("employee_id", "Unknown"),
-                "man_days": item.get("man_days", 0),
-                "work_hours": format_seconds(item.get('total_seconds',0))
-            })
-    except Exception as e:
-        current_app.logger.error(f"Error in Work Hours aggregation: {e}")
-
+    latest_seen_employee = employee_result("latest_seen", None)
+    if latest_seen_employee and latest_seen_employee.get('last_seen'):
+        # Check if the latest activity is within the currently viewed date range for relevance
+        if start_date <= latest_seen_employee['last_seen'] <= end_date:
+             latest_activity_seen_str = latest_seen_employee['last_seen'].strftime("%H:%M")
 
     return render_template('dashboard.html',
                            username=session.get('username'),
-                           avg_start_time=avg_start_time_str,
-                           team_working_time=working_time_str,
+                           avg_start_time=panels["avg_start_time"],
+                           team_working_time=panels["team_working_time"],
                            team_working_time_label=team_working_time_label,
                            avg_last_seen=latest_activity_seen_str,
                            team_members_count=team_members_count,
                            tracked_members_count=tracked_members_count,
-                           top_websites=top_websites_data,
-                           work_hours_data=work_hours_data_list,
+                           top_websites=panels["top_websites"],
+                           work_hours_data=panels["work_hours_data"],
                            filter_employees_list=filter_employees_list,
                            pending_rename_count=pending_rename_count,
                            active_page='dashboard',
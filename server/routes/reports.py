@@ -1,14 +1,22 @@
 # /root/EMS/server/routes/reports.py
 from flask import (
     Blueprint, render_template, request, current_app, session,
-    send_from_directory, abort, flash, redirect, url_for
+    send_from_directory, abort, flash, redirect, url_for,
+    Response, stream_with_context
 )
 from routes.auth import login_required
 from models.db import get_db
+from utils.helpers import keyset_page, cached_count
+from utils.thumbnails import thumbnails
+from utils.cache import LRUCacheBackend
+from models import screenshot_store, screenshot_packs
+from utils.export import ACTIVITY_EXPORT_FIELDS, EXPORT_FORMATS, csv_chunks, ndjson_chunks, encode_chunks
 from bson import ObjectId
 import datetime
 from dateutil.relativedelta import relativedelta
 import os
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import secure_filename
 
 reports_bp = Blueprint('reports', __name__)
 
@@ -33,6 +41,26 @@ def get_report_date_range(start_str=None, end_str=None):
     end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
     return start_date, end_date
 
+def fetch_report_page(collection, filter_criteria, per_page, count_key):
+    """
+    Keyset-paginated page for the report views, driven by the 'after'/'before' cursor args.
+    The exact total is only computed (and then cached) when the page is requested with count=1.
+    Returns (items, older_cursor, newer_cursor, total or None).
+    """
+    after = request.args.get('after')
+    before = request.args.get('before')
+    try:
+        items, older_cursor, newer_cursor = keyset_page(collection, filter_criteria, per_page, after=after, before=before)
+    except ValueError as e:
+        current_app.logger.warning(f"Ignoring invalid report cursor (after={after}, before={before}): {e}")
+        flash("The requested page is no longer valid. Showing the newest entries.", "warning")
+        items, older_cursor, newer_cursor = keyset_page(collection, filter_criteria, per_page)
+    total = None
+    if request.args.get('count') == '1':
+        total = cached_count(collection, filter_criteria, count_key,
+                             ttl=current_app.config.get('REPORT_COUNT_CACHE_TTL_SECONDS', 300))
+    return items, older_cursor, newer_cursor, total
+
 @reports_bp.route('/')
 @login_required
 def index():
@@ -66,8 +94,6 @@ def activity_log_report():
     selected_employee_id = request.args.get('employee_id')
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
-    page = request.args.get('page', 1, type=int)
-    skip_count = (page - 1) * REPORTS_PER_PAGE
 
     start_date, end_date = get_report_date_range(start_date_str, end_date_str)
     filter_criteria = {"timestamp": {"$gte": start_date, "$lte": end_date}}
@@ -78,37 +104,88 @@ def activity_log_report():
         filter_criteria["employee_id"] = None # Effectively no results if not selected
 
     activity_logs = []
-    total_logs = 0
+    total_logs = None
+    older_cursor = newer_cursor = None
     if selected_employee_id:
         try:
             # Ensure log_type is not screenshot for activity logs
             filter_criteria["log_type"] = {"$ne": "screenshot"}
-            total_logs = db.activity_logs.count_documents(filter_criteria)
-            activity_logs = list(db.activity_logs.find(filter_criteria)
-                                 .sort("timestamp", -1)
-                                 .skip(skip_count)
-                                 .limit(REPORTS_PER_PAGE))
+            activity_logs, older_cursor, newer_cursor, total_logs = fetch_report_page(
+                db.activity_logs, filter_criteria, REPORTS_PER_PAGE,
+                f"activity:{selected_employee_id}:{start_date.isoformat()}:{end_date.isoformat()}")
         except Exception as e:
             current_app.logger.error(f"Error fetching activity logs for report: {e}")
             flash("Error retrieving activity logs.", "danger")
     elif not selected_employee_id and (start_date_str or end_date_str):
         flash("Please select an employee to view their activity log.", "info")
 
-
-    total_pages = (total_logs + REPORTS_PER_PAGE - 1) // REPORTS_PER_PAGE
-
     return render_template('reports/activity_log.html',
                            employees=employees,
                            selected_employee_id=selected_employee_id,
                            activity_logs=activity_logs,
                            start_date_str=start_date.strftime('%Y-%m-%d'),
                            end_date_str=end_date.strftime('%Y-%m-%d'),
-                           current_page=page,
-                           total_pages=total_pages,
+                           older_cursor=older_cursor,
+                           newer_cursor=newer_cursor,
+                           total_logs=total_logs,
                            active_page='reports',
                            pending_rename_count=pending_rename_count)
 
 
+@reports_bp.route('/activity_log/export', methods=['GET'])
+@login_required
+def export_activity_log():
+    """
+    Streams activity logs as CSV (default) or NDJSON straight from a server-side cursor.
+    employee_id is optional ('all' or empty exports every employee); gzip=1 compresses the stream.
+    Rows are written as the cursor yields them, so memory use doesn't grow with the range.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+    selected_employee_id = request.args.get('employee_id')
+    if selected_employee_id == 'all':
+        selected_employee_id = None
+    start_date, end_date = get_report_date_range(request.args.get('start_date'), request.args.get('end_date'))
+    use_gzip = request.args.get('gzip') == '1'
+
+    filter_criteria = {"timestamp": {"$gte": start_date, "$lte": end_date}, "log_type": {"$ne": "screenshot"}}
+    if selected_employee_id:
+        filter_criteria["employee_id"] = selected_employee_id
+
+    projection = {field: 1 for field in ACTIVITY_EXPORT_FIELDS}
+    projection["_id"] = 0
+    cursor = (get_db().activity_logs.find(filter_criteria, projection)
+              .sort("timestamp", 1)
+              .batch_size(current_app.config.get('EXPORT_BATCH_SIZE', 2000)))
+
+    username = session.get('username')
+    logger = current_app.logger
+    logger.info(f"User '{username}' exporting activity logs ({export_format}, employee={selected_employee_id or 'all'}, "
+                f"{start_date.date()}..{end_date.date()}, gzip={use_gzip})")
+
+    def generate():
+        rows = 0
+        def counted(docs):
+            nonlocal rows
+            for doc in docs:
+                rows += 1
+                yield doc
+        chunker = csv_chunks if export_format == 'csv' else ndjson_chunks
+        try:
+            yield from encode_chunks(chunker(counted(cursor), ACTIVITY_EXPORT_FIELDS),
+                                     gzip_level=current_app.config.get('EXPORT_GZIP_LEVEL', 6) if use_gzip else None)
+            logger.info(f"Activity export for '{username}' finished: {rows} row(s)")
+        finally:
+            cursor.close() # Also runs when the client disconnects mid-download
+
+    filename = secure_filename(f"activity_{selected_employee_id or 'all'}_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}"
+                f".{export_format}{'.gz' if use_gzip else ''}")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    mimetype = 'application/gzip' if use_gzip else EXPORT_FORMATS[export_format]
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
 @reports_bp.route('/screenshots', methods=['GET'])
 @login_required
 def screenshot_report():
@@ -125,8 +202,6 @@ def screenshot_report():
     selected_employee_id = request.args.get('employee_id')
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
-    page = request.args.get('page', 1, type=int)
-    skip_count = (page - 1) * SCREENSHOTS_PER_PAGE
 
     start_date, end_date = get_report_date_range(start_date_str, end_date_str)
     filter_criteria = {
@@ -141,56 +216,179 @@ def screenshot_report():
         filter_criteria["employee_id"] = None # Effectively no results if not selected
 
     screenshots = []
-    total_screenshots = 0
+    total_screenshots = None
+    older_cursor = newer_cursor = None
     if selected_employee_id:
         try:
-            total_screenshots = db.activity_logs.count_documents(filter_criteria)
-            screenshots = list(db.activity_logs.find(filter_criteria)
-                               .sort("timestamp", -1)
-                               .skip(skip_count)
-                               .limit(SCREENSHOTS_PER_PAGE))
+            screenshots, older_cursor, newer_cursor, total_screenshots = fetch_report_page(
+                db.activity_logs, filter_criteria, SCREENSHOTS_PER_PAGE,
+                f"screenshots:{selected_employee_id}:{start_date.isoformat()}:{end_date.isoformat()}")
         except Exception as e:
             current_app.logger.error(f"Error fetching screenshots for report: {e}")
             flash("Error retrieving screenshots.", "danger")
     elif not selected_employee_id and (start_date_str or end_date_str):
         flash("Please select an employee to view their screenshots.", "info")
-
-    total_pages = (total_screenshots + SCREENSHOTS_PER_PAGE - 1) // SCREENSHOTS_PER_PAGE
-
     return render_template('reports/screenshots.html',
                            employees=employees,
                            selected_employee_id=selected_employee_id,
                            screenshots=screenshots,
                            start_date_str=start_date.strftime('%Y-%m-%d'),
                            end_date_str=end_date.strftime('%Y-%m-%d'),
-                           current_page=page,
-                           total_pages=total_pages,
+                           older_cursor=older_cursor,
+                           newer_cursor=newer_cursor,
+                           total_screenshots=total_screenshots,
                            active_page='reports',
                            pending_rename_count=pending_rename_count)
 
 
+# Screenshots and their thumbnails never change once written (content-addressed names; legacy names
+# carry a uuid), so they're served with strong ETags and immutable caching. Filenames already checked
+# against activity_logs are remembered per process so repeat views skip Mongo.
+_authorized_screenshots = LRUCacheBackend(max_entries=4096)
+_packed_entries = LRUCacheBackend(max_entries=4096) # Pack index entries never change once written
+_SCREENSHOT_MIMETYPES = {'.png': 'image/png', '.webp': 'image/webp', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg'}
+
+def is_safe_screenshot_path(filename):
+    return not ('..' in filename or filename.startswith('/') or filename.startswith('\\') or '\0' in filename)
+
+def screenshot_log_state(filename):
+    """
+    'loose' or 'packed' (moved to the cold tier) if an activity log references this screenshot, else None.
+    Cached for SCREENSHOT_AUTH_CACHE_TTL_SECONDS, so a repeat view knows where the bytes are without Mongo or disk.
+    """
+    state = _authorized_screenshots.get(filename)
+    if state:
+        return state
+    doc = get_db().activity_logs.find_one({"screenshot_path": filename, "log_type": "screenshot"}, {"_id": 0, "screenshot_packed": 1})
+    if doc is None: # An unmarked log projects to {}
+        return None
+    state = 'packed' if doc.get("screenshot_packed") else 'loose'
+    _authorized_screenshots.set(filename, state, ttl=current_app.config.get('SCREENSHOT_AUTH_CACHE_TTL_SECONDS', 600))
+    return state
+
+def screenshot_is_authorized(filename):
+    """True if an activity log references this screenshot."""
+    return screenshot_log_state(filename) is not None
+
+def screenshot_etag(filename, full_path):
+    """The content hash for content-addressed files (no disk access); mtime/size for legacy flat files."""
+    if screenshot_store.is_content_addressed(filename):
+        return os.path.splitext(filename.split('/')[-1])[0]
+    stat = os.stat(full_path) # Raises FileNotFoundError for a missing file
+    return f"{int(stat.st_mtime)}-{stat.st_size}"
+
+def packed_screenshot_entry(filename):
+    """Pack index entry for a screenshot moved to the cold tier (positive lookups cached per process)."""
+    entry = _packed_entries.get(filename)
+    if entry is None:
+        entry = screenshot_packs.find_entry(get_db(), filename)
+        if entry is not None:
+            _packed_entries.set(filename, entry)
+    return entry
+
+def serve_immutable_file(directory, relpath, etag, accel_prefix=None, body=None, mimetype=None):
+    """
+    Answers If-None-Match with 304, otherwise hands the file to the front proxy (X-Accel-Redirect under
+    accel_prefix, or X-Sendfile via Flask's USE_X_SENDFILE) or streams it from Python.
+    body/mimetype serve bytes already in memory (packed screenshots) instead of a file.
+    """
+    max_age = current_app.config.get('SCREENSHOT_CACHE_MAX_AGE', 31536000)
+    mimetype = mimetype or _SCREENSHOT_MIMETYPES.get(os.path.splitext(relpath)[1].lower(), 'application/octet-stream')
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    elif body is not None:
+        response = current_app.response_class(body, mimetype=mimetype)
+    elif accel_prefix:
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{relpath}"
+    else:
+        response = send_from_directory(directory, relpath, mimetype=mimetype, etag=False, conditional=False)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = True
+    return response
+
+
+@reports_bp.route('/thumbnail/<path:filename>')
+@login_required
+def thumbnail(filename):
+    """
+    Small WebP/JPEG preview of a screenshot for the report grid. Rendered on the thumbnail pool
+    (at upload time, or here on first request) and cached by the browser like the screenshot itself.
+    """
+    if not is_safe_screenshot_path(filename) or not screenshot_is_authorized(filename):
+        abort(404)
+    etag = None
+    if screenshot_store.is_content_addressed(filename):
+        # Known without touching the disk, so a revalidation never renders or stats anything
+        etag = f"{os.path.splitext(filename.split('/')[-1])[0]}-{thumbnails.fmt}{thumbnails.max_size}"
+        if request.if_none_match.contains(etag):
+            return serve_immutable_file(thumbnails.folder, filename, etag)
+    thumb_path = thumbnails.ensure(filename, timeout=current_app.config.get('THUMBNAIL_WAIT_SECONDS', 5))
+    if not thumb_path:
+        # Pillow missing or rendering failed/slow: fall back to the full image
+        return redirect(url_for('reports.view_screenshot', filename=filename))
+    relpath = os.path.relpath(thumb_path, thumbnails.folder).replace(os.sep, '/')
+    if etag is None:
+        stat = os.stat(thumb_path)
+        etag = f"{int(stat.st_mtime)}-{stat.st_size}"
+    return serve_immutable_file(thumbnails.folder, relpath, etag,
+                                accel_prefix=current_app.config.get('THUMBNAIL_ACCEL_REDIRECT_PREFIX'))
+
+
+def serve_loose_screenshot(screenshot_dir, filename):
+    """Response for a screenshot file under UPLOAD_FOLDER, or None if it isn't there."""
+    full_path = os.path.join(screenshot_dir, filename)
+    accel_prefix = current_app.config.get('SCREENSHOT_ACCEL_REDIRECT_PREFIX')
+    try:
+        etag = screenshot_etag(filename, full_path)
+        # The proxy can't fall back to the packs, so check the file is still loose before handing it over
+        # (a screenshot tiered after its state was cached, or a deduped log on a packed blob). A 304 needs no file.
+        if accel_prefix and not request.if_none_match.contains(etag) and not os.path.isfile(full_path):
+            return None
+        return serve_immutable_file(screenshot_dir, filename, etag, accel_prefix=accel_prefix)
+    except (FileNotFoundError, NotFound):
+        return None
+
+def serve_packed_screenshot(screenshot_dir, filename):
+    """Response for a screenshot in the cold tier's packs (models/screenshot_packs.py), or None if it isn't packed."""
+    entry = packed_screenshot_entry(filename)
+    if entry is None:
+        return None
+    etag = f"pack-{entry['pack'].replace('/', '-')}-{entry['offset']}" # Re-encoded bytes, so not the content hash
+    if request.if_none_match.contains(etag):
+        return serve_immutable_file(screenshot_dir, filename, etag)
+    pack_path = os.path.join(current_app.config['PACK_FOLDER'], *entry["pack"].split('/'))
+    body = screenshot_packs.pack_reader.read(pack_path, entry["offset"], entry["length"])
+    return serve_immutable_file(screenshot_dir, filename, etag, body=body, mimetype=entry["mimetype"])
+
+
 @reports_bp.route('/view_screenshot/<path:filename>')
 @login_required
 def view_screenshot(filename):
-    if '..' in filename or filename.startswith('/') or filename.startswith('\\') or '\0' in filename:
+    if not is_safe_screenshot_path(filename):
         current_app.logger.warning(f"Attempted invalid path for screenshot: {filename} by user {session.get('username')}")
         abort(404)
     screenshot_dir = current_app.config['UPLOAD_FOLDER']
-    db = get_db()
-    log_entry = db.activity_logs.find_one({"screenshot_path": filename, "log_type": "screenshot"})
-    if not log_entry:
+    state = screenshot_log_state(filename)
+    if state is None:
         current_app.logger.warning(f"Screenshot not found in logs or access denied for filename: {filename} (User: {session.get('username')})")
         abort(404)
     full_file_path = os.path.join(screenshot_dir, filename)
-    if not os.path.isfile(full_file_path):
-        current_app.logger.error(f"Screenshot file missing on disk but present in logs: {full_file_path} (User: {session.get('username')})")
-        abort(404)
     try:
-        current_app.logger.info(f"Serving screenshot: {filename} to user {session.get('username')}")
-        return send_from_directory(screenshot_dir, filename)
+        # The logged state picks the first place to look, without a stat; the other one covers a screenshot
+        # tiered since its state was cached (or packed before packs were marked in activity_logs)
+        sources = (serve_packed_screenshot, serve_loose_screenshot) if state == 'packed' else (serve_loose_screenshot, serve_packed_screenshot)
+        for serve in sources:
+            response = serve(screenshot_dir, filename)
+            if response is not None:
+                current_app.logger.debug(f"Serving screenshot: {filename} to user {session.get('username')}")
+                return response
+        raise FileNotFoundError(full_file_path)
     except FileNotFoundError:
-        current_app.logger.error(f"send_from_directory could not find screenshot: {filename} in {screenshot_dir}")
+        current_app.logger.error(f"Screenshot file missing on disk but present in logs: {full_file_path} (User: {session.get('username')})")
         abort(404)
     except Exception as e:
         current_app.logger.error(f"Unexpected error serving screenshot {filename}: {e}")
-        abort(500)
\ No newline at end of file
+        abort(500)
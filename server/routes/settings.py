@@ -4,6 +4,7 @@ from flask import (
 )
 from models.db import get_db
 from routes.auth import login_required
+from utils.cache import session_user_cache
 import bcrypt
 from bson import ObjectId
 
@@ -76,6 +77,7 @@ def change_password():
                 {"_id": user_obj_id},
                 {"$set": {"password_hash": hashed_new_password}}
             )
+            session_user_cache.invalidate(user_obj_id)
             flash("Password changed successfully. Please log in again with your new password.", "success")
             current_app.logger.info(f"User '{user.get('username')}' changed their password.")
             session.clear() # Log out user after password change
@@ -3,6 +3,8 @@ from flask import (
     Blueprint, render_template, request, redirect, url_for, flash, current_app, session
 )
 from models.db import get_db
+from models.presence import presence
+from models.search import search_filter, search_tokens
 from routes.auth import login_required # g might be implicitly used here
 from bson import ObjectId # For converting string ID back to ObjectId
 import datetime # Not strictly used in this version but good to have for future features
@@ -25,18 +27,17 @@ def list_users():
     filter_criteria = {}
 
     if search_query:
-        # Case-insensitive search on display_name or employee_id
-        # If status_filter is also a search term, it will be part of $or
-        regex_query = {"$regex": search_query, "$options": "i"}
-        search_or_conditions = [
-            {"display_name": regex_query},
-            {"employee_id": regex_query}
-        ]
+        # Word-prefix search on display_name / employee_id, served by the search_tokens index
+        search_or_conditions = []
+        token_filter = search_filter(search_query)
+        if token_filter:
+            search_or_conditions.append(token_filter)
         # Allow searching for status text as well
         if search_query.lower() in ["active", "inactive", "pending_rename", "disabled", "pending"]:
             search_or_conditions.append({"status": {"$regex": f"^{search_query}$", "$options": "i"}}) # Exact match for status search
-        
-        filter_criteria["$or"] = search_or_conditions
+
+        # A query with no searchable words (e.g. only punctuation) matches nothing
+        filter_criteria["$or"] = search_or_conditions or [{"_id": None}]
 
     if status_filter: # If a specific status filter is applied (e.g., from sidebar link)
         filter_criteria["status"] = status_filter
@@ -123,11 +124,13 @@ def edit_user(employee_doc_id):
 
         update_data = {
             "display_name": new_display_name,
+            "search_tokens": search_tokens(new_display_name, employee.get('employee_id')),
             "status": new_status,
             "updated_at": datetime.datetime.now(datetime.timezone.utc) # Track updates
         }
         try:
             result = db.employees.update_one({"_id": obj_id}, {"$set": update_data})
+            presence.update_employee(employee.get('employee_id'), display_name=new_display_name, status=new_status)
             if result.modified_count > 0:
                 flash(f"Employee '{new_display_name}' updated successfully.", "success")
                 current_app.logger.info(
@@ -0,0 +1,26 @@
+# /root/EMS/server/tests/conftest.py
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))) # Server modules import as top-level packages
+
+# Tests that need MongoDB use a throwaway database on MONGO_TEST_URI and are skipped when none answers.
+MONGO_TEST_URI = os.environ.get('MONGO_TEST_URI') or 'mongodb://localhost:27017'
+
+
+@pytest.fixture(scope='module')
+def mongo_db():
+    pymongo = pytest.importorskip('pymongo')
+    client = pymongo.MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=1000, tz_aware=True)
+    try:
+        client.admin.command('ping')
+    except pymongo.errors.PyMongoError as e:
+        client.close()
+        pytest.skip(f"No MongoDB at {MONGO_TEST_URI}: {e}")
+    name = f"ems_test_{uuid.uuid4().hex[:8]}"
+    yield client[name]
+    client.drop_database(name)
+    client.close()
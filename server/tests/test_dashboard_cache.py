@@ -0,0 +1,65 @@
+# /root/EMS/server/tests/test_dashboard_cache.py
+import datetime
+
+import pytest
+from flask import Flask
+
+from utils.cache import DashboardCache
+
+UTC = datetime.timezone.utc
+
+
+@pytest.fixture
+def cache():
+    app = Flask(__name__)
+    app.config.update(DASHBOARD_CACHE_INVALIDATE_INTERVAL_SECONDS=0)
+    return DashboardCache(app)
+
+
+def today():
+    return datetime.datetime.now(UTC).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def last_week():
+    return today() - datetime.timedelta(days=8), today() - datetime.timedelta(days=1)
+
+
+def cached(cache, start, end, employee_id=None, value="panels"):
+    entry, _ = cache.lookup('weekly', start, end, employee_id)
+    cache.store(entry, value)
+    return cache.lookup('weekly', start, end, employee_id)[1]
+
+
+def activity(employee_id, start):
+    return {"employee_id": employee_id, "start_time": start, "end_time": start + datetime.timedelta(minutes=5)}
+
+
+@pytest.mark.parametrize('employee_id', [None, 'emp-1'])
+def test_past_dated_write_drops_past_ranges(cache, employee_id):
+    start, end = last_week()
+    assert cached(cache, start, end, employee_id) == "panels"
+    cache.invalidate_written([activity('emp-2', start + datetime.timedelta(days=2))]) # e.g. an outbox replay
+    assert cache.lookup('weekly', start, end, employee_id)[1] is None
+
+
+def test_todays_writes_keep_past_ranges(cache):
+    start, end = last_week()
+    cached(cache, start, end)
+    cache.invalidate_written([activity('emp-1', datetime.datetime.now(UTC))])
+    assert cache.lookup('weekly', start, end, None)[1] == "panels"
+
+
+def test_naive_start_times_count_as_utc(cache):
+    start, end = last_week()
+    cached(cache, start, end)
+    cache.invalidate_written([activity('emp-1', (start + datetime.timedelta(days=1)).replace(tzinfo=None))])
+    assert cache.lookup('weekly', start, end, None)[1] is None
+
+
+def test_past_ranges_expire(cache, monkeypatch):
+    start, end = last_week()
+    entry, _ = cache.lookup('weekly', start, end, None)
+    ttls = []
+    monkeypatch.setattr(cache.backend, 'set', lambda key, value, ttl=None: ttls.append(ttl))
+    cache.store(entry, "panels")
+    assert ttls == [3600]
@@ -0,0 +1,52 @@
+# /root/EMS/server/tests/test_ingest_spill.py
+import datetime
+import os
+
+import pytest
+from flask import Flask
+from pymongo.errors import BulkWriteError
+
+from models.rollups import ROLLUP_COLLECTION
+from utils.ingest import ActivityIngestQueue
+
+START = datetime.datetime(2025, 3, 3, 9, 0, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def ingest(tmp_path):
+    app = Flask(__name__)
+    app.config.update(INGEST_SPILL_FOLDER=str(tmp_path), INGEST_SPILL_RETRY_SECONDS=0)
+    return ActivityIngestQueue(app)
+
+
+def activities(employee_id, count):
+    return [{"employee_id": employee_id, "log_type": "activity", "window_title": "Mail", "process_name": "OUTLOOK.EXE",
+             "timestamp": START + datetime.timedelta(minutes=i), "start_time": START + datetime.timedelta(minutes=i),
+             "duration_seconds": 60, "is_active": True} for i in range(count)]
+
+
+def rolled_up_seconds(db, employee_id):
+    return sum(r["total_seconds"] for r in db[ROLLUP_COLLECTION].find({"employee_id": employee_id}))
+
+
+def test_replaying_a_spill_file_twice_counts_rollups_once(mongo_db, ingest, tmp_path):
+    ingest._spill(activities("emp-spill", 3))
+    (name,) = os.listdir(tmp_path)
+    content = (tmp_path / name).read_text()
+
+    ingest._replay_spilled(mongo_db)
+    assert os.listdir(tmp_path) == []
+    # A worker that died between the insert and removing the file leaves it to be replayed again
+    (tmp_path / name).write_text(content)
+    ingest._replay_spilled(mongo_db)
+
+    assert os.listdir(tmp_path) == []
+    assert mongo_db.activity_logs.count_documents({"employee_id": "emp-spill"}) == 3
+    assert rolled_up_seconds(mongo_db, "emp-spill") == 180
+
+
+def test_only_documents_a_failed_write_rejected_are_unwritten():
+    docs = activities("emp-partial", 4)
+    error = BulkWriteError({"writeErrors": [{"index": 1, "code": 11000}, {"index": 3, "code": 121}]})
+    assert ActivityIngestQueue._unwritten(docs, error) == [docs[3]]
+    assert ActivityIngestQueue._unwritten(docs, ConnectionError("reset")) == docs
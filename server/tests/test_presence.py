@@ -0,0 +1,28 @@
+# /root/EMS/server/tests/test_presence.py
+import os
+
+import pytest
+from flask import Flask
+
+from models.presence import PresenceTracker
+
+
+@pytest.fixture
+def tracker():
+    tracker = PresenceTracker(Flask(__name__))
+    tracker._pid = os.getpid() # Flushed by hand below instead of by the background thread
+    return tracker
+
+
+def test_deleted_employee_is_created_again_on_the_next_touch(mongo_db, tracker):
+    first_id = tracker.touch(mongo_db, "emp-gone", hostname="desk-1")
+    tracker.flush(mongo_db)
+
+    mongo_db.employees.delete_one({"employee_id": "emp-gone"})
+    tracker.touch(mongo_db, "emp-gone", hostname="desk-1") # Still cached, so only queued for the flush
+    tracker.flush(mongo_db)
+    assert tracker.stats()["forgotten"] == 1
+
+    second_id = tracker.touch(mongo_db, "emp-gone", hostname="desk-1")
+    assert second_id != first_id
+    assert mongo_db.employees.count_documents({"employee_id": "emp-gone"}) == 1
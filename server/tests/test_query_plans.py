@@ -0,0 +1,71 @@
+# /root/EMS/server/tests/test_query_plans.py
+import datetime
+
+import pytest
+
+from models import indexes
+from models.rollups import apply_rollups
+from models.search import search_tokens
+
+EMPLOYEES = 40
+LOGS_PER_EMPLOYEE = 300
+SCREENSHOT_EVERY = 10
+
+
+@pytest.fixture(scope='module')
+def seeded_db(mongo_db):
+    """Registry indexes plus a week of activity for a few dozen employees, enough for the planner to choose."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    employees = []
+    for i in range(EMPLOYEES):
+        display_name = f"User {i}"
+        employees.append({
+            "employee_id": f"emp-{i}", "display_name": display_name,
+            "status": ("active", "pending_rename", "inactive")[i % 3],
+            "last_seen": now - datetime.timedelta(minutes=i),
+            "search_tokens": search_tokens(display_name, f"emp-{i}"),
+        })
+    mongo_db.employees.insert_many(employees)
+    mongo_db.users.insert_many([{"username": f"admin{i}"} for i in range(3)])
+
+    logs = []
+    for i in range(EMPLOYEES):
+        for n in range(LOGS_PER_EMPLOYEE):
+            start = now - datetime.timedelta(days=6, minutes=-n * 30)
+            if n % SCREENSHOT_EVERY == 0:
+                logs.append({"employee_id": f"emp-{i}", "timestamp": start, "log_type": "screenshot",
+                             "screenshot_path": f"{i:02x}/{n:08x}.webp"})
+            else:
+                logs.append({"employee_id": f"emp-{i}", "timestamp": start, "log_type": "activity",
+                             "window_title": f"Window {n % 7}", "process_name": "app.exe", "start_time": start,
+                             "end_time": start + datetime.timedelta(minutes=5), "duration_seconds": 300, "is_active": True})
+    mongo_db.activity_logs.insert_many(logs)
+    apply_rollups(mongo_db, logs)
+    indexes.ensure_indexes(mongo_db, log=lambda message: None)
+    return mongo_db
+
+
+@pytest.fixture(scope='module')
+def plan_results(seeded_db):
+    return {name: (result, problem) for name, result, problem in
+            indexes.check_query_plans(seeded_db, 'emp-1', screenshot_path='01/00000000.webp', min_examined=500)}
+
+
+@pytest.mark.parametrize('shape_name', [shape.name for shape in indexes.query_shapes('emp-1')])
+def test_query_shape_uses_an_index(plan_results, shape_name):
+    result, problem = plan_results[shape_name]
+    assert problem is None, f"{shape_name}: {problem} (plan: {'/'.join(result['stages'])})"
+
+
+def test_missing_index_is_reported(seeded_db):
+    """The check itself must catch a regression: without the username index, login falls back to a COLLSCAN."""
+    seeded_db.users.drop_index([("username", 1)])
+    try:
+        results = {name: problem for name, _, problem in indexes.check_query_plans(seeded_db, 'emp-1')}
+        assert results['users.by_username'] == "collection scan"
+    finally:
+        indexes.ensure_indexes(seeded_db, log=lambda message: None)
+
+
+def test_registry_matches_database(seeded_db):
+    assert indexes.missing_indexes(seeded_db) == {}
@@ -0,0 +1,67 @@
+# /root/EMS/server/tests/test_screenshot_packs.py
+import datetime
+import io
+import os
+
+import pytest
+
+from models import screenshot_packs, screenshot_store
+
+Image = pytest.importorskip('PIL.Image')
+DAY = datetime.datetime(2025, 3, 3, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def folders(tmp_path):
+    upload_folder, pack_folder = tmp_path / "screenshots", tmp_path / "packs"
+    upload_folder.mkdir()
+    return str(upload_folder), str(pack_folder)
+
+
+def png_bytes(color):
+    out = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(out, 'PNG')
+    return out.getvalue()
+
+
+def test_dedup_and_release_follow_a_tiered_blob(mongo_db, folders):
+    upload_folder, pack_folder = folders
+    relpath, digest, _, _ = screenshot_store.store_stream(mongo_db, upload_folder, io.BytesIO(png_bytes((10, 20, 30))))
+    mongo_db.activity_logs.insert_one({"employee_id": "emp-pack", "timestamp": DAY + datetime.timedelta(hours=9),
+                                       "log_type": "screenshot", "screenshot_path": relpath, "screenshot_sha256": digest})
+
+    summary = screenshot_packs.tier_day(mongo_db, upload_folder, pack_folder, DAY, log=lambda message: None)
+    assert summary["screenshots"] == 1
+    assert not os.path.exists(os.path.join(upload_folder, *relpath.split('/')))
+    entry = screenshot_packs.find_entry(mongo_db, relpath)
+    pack_path = os.path.join(pack_folder, *entry["pack"].split('/'))
+
+    # A later identical frame is deduplicated onto the packed blob, and learns it is packed
+    blob = screenshot_store.add_existing_reference(mongo_db, digest)
+    assert blob["path"] == relpath
+    assert blob["pack"]["pack"] == entry["pack"] and blob["pack"]["offset"] == entry["offset"]
+
+    # The last reference takes the pack entry, and the pack once nothing else points into it
+    assert not screenshot_store.release(mongo_db, upload_folder, relpath, pack_folder)
+    assert screenshot_store.release(mongo_db, upload_folder, relpath, pack_folder)
+    assert mongo_db[screenshot_store.BLOB_COLLECTION].find_one({"_id": digest}) is None
+    assert screenshot_packs.find_entry(mongo_db, relpath) is None
+    assert not os.path.exists(pack_path)
+
+
+def test_loose_copy_of_packed_content_is_replaced_by_the_pack(mongo_db, folders):
+    upload_folder, pack_folder = folders
+    relpath, digest, _, _ = screenshot_store.store_stream(mongo_db, upload_folder, io.BytesIO(png_bytes((200, 10, 10))))
+    first = {"employee_id": "emp-loose", "timestamp": DAY + datetime.timedelta(hours=10),
+             "log_type": "screenshot", "screenshot_path": relpath, "screenshot_sha256": digest}
+    mongo_db.activity_logs.insert_one(dict(first))
+    screenshot_packs.tier_day(mongo_db, upload_folder, pack_folder, DAY, log=lambda message: None)
+
+    # The same frame uploaded again puts a loose copy back; its log isn't marked until the next tiering run
+    screenshot_store.store_stream(mongo_db, upload_folder, io.BytesIO(png_bytes((200, 10, 10))))
+    mongo_db.activity_logs.insert_one(dict(first, timestamp=DAY + datetime.timedelta(hours=11)))
+    assert os.path.exists(os.path.join(upload_folder, *relpath.split('/')))
+
+    screenshot_packs.tier_day(mongo_db, upload_folder, pack_folder, DAY, log=lambda message: None)
+    assert not os.path.exists(os.path.join(upload_folder, *relpath.split('/')))
+    assert mongo_db.activity_logs.count_documents({"screenshot_path": relpath, "screenshot_packed": True}) == 2
@@ -0,0 +1,59 @@
+# /root/EMS/server/tests/test_screenshot_serving.py
+import datetime
+
+import pytest
+from flask import Flask
+
+from models import screenshot_packs
+from routes import reports
+
+FILENAME = "ab/ab/" + "ab" * 32 + ".png" # Content-addressed: the ETag is the hash
+PACKED_BYTES = b"RIFF\x00\x00\x00\x00WEBPVP8 packed"
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(UPLOAD_FOLDER=str(tmp_path / "screenshots"), PACK_FOLDER=str(tmp_path / "packs"),
+                      SCREENSHOT_ACCEL_REDIRECT_PREFIX='/protected/screenshots')
+    (tmp_path / "screenshots").mkdir()
+    return app
+
+
+@pytest.fixture
+def packed(app, monkeypatch):
+    """FILENAME exists only in a pack; its log state is cached as 'loose' (tiered after the view was cached)."""
+    pack_relpath, entries = screenshot_packs._write_pack(
+        app.config['PACK_FOLDER'], "emp-1", datetime.datetime(2025, 3, 3), [(FILENAME, PACKED_BYTES, 1000)])
+    entry = dict(entries[0], mimetype='image/webp')
+    monkeypatch.setattr(reports, 'screenshot_log_state', lambda filename: 'loose')
+    monkeypatch.setattr(reports, 'packed_screenshot_entry', lambda filename: entry if filename == FILENAME else None)
+    return entry
+
+
+def view(app, headers=None):
+    with app.test_request_context(f'/view_screenshot/{FILENAME}', headers=headers or {}):
+        return reports.view_screenshot.__wrapped__(FILENAME) # Past login_required
+
+
+def test_packed_screenshot_is_not_offloaded_to_the_proxy(app, packed):
+    response = view(app)
+    assert response.status_code == 200
+    assert 'X-Accel-Redirect' not in response.headers
+    assert response.get_data() == PACKED_BYTES
+    assert response.mimetype == 'image/webp'
+
+
+def test_loose_screenshot_is_offloaded_to_the_proxy(app, packed, tmp_path):
+    loose = tmp_path / "screenshots" / "ab" / "ab"
+    loose.mkdir(parents=True)
+    (loose / FILENAME.split('/')[-1]).write_bytes(b"\x89PNG loose")
+    response = view(app)
+    assert response.headers['X-Accel-Redirect'] == f"/protected/screenshots/{FILENAME}"
+    assert response.get_data() == b""
+
+
+def test_revalidation_of_loose_etag_needs_no_file(app, packed):
+    response = view(app, headers={'If-None-Match': '"' + "ab" * 32 + '"'})
+    assert response.status_code == 304
+    assert 'X-Accel-Redirect' not in response.headers
@@ -0,0 +1,36 @@
+# /root/EMS/server/tests/test_screenshot_store.py
+import datetime
+import hashlib
+
+from models import indexes, screenshot_store
+
+DATA = b"\x89PNG identical frame"
+DIGEST = hashlib.sha256(DATA).hexdigest()
+TAKEN = datetime.datetime(2025, 3, 3, 9, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+
+
+def test_identical_frames_upload_side_by_side(mongo_db, tmp_path):
+    indexes.ensure_indexes(mongo_db, log=lambda message: None)
+    first, _ = screenshot_store.begin_upload(mongo_db, "emp-up", TAKEN, len(DATA), DIGEST)
+    second, _ = screenshot_store.begin_upload(mongo_db, "emp-up", TAKEN + datetime.timedelta(seconds=30), len(DATA), DIGEST)
+    assert first["_id"] != second["_id"]
+
+    # A retry of the first frame (same timestamp, as the agent resends it) resumes the same upload
+    retry, _ = screenshot_store.begin_upload(mongo_db, "emp-up", TAKEN, len(DATA), DIGEST)
+    assert retry["_id"] == first["_id"]
+
+    upload_folder = str(tmp_path)
+    for upload in (first, second):
+        screenshot_store.write_chunk(mongo_db, upload_folder, upload["_id"], 0, _Stream(DATA), len(DATA))
+    timestamps = {screenshot_store.finalize_upload(mongo_db, upload_folder, upload["_id"])[3]["timestamp"] for upload in (first, second)}
+    assert len(timestamps) == 2 # Each finalize still knows its own frame's timestamp
+    assert mongo_db[screenshot_store.BLOB_COLLECTION].find_one({"_id": DIGEST})["refcount"] == 2
+
+
+class _Stream:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, n):
+        chunk, self.data = self.data[:n], self.data[n:]
+        return chunk
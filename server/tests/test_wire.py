@@ -0,0 +1,104 @@
+# /root/EMS/server/tests/test_wire.py
+import datetime
+import json
+
+import pytest
+from flask import Flask, request
+
+from routes.api import api_bp
+from utils import wire
+
+msgpack = pytest.importorskip('msgpack')
+
+START_MS = 1741000000000 # 2025-03-03T11:06:40Z
+START = datetime.datetime(2025, 3, 3, 11, 6, 40, tzinfo=datetime.timezone.utc)
+DICT_BATCH = {"e": "emp-1", "t": ["Inbox - Outlook", "OUTLOOK.EXE", "Idle", "idle"], "b": START_MS,
+              "r": [[0, 1, 0, 12250, 1], [2, 3, 750, 600000, 0], [0, 1, 0, 1000, 1]]}
+
+
+@pytest.fixture(scope='module')
+def app():
+    app = Flask(__name__)
+    app.config.update(AGENT_API_KEY='test-key')
+    app.register_blueprint(api_bp, url_prefix='/api')
+    return app
+
+
+def decode(app, body, content_type):
+    with app.test_request_context('/api/log/activity', method='POST', data=body, content_type=content_type):
+        return wire.read_activity_payload(request)
+
+
+def test_json_batch_passes_through(app):
+    payload = {"employee_id": "emp-1", "activities": [{"window_title": "Mail", "start_time": START.isoformat()}]}
+    assert decode(app, json.dumps(payload), 'application/json') == (payload, 'json')
+
+
+def test_msgpack_batch_gets_long_top_level_keys(app):
+    activity = {"w": "Mail", "p": "OUTLOOK.EXE", "s": START_MS, "n": START_MS + 30000, "d": 30, "i": True}
+    data, wire_format = decode(app, msgpack.packb({"e": "emp-1", "a": [activity]}), 'application/msgpack')
+    assert wire_format == 'msgpack'
+    assert data == {"employee_id": "emp-1", "activities": [activity]}
+    assert wire.parse_activity_item(activity, wire_format) == (
+        "Mail", "OUTLOOK.EXE", START, START + datetime.timedelta(seconds=30), 30, True)
+
+
+@pytest.mark.parametrize('encode, content_type', [
+    (json.dumps, 'application/json'),
+    (msgpack.packb, 'application/msgpack'),
+])
+def test_dictionary_batch_expands_in_either_body_format(app, encode, content_type):
+    data, wire_format = decode(app, encode(DICT_BATCH), content_type)
+    assert wire_format == 'dict'
+    assert data["employee_id"] == "emp-1"
+    items = [wire.parse_activity_item(act, wire_format) for act in data["activities"]]
+    idle_start = START + datetime.timedelta(milliseconds=13000)
+    assert items == [
+        ("Inbox - Outlook", "OUTLOOK.EXE", START, START + datetime.timedelta(milliseconds=12250), 12, True),
+        ("Idle", "idle", idle_start, idle_start + datetime.timedelta(minutes=10), 600, False),
+        ("Inbox - Outlook", "OUTLOOK.EXE", idle_start + datetime.timedelta(minutes=10),
+         idle_start + datetime.timedelta(minutes=10, seconds=1), 1, True),
+    ]
+
+
+@pytest.mark.parametrize('batch', [
+    dict(DICT_BATCH, r=[[0, 4, 0, 1000, 1]]), # Index past the string table
+    dict(DICT_BATCH, r=[[-1, 1, 0, 1000, 1]]),
+    dict(DICT_BATCH, r=[[0, 1, 0, -5, 1]]), # Negative duration
+    dict(DICT_BATCH, r=[[0, 1, 0, 1000]]), # Short row
+    dict(DICT_BATCH, r=[[True, 1, 0, 1000, 1]]), # bool is not an index
+    dict(DICT_BATCH, r=[[0, 1, "0", 1000, 1]]),
+    dict(DICT_BATCH, b="1741000000000"),
+    {k: v for k, v in DICT_BATCH.items() if k != "b"},
+    dict(DICT_BATCH, t="Inbox - Outlook"),
+])
+def test_malformed_dictionary_batch_is_rejected(batch):
+    with pytest.raises(ValueError):
+        wire.expand_dictionary_batch(batch)
+
+
+def test_batch_without_string_table_is_not_a_dictionary_batch(app):
+    # Only bodies with both 't' and 'r' are dictionary batches; anything else keeps its own format
+    batch = {k: v for k, v in DICT_BATCH.items() if k != "t"}
+    assert decode(app, json.dumps(batch), 'application/json') == (batch, 'json')
+
+
+def test_malformed_dictionary_batch_is_a_400(app):
+    response = app.test_client().post('/api/log/activity', data=json.dumps(dict(DICT_BATCH, r=[[9, 1, 0, 1000, 1]])),
+                                      content_type='application/json', headers={'X-API-KEY': 'test-key'})
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Malformed payload"
+
+
+def test_msgpack_without_server_support_is_a_415_listing_what_is_accepted(app, monkeypatch):
+    monkeypatch.setattr(wire, 'msgpack', None)
+    response = app.test_client().post('/api/log/activity', data=msgpack.packb(DICT_BATCH),
+                                      content_type='application/msgpack', headers={'X-API-KEY': 'test-key'})
+    assert response.status_code == 415
+    assert response.get_json()["activity_formats"] == ['json', 'json+dict']
+
+
+def test_accepted_formats_follow_msgpack_availability(monkeypatch):
+    assert wire.accepted_activity_formats() == ['json', 'json+dict', 'msgpack', 'msgpack+dict']
+    monkeypatch.setattr(wire, 'msgpack', None)
+    assert wire.accepted_activity_formats() == ['json', 'json+dict']
@@ -0,0 +1,257 @@
+# /root/EMS/server/utils/cache.py
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.connection import Client, Listener
+
+
+class LRUCacheBackend:
+    """Thread-safe in-process LRU with optional per-entry TTL."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict() # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            expires_at, value = self._data.get(key, (None, 0))
+            self._data[key] = (expires_at, value + 1)
+            self._data.move_to_end(key)
+            return value + 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SharedCacheBackend:
+    """
+    Client for a cache process started with `flask cache-server`, so every gunicorn
+    worker sees the same entries. Errors degrade to cache misses instead of failing the request.
+    """
+
+    def __init__(self, address, authkey, logger=None):
+        self.address = address
+        self.authkey = authkey
+        self.logger = logger
+        self._local = threading.local() # One connection per thread; Connection objects aren't thread-safe
+
+    def _call(self, op, *args):
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            try:
+                if conn is None:
+                    conn = self._local.conn = Client(self.address, authkey=self.authkey)
+                conn.send((op, args))
+                return conn.recv()
+            except (OSError, EOFError) as e:
+                self._local.conn = None
+                if attempt == 1 and self.logger:
+                    self.logger.warning(f"Shared cache at {self.address} unavailable ({op}): {e}")
+        return None
+
+    def get(self, key):
+        return self._call('get', key)
+
+    def set(self, key, value, ttl=None):
+        self._call('set', key, value, ttl)
+
+    def delete(self, key):
+        self._call('delete', key)
+
+    def incr(self, key):
+        return self._call('incr', key) or 0
+
+
+def serve_cache(address, authkey, max_entries=4096):
+    """Runs the shared cache process (blocking). One thread per worker connection."""
+    store = LRUCacheBackend(max_entries=max_entries)
+    listener = Listener(address, authkey=authkey)
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                conn.send(getattr(store, op)(*args) if op in ('get', 'set', 'delete', 'incr') else None)
+
+    while True:
+        conn = listener.accept()
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
+class DashboardCache:
+    """
+    Caches computed dashboard panels keyed on (period, start, end, employee_id).
+    Ranges that include today expire after DASHBOARD_CACHE_TODAY_TTL_SECONDS and, for a single
+    employee, are invalidated when log_activity writes for that employee (generation counter in the key).
+    Ranges that ended before today only change when past-dated activity arrives (outbox replays, spill
+    replays, backfill-rollups): those writes bump a global generation that is part of every key, and
+    past entries expire after DASHBOARD_CACHE_PAST_TTL_SECONDS in any case (the bump can't reach
+    another process's 'memory' backend).
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._last_invalidated = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.today_ttl = app.config.get('DASHBOARD_CACHE_TODAY_TTL_SECONDS', 60)
+        self.past_ttl = app.config.get('DASHBOARD_CACHE_PAST_TTL_SECONDS', 3600)
+        self.invalidate_interval = app.config.get('DASHBOARD_CACHE_INVALIDATE_INTERVAL_SECONDS', 1.0)
+        backend = app.config.get('DASHBOARD_CACHE_BACKEND', 'memory')
+        if backend == 'shared':
+            self.backend = SharedCacheBackend(parse_address(app.config['DASHBOARD_CACHE_ADDRESS']),
+                                              app.config['SECRET_KEY'].encode('utf-8'), logger=app.logger)
+        elif backend == 'memory':
+            self.backend = LRUCacheBackend(max_entries=app.config.get('DASHBOARD_CACHE_MAX_ENTRIES', 1024))
+        else:
+            self.backend = None # 'none' disables caching
+        self.backend_name = backend
+        app.extensions['dashboard_cache'] = self
+
+    def _bump(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_ratio"] = round(snapshot["hits"] / lookups, 3) if lookups else None
+        snapshot["backend"] = self.backend_name
+        if isinstance(self.backend, LRUCacheBackend):
+            snapshot["entries"] = len(self.backend)
+        return snapshot
+
+    def lookup(self, period, start_date, end_date, employee_id):
+        """Returns (entry, value); value is None on a miss. Pass entry to store() once the value is computed."""
+        if self.backend is None:
+            return None, None
+        now = datetime.datetime.now(datetime.timezone.utc)
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        includes_today = end_date >= today_start
+        key = f"dash:{period}:{start_date.isoformat()}:{end_date.isoformat()}:{employee_id or '*'}:G{self.backend.get('gen:*') or 0}"
+        if includes_today and employee_id:
+            key += f":g{self.backend.get(f'gen:{employee_id}') or 0}"
+        value = self.backend.get(key)
+        self._bump("hits" if value is not None else "misses")
+        return (key, includes_today), value
+
+    def store(self, entry, value, cacheable=True):
+        """Stores a value computed after a lookup() miss; partial results (failed aggregations) aren't stored."""
+        if entry is None or not cacheable:
+            return
+        key, includes_today = entry
+        self.backend.set(key, value, ttl=self.today_ttl if includes_today else self.past_ttl)
+
+    def invalidate_employee(self, employee_id):
+        """Called on ingest; drops today's cached panels for this employee (throttled per employee)."""
+        if self.backend is None:
+            return
+        now = time.monotonic()
+        if now - self._last_invalidated.get(employee_id, 0) < self.invalidate_interval:
+            return
+        self._last_invalidated[employee_id] = now
+        self.backend.incr(f"gen:{employee_id}")
+        self._bump("invalidations")
+
+    def invalidate_all(self, throttle=False):
+        """Drops every cached panel, past ranges and team-wide ones included (bumps the global generation)."""
+        if self.backend is None:
+            return
+        now = time.monotonic()
+        if throttle and now - self._last_invalidated.get('*', 0) < self.invalidate_interval:
+            return
+        self._last_invalidated['*'] = now
+        self.backend.incr('gen:*')
+        self._bump("invalidations")
+
+    def invalidate_written(self, docs):
+        """Called once activity_logs documents are written: per employee, plus everything if any predate today."""
+        for employee_id in {doc["employee_id"] for doc in docs}:
+            self.invalidate_employee(employee_id)
+        today_start = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        for doc in docs:
+            start = doc.get("start_time")
+            if start is not None and (start if start.tzinfo else start.replace(tzinfo=datetime.timezone.utc)) < today_start:
+                self.invalidate_all(throttle=True)
+                break
+
+
+dashboard_cache = DashboardCache()
+
+
+class SessionUserCache:
+    """
+    Short-lived per-process cache of the logged-in admin's user document, keyed by session user id,
+    so login_required doesn't hit Mongo on every request. Entries never hold the password hash.
+    Password/role changes call invalidate(); other workers pick the change up once the TTL lapses.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('SESSION_USER_CACHE_TTL_SECONDS', 30)
+        # TTL of 0 disables the cache
+        self.backend = LRUCacheBackend(max_entries=app.config.get('SESSION_USER_CACHE_MAX_ENTRIES', 256)) if self.ttl > 0 else None
+        app.extensions['session_user_cache'] = self
+
+    def get_user(self, db, user_obj_id):
+        """Returns the user document (without password_hash) or None if the user no longer exists."""
+        key = str(user_obj_id)
+        if self.backend is not None:
+            user = self.backend.get(key)
+            if user is not None:
+                return user
+        user = db.users.find_one({"_id": user_obj_id}, {"password_hash": 0})
+        if user is not None and self.backend is not None:
+            self.backend.set(key, user, ttl=self.ttl)
+        return user
+
+    def invalidate(self, user_id):
+        if self.backend is not None:
+            self.backend.delete(str(user_id))
+
+
+session_user_cache = SessionUserCache()
@@ -0,0 +1,112 @@
+# /root/EMS/server/utils/compression.py
+import io
+import json
+import zlib
+
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import get_input_stream
+
+try:
+    import zstandard # Optional: only needed for 'Content-Encoding: zstd'
+except ImportError:
+    zstandard = None
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class DecompressionLimitExceeded(Exception):
+    """The decoded body would be larger than the configured limit (likely a decompression bomb)."""
+
+
+def _inflate(stream, limit, wbits):
+    """zlib/gzip decode that never holds more than limit+1 decoded bytes in memory."""
+    decompressor = zlib.decompressobj(wbits)
+    out = bytearray()
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        data = chunk
+        while data:
+            out += decompressor.decompress(data, limit - len(out) + 1)
+            if len(out) > limit:
+                raise DecompressionLimitExceeded(f"Decoded body exceeds {limit} bytes")
+            data = decompressor.unconsumed_tail
+        if decompressor.eof:
+            break
+    out += decompressor.flush()
+    if len(out) > limit:
+        raise DecompressionLimitExceeded(f"Decoded body exceeds {limit} bytes")
+    if not decompressor.eof:
+        raise ValueError("Truncated compressed body")
+    return bytes(out)
+
+
+def _unzstd(stream, limit):
+    out = bytearray()
+    with zstandard.ZstdDecompressor().stream_reader(stream, read_size=READ_CHUNK_SIZE) as reader:
+        while True:
+            chunk = reader.read(min(READ_CHUNK_SIZE, limit - len(out) + 1))
+            if not chunk:
+                break
+            out += chunk
+            if len(out) > limit:
+                raise DecompressionLimitExceeded(f"Decoded body exceeds {limit} bytes")
+    return bytes(out)
+
+
+def supported_encodings():
+    encodings = ['gzip', 'deflate']
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+
+def decode_body(stream, encoding, limit):
+    """Decodes a request body stream for the given Content-Encoding."""
+    if encoding in ('gzip', 'x-gzip'):
+        return _inflate(stream, limit, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return _inflate(stream, limit, zlib.MAX_WBITS)
+    if encoding == 'zstd' and zstandard is not None:
+        return _unzstd(stream, limit)
+    raise LookupError(encoding)
+
+
+class RequestDecompressionMiddleware:
+    """
+    WSGI middleware that transparently decodes compressed request bodies for the agent API.
+    The decoded body replaces wsgi.input before Flask sees the request, so request.get_json()
+    and request.files work unchanged. Decoding is capped at max_decoded_bytes.
+    """
+
+    def __init__(self, wsgi_app, path_prefixes=('/api/',), max_decoded_bytes=16 * 1024 * 1024):
+        self.wsgi_app = wsgi_app
+        self.path_prefixes = tuple(path_prefixes)
+        self.max_decoded_bytes = max_decoded_bytes
+
+    @staticmethod
+    def _error(status, message, environ, start_response):
+        body = json.dumps({"status": "error", "message": message})
+        headers = {"Accept-Encoding": ", ".join(supported_encodings())} if status == 415 else None
+        return Response(body, status=status, mimetype='application/json', headers=headers)(environ, start_response)
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if not encoding or encoding == 'identity' or not environ.get('PATH_INFO', '').startswith(self.path_prefixes):
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            body = decode_body(get_input_stream(environ), encoding, self.max_decoded_bytes)
+        except LookupError:
+            return self._error(415, f"Unsupported Content-Encoding '{encoding}'", environ, start_response)
+        except DecompressionLimitExceeded as e:
+            return self._error(413, str(e), environ, start_response)
+        except Exception as e: # zlib.error, zstandard.ZstdError, truncated bodies
+            return self._error(400, f"Malformed {encoding} body: {e}", environ, start_response)
+
+        environ['wsgi.input'] = io.BytesIO(body)
+        environ['CONTENT_LENGTH'] = str(len(body))
+        environ['ems.request_encoding'] = encoding
+        del environ['HTTP_CONTENT_ENCODING']
+        return self.wsgi_app(environ, start_response)
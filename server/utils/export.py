@@ -0,0 +1,72 @@
+# /root/EMS/server/utils/export.py
+import csv
+import datetime
+import io
+import json
+import zlib
+
+from bson import ObjectId
+
+# Columns of the activity export, in order. Also used as the Mongo projection so only these fields leave the server.
+ACTIVITY_EXPORT_FIELDS = [
+    "employee_id", "timestamp", "start_time", "end_time", "duration_seconds",
+    "window_title", "process_name", "is_active", "log_type",
+]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _export_value(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None: # pymongo returns naive UTC datetimes
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def csv_chunks(docs, fields, rows_per_chunk=500):
+    """Yields CSV text a few hundred rows at a time; memory stays constant whatever the row count."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    rows = 0
+    for doc in docs:
+        writer.writerow(["" if doc.get(f) is None else _export_value(doc.get(f)) for f in fields])
+        rows += 1
+        if rows % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(docs, fields, rows_per_chunk=500):
+    """Yields newline-delimited JSON, one object per document."""
+    lines = []
+    for doc in docs:
+        lines.append(json.dumps({f: _export_value(doc.get(f)) for f in fields}, ensure_ascii=False))
+        if len(lines) >= rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def encode_chunks(chunks, gzip_level=None):
+    """UTF-8 encodes text chunks, optionally gzip-compressing them as a single streamed member."""
+    if gzip_level is None:
+        for chunk in chunks:
+            if chunk:
+                yield chunk.encode('utf-8')
+        return
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31) # wbits=31 writes a gzip header/trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,75 @@
+# /root/EMS/server/utils/helpers.py
+import base64
+import datetime
+import json
+
+from bson import ObjectId
+
+from utils.cache import LRUCacheBackend
+
+# Keyset pagination over (timestamp, _id), newest first.
+# Cursors are opaque URL-safe tokens holding the boundary document's sort key, so every page is
+# an index range scan on (employee_id, timestamp, _id) instead of a skip over all earlier pages.
+KEYSET_SORT = [("timestamp", -1), ("_id", -1)]
+
+_count_cache = LRUCacheBackend(max_entries=512)
+
+
+def encode_cursor(doc):
+    payload = json.dumps({"t": doc["timestamp"].isoformat(), "i": str(doc["_id"])}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Returns (timestamp, ObjectId). Raises ValueError for tampered or malformed tokens."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.datetime.fromisoformat(payload["t"]), ObjectId(payload["i"])
+    except Exception as e:
+        raise ValueError(f"Invalid page cursor: {e}")
+
+
+def keyset_page(collection, filter_criteria, per_page, after=None, before=None, projection=None):
+    """
+    Fetches one page sorted newest first.
+      after  - cursor of the last row on the current page; returns the next (older) page
+      before - cursor of the first row on the current page; returns the previous (newer) page
+    Returns (items, older_cursor, newer_cursor); a cursor is None when there is no page in that direction.
+    """
+    if before:
+        timestamp, obj_id = decode_cursor(before)
+        boundary = {"$or": [{"timestamp": {"$gt": timestamp}}, {"timestamp": timestamp, "_id": {"$gt": obj_id}}]}
+        sort = [(field, -direction) for field, direction in KEYSET_SORT]
+    elif after:
+        timestamp, obj_id = decode_cursor(after)
+        boundary = {"$or": [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": obj_id}}]}
+        sort = KEYSET_SORT
+    else:
+        boundary = None
+        sort = KEYSET_SORT
+
+    query = {"$and": [filter_criteria, boundary]} if boundary else filter_criteria
+    # One extra row tells us whether another page exists in the direction we're moving
+    items = list(collection.find(query, projection).sort(sort).limit(per_page + 1))
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if before:
+        items.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = bool(after), has_more
+
+    older_cursor = encode_cursor(items[-1]) if items and has_older else None
+    newer_cursor = encode_cursor(items[0]) if items and has_newer else None
+    return items, older_cursor, newer_cursor
+
+
+def cached_count(collection, filter_criteria, cache_key, ttl=300):
+    """Exact count_documents, cached per cache_key for ttl seconds. Only call it when the total is asked for."""
+    count = _count_cache.get(cache_key)
+    if count is None:
+        count = collection.count_documents(filter_criteria)
+        _count_cache.set(cache_key, count, ttl=ttl)
+    return count
@@ -0,0 +1,389 @@
+# /root/EMS/server/utils/ingest.py
+import atexit
+import datetime
+import itertools
+import os
+import queue
+import threading
+import time
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+
+from utils.cache import dashboard_cache
+
+# Durability levels for /api/log/activity:
+#   'sync'    - insert inside the request (original behaviour, no queue)
+#   'flushed' - queue the batch and wait until a flusher has written it
+#   'queued'  - return as soon as the batch is in the in-process queue
+# A batch the agent was already told about ('queued', or 'flushed' after the wait timed out) has left the
+# agent's outbox, so if its flush gives up the documents are spilled to INGEST_SPILL_FOLDER and replayed
+# once writes succeed again.
+DURABILITY_LEVELS = ('sync', 'flushed', 'queued')
+
+_SPILL_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.CANONICAL, tz_aware=True, tzinfo=datetime.timezone.utc)
+
+
+class IngestQueueFull(Exception):
+    """Raised when the write-behind queue has no room for another batch."""
+
+
+class IngestBatch:
+    """One agent request worth of validated activity documents."""
+    __slots__ = ('employee_id', 'docs', 'done', 'error', 'acknowledged', '_lock')
+
+    def __init__(self, employee_id, docs, wait=False):
+        self.employee_id = employee_id
+        self.docs = docs
+        self.done = threading.Event() if wait else None
+        self.error = None
+        self.acknowledged = not wait # True once the agent was answered before the write finished
+        self._lock = threading.Lock()
+
+    def wait(self, timeout):
+        """Blocks until the batch was flushed. Returns False on timeout (the batch then counts as acknowledged)."""
+        if self.done is None:
+            return True
+        if self.done.wait(timeout):
+            return True
+        with self._lock:
+            if self.done.is_set():
+                return True
+            self.acknowledged = True
+            return False
+
+    def finish(self, error):
+        """Records the flush outcome. Returns True if the agent was already acknowledged."""
+        with self._lock:
+            self.error = error
+            if self.done is not None:
+                self.done.set()
+            return self.acknowledged
+
+
+class ActivityIngestQueue:
+    """
+    Bounded in-process write-behind queue for activity documents.
+    Background flushers merge batches from many agents into a single unordered insert_many,
+    flushing when INGEST_FLUSH_MAX_DOCS documents are pending or INGEST_FLUSH_INTERVAL_SECONDS elapsed.
+    employees.last_seen is handled by models.presence, not here.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stopping = False
+        self._stats = {
+            "batches_enqueued": 0, "docs_enqueued": 0,
+            "batches_flushed": 0, "docs_flushed": 0,
+            "flushes": 0, "flush_errors": 0, "docs_failed": 0,
+            "docs_spilled": 0, "docs_replayed": 0,
+            "queue_full": 0, "last_flush_docs": 0, "last_flush_ms": 0.0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.durability = app.config.get('INGEST_DURABILITY', 'queued')
+        if self.durability not in DURABILITY_LEVELS:
+            app.logger.warning(f"Unknown INGEST_DURABILITY '{self.durability}', falling back to 'sync'.")
+            self.durability = 'sync'
+        self.max_batches = app.config.get('INGEST_QUEUE_MAX_BATCHES', 10000)
+        self.flush_max_docs = app.config.get('INGEST_FLUSH_MAX_DOCS', 5000)
+        self.flush_interval = app.config.get('INGEST_FLUSH_INTERVAL_SECONDS', 1.0)
+        self.flusher_threads = max(1, app.config.get('INGEST_FLUSHER_THREADS', 2))
+        self.flush_retries = app.config.get('INGEST_FLUSH_RETRIES', 3)
+        self.wait_timeout = app.config.get('INGEST_FLUSH_WAIT_TIMEOUT_SECONDS', 10)
+        self.spill_folder = app.config.get('INGEST_SPILL_FOLDER')
+        self.spill_retry_interval = app.config.get('INGEST_SPILL_RETRY_SECONDS', 60)
+        self._spill_seq = itertools.count()
+        self._replay_lock = threading.Lock()
+        self._next_replay_at = 0.0
+        self._queue = queue.Queue(maxsize=self.max_batches)
+        app.extensions['activity_ingest'] = self
+        atexit.register(self.shutdown)
+        app.logger.info(f"Activity ingest configured: durability='{self.durability}', "
+                        f"queue={self.max_batches} batches, flush at {self.flush_max_docs} docs / {self.flush_interval}s, "
+                        f"{self.flusher_threads} flusher thread(s).")
+
+    @property
+    def enabled(self):
+        return self.durability != 'sync'
+
+    def _ensure_started(self):
+        # Threads are started lazily so that forking servers (gunicorn --preload) get their own flushers.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for i in range(self.flusher_threads):
+                t = threading.Thread(target=self._run, name=f"IngestFlusher-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+
+    def submit(self, employee_id, docs):
+        """Queues a batch of activity docs. Raises IngestQueueFull if the queue is at capacity."""
+        self._ensure_started()
+        batch = IngestBatch(employee_id, docs, wait=(self.durability == 'flushed'))
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            self._bump("queue_full")
+            raise IngestQueueFull(f"Ingest queue is full ({self.max_batches} batches pending)")
+        self._bump("batches_enqueued")
+        self._bump("docs_enqueued", len(docs))
+        return batch
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot.update({
+            "durability": self.durability,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.max_batches if self._queue is not None else 0,
+            "flusher_threads_alive": sum(1 for t in self._threads if t.is_alive()) if self._pid == os.getpid() else 0,
+        })
+        return snapshot
+
+    def _collect(self):
+        """Waits for the first batch, then keeps draining until the size or time limit is hit."""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        if first is None: # Shutdown sentinel
+            return None
+        batches = [first]
+        pending_docs = len(first.docs)
+        deadline = time.monotonic() + self.flush_interval
+        while pending_docs < self.flush_max_docs:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None) # Let the outer loop see the sentinel after this flush
+                break
+            batches.append(item)
+            pending_docs += len(item.docs)
+        return batches
+
+    def _run(self):
+        from models.db import get_db # Imported here to avoid a circular import at module load
+        with self.app.app_context():
+            db = get_db()
+            while True:
+                batches = self._collect()
+                if batches is None:
+                    break
+                if batches:
+                    self._flush(db, batches)
+                self._replay_spilled(db)
+
+    def _flush(self, db, batches):
+        docs = [doc for b in batches for doc in b.docs]
+        employee_count = len({b.employee_id for b in batches})
+
+        started = time.perf_counter()
+        error = None
+        for attempt in range(self.flush_retries + 1):
+            try:
+                self._write(db, docs)
+                error = None
+                break
+            except Exception as e:
+                error = e
+                self.app.logger.warning(f"Ingest flush attempt {attempt + 1}/{self.flush_retries + 1} failed for {len(docs)} docs: {e}")
+                if attempt < self.flush_retries:
+                    time.sleep(min(2 ** attempt, 10))
+        if error is None:
+            self._update_rollups(db, docs)
+            dashboard_cache.invalidate_written(docs)
+            unwritten = set()
+        else:
+            # Documents the failed write did store still get their rollups here, and are left out of the spill
+            unwritten = {id(doc) for doc in self._unwritten(docs, error)}
+            written = [doc for doc in docs if id(doc) not in unwritten]
+            if written:
+                self._update_rollups(db, written)
+                dashboard_cache.invalidate_written(written)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["last_flush_docs"] = len(docs)
+            self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+            if error is None:
+                self._stats["batches_flushed"] += len(batches)
+                self._stats["docs_flushed"] += len(docs)
+            else:
+                self._stats["flush_errors"] += 1
+                self._stats["docs_failed"] += len(unwritten)
+
+        if error is None:
+            self.app.logger.info(f"Ingest flush: {len(docs)} activities from {len(batches)} request(s) / {employee_count} employee(s) in {elapsed_ms:.1f}ms.")
+        else:
+            self.app.logger.error(f"Ingest flush gave up on {len(docs)} activities from {len(batches)} request(s): {error}", exc_info=error)
+
+        # Agents still waiting get the error (and keep the batch in their outbox); acknowledged batches are spilled
+        acknowledged = [b for b in batches if b.finish(error)]
+        if error is not None and acknowledged:
+            spill = [doc for b in acknowledged for doc in b.docs if id(doc) in unwritten]
+            if spill:
+                self._spill(spill)
+
+    def _spill(self, docs):
+        """Writes documents whose flush gave up to the spill folder for _replay_spilled."""
+        if not self.spill_folder:
+            self.app.logger.critical(f"INGEST_SPILL_FOLDER is not set; {len(docs)} acknowledged activities are lost.")
+            return
+        for doc in docs:
+            doc.setdefault("_id", ObjectId()) # A fixed _id makes a repeated replay of the file hit duplicate keys
+        path = os.path.join(self.spill_folder, f"spill-{time.time_ns()}-{os.getpid()}-{next(self._spill_seq)}.json")
+        try:
+            os.makedirs(self.spill_folder, exist_ok=True)
+            _write_spill_file(path, docs)
+        except OSError as e:
+            self.app.logger.critical(f"Could not spill {len(docs)} acknowledged activities to {path}: {e}")
+            return
+        self._bump("docs_spilled", len(docs))
+        self.app.logger.warning(f"Spilled {len(docs)} activities to {path}; they are replayed once writes succeed.")
+
+    def _replay_spilled(self, db):
+        """Re-inserts spilled documents, at most every INGEST_SPILL_RETRY_SECONDS and by one flusher at a time."""
+        if not self.spill_folder or time.monotonic() < self._next_replay_at or not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_replay_at = time.monotonic() + self.spill_retry_interval
+            try:
+                names = os.listdir(self.spill_folder)
+            except FileNotFoundError:
+                return
+            for name in names:
+                # Files claimed by a worker that died mid-replay go back into the pool
+                if name.endswith('.replaying'):
+                    original, pid = name[:-len('.replaying')].rsplit('.', 1)
+                    if not _process_alive(int(pid)):
+                        try:
+                            os.rename(os.path.join(self.spill_folder, name), os.path.join(self.spill_folder, original))
+                        except OSError:
+                            pass
+            names = sorted(n for n in os.listdir(self.spill_folder) if n.startswith('spill-') and n.endswith('.json'))
+            for name in names:
+                path = os.path.join(self.spill_folder, name)
+                claimed = f"{path}.{os.getpid()}.replaying"
+                try:
+                    os.rename(path, claimed) # Claims the file against other worker processes
+                except FileNotFoundError:
+                    continue
+                docs = None
+                try:
+                    with open(claimed, encoding='utf-8') as f:
+                        docs = json_util.loads(f.read(), json_options=_SPILL_JSON_OPTIONS)
+                    inserted = self._write(db, docs)
+                except Exception as e:
+                    self._requeue_spilled(db, claimed, path, docs, e)
+                    self.app.logger.warning(f"Replaying spilled activities from {name} failed, will retry: {e}")
+                    return
+                # Rollups only for the documents this replay stored: duplicates were stored (and rolled up)
+                # by an earlier replay of the same file that died before removing it.
+                self._update_rollups(db, inserted)
+                dashboard_cache.invalidate_written(inserted)
+                os.remove(claimed)
+                self._bump("docs_replayed", len(inserted))
+                if len(inserted) < len(docs):
+                    self.app.logger.warning(f"Replay of {name} skipped {len(docs) - len(inserted)} activities already stored by an earlier replay.")
+                self.app.logger.info(f"Replayed {len(inserted)} spilled activities from {name}.")
+        finally:
+            self._replay_lock.release()
+
+    def _requeue_spilled(self, db, claimed, path, docs, error):
+        """Puts a spill file whose replay failed back in the pool, minus (and with rollups for) what the failed write stored."""
+        unwritten = self._unwritten(docs, error) if docs is not None else None
+        if unwritten is not None and len(unwritten) < len(docs):
+            remaining = {id(doc) for doc in unwritten}
+            written = [doc for doc in docs if id(doc) not in remaining]
+            self._update_rollups(db, written)
+            dashboard_cache.invalidate_written(written)
+            self._bump("docs_replayed", len(written))
+            _write_spill_file(claimed, unwritten)
+        os.rename(claimed, path)
+
+    @staticmethod
+    def _write(db, docs):
+        """Inserts docs and returns the ones this call stored; documents whose _id is already stored are skipped."""
+        try:
+            db.activity_logs.insert_many(docs, ordered=False)
+        except BulkWriteError as bwe:
+            # insert_many assigns _id in place, so a retry after a partial write only hits duplicate keys.
+            errors = bwe.details.get('writeErrors', [])
+            if any(e.get('code') != 11000 for e in errors):
+                raise
+            duplicates = {e['index'] for e in errors}
+            return [doc for i, doc in enumerate(docs) if i not in duplicates]
+        return docs
+
+    @staticmethod
+    def _unwritten(docs, error):
+        """The docs a failed _write did not store: all of them unless the error names the failed documents."""
+        if not isinstance(error, BulkWriteError):
+            return docs
+        failed = {e['index'] for e in error.details.get('writeErrors', []) if e.get('code') != 11000}
+        return [doc for i, doc in enumerate(docs) if i in failed]
+
+    def _update_rollups(self, db, docs):
+        # Kept out of the retried write: re-applying $inc after a partial failure would double count.
+        from models.rollups import apply_rollups
+        try:
+            apply_rollups(db, docs)
+        except Exception as e:
+            self.app.logger.error(f"Hourly rollup update failed for {len(docs)} activities (re-run 'flask backfill-rollups' for the affected hours): {e}")
+
+    def shutdown(self, timeout=5.0):
+        """Drains the queue on interpreter exit."""
+        if self._stopping or self._pid != os.getpid():
+            return
+        self._stopping = True
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        for t in self._threads:
+            t.join(timeout)
+
+
+def _write_spill_file(path, docs):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(json_util.dumps(docs, json_options=_SPILL_JSON_OPTIONS))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path) # Never replay a half-written file
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+activity_ingest = ActivityIngestQueue()
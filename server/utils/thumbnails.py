@@ -0,0 +1,139 @@
+# /root/EMS/server/utils/thumbnails.py
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image # Optional: without Pillow the report grid falls back to full-size images
+except ImportError:
+    Image = None
+
+THUMBNAIL_FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+
+
+def thumbnail_relpath(screenshot_path, fmt):
+    """Thumbnails mirror the screenshot's relative path (sharded or legacy flat) with the thumbnail extension."""
+    return f"{os.path.splitext(screenshot_path)[0]}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def render_thumbnail(source_path, dest_path, max_size, fmt, quality):
+    """
+    Runs in a pool process: decodes the screenshot, downsizes it and writes the preview atomically.
+    Returns dest_path, or None if the source is gone.
+    """
+    if not os.path.isfile(source_path):
+        return None
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    temp_path = f"{dest_path}.{os.getpid()}.tmp"
+    with Image.open(source_path) as img:
+        img.draft('RGB', (max_size, max_size)) # Lets JPEG sources decode at reduced size
+        img = img.convert('RGB')
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS)
+        if fmt == 'webp':
+            img.save(temp_path, 'WEBP', quality=quality, method=4)
+        else:
+            img.save(temp_path, 'JPEG', quality=quality, optimize=True)
+    os.replace(temp_path, dest_path)
+    return dest_path
+
+
+class ThumbnailService:
+    """
+    Generates report thumbnails on a process pool (image decoding is CPU-bound and would hold the GIL).
+    Uploads enqueue work fire-and-forget; the thumbnail route waits briefly for a missing one.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._pending = {} # relpath -> Future, so the same thumbnail isn't rendered twice at once
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.folder = app.config['THUMBNAIL_FOLDER']
+        self.source_folder = app.config['UPLOAD_FOLDER']
+        self.max_size = app.config.get('THUMBNAIL_MAX_SIZE', 320)
+        self.fmt = app.config.get('THUMBNAIL_FORMAT', 'webp')
+        self.quality = app.config.get('THUMBNAIL_QUALITY', 70)
+        self.workers = app.config.get('THUMBNAIL_WORKERS', 2)
+        if self.fmt not in THUMBNAIL_FORMATS:
+            app.logger.warning(f"Unknown THUMBNAIL_FORMAT '{self.fmt}', using webp.")
+            self.fmt = 'webp'
+        if Image is None:
+            app.logger.warning("Pillow is not installed; screenshot thumbnails are disabled.")
+        app.extensions['thumbnails'] = self
+
+    @property
+    def enabled(self):
+        return Image is not None and self.app is not None
+
+    @property
+    def mimetype(self):
+        return THUMBNAIL_FORMATS[self.fmt][1]
+
+    def _get_executor(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                # 'spawn' keeps pool processes independent of the web worker's threads and Mongo sockets
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._executor_pid = os.getpid()
+                self._pending = {}
+        return self._executor
+
+    def path_for(self, screenshot_path):
+        return os.path.join(self.folder, *thumbnail_relpath(screenshot_path, self.fmt).split('/'))
+
+    def exists(self, screenshot_path):
+        return os.path.isfile(self.path_for(screenshot_path))
+
+    def enqueue(self, screenshot_path):
+        """Schedules a thumbnail unless it exists or is already being rendered. Returns the Future or None."""
+        if not self.enabled or self.exists(screenshot_path):
+            return None
+        executor = self._get_executor()
+        with self._lock:
+            future = self._pending.get(screenshot_path)
+            if future is not None:
+                return future
+            source = os.path.join(self.source_folder, *screenshot_path.split('/'))
+            future = executor.submit(render_thumbnail, source, self.path_for(screenshot_path),
+                                     self.max_size, self.fmt, self.quality)
+            self._pending[screenshot_path] = future
+        # Outside the lock: the callback runs inline if the future has already finished
+        future.add_done_callback(lambda f, key=screenshot_path: self._done(key, f))
+        return future
+
+    def _done(self, screenshot_path, future):
+        with self._lock:
+            self._pending.pop(screenshot_path, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None and self.app is not None:
+            self.app.logger.error(f"Thumbnail generation failed for {screenshot_path}: {error}")
+
+    def ensure(self, screenshot_path, timeout=5):
+        """Returns the thumbnail's absolute path, rendering it first if needed; None if unavailable."""
+        if self.exists(screenshot_path):
+            return self.path_for(screenshot_path)
+        future = self.enqueue(screenshot_path)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            return None
+
+    def shutdown(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+thumbnails = ThumbnailService()
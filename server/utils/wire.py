@@ -0,0 +1,125 @@
+# /root/EMS/server/utils/wire.py
+import datetime
+
+try:
+    import msgpack # Optional: binary activity batches from newer agents
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+# Compact keys used by the msgpack format (agent/agent.py encode_activity_batch)
+#   batch:    e = employee_id, a = activities
+#   activity: w = window_title, p = process_name, s = start (epoch ms), n = end (epoch ms),
+#             d = duration_seconds, i = is_active
+BATCH_KEYS = {"e": "employee_id", "a": "activities"}
+
+# Dictionary-encoded batches (agent/agent.py encode_dictionary_batch), in either body format:
+#   {e: employee_id, t: [string table], b: first start (epoch ms),
+#    r: [[title index, process index, start - previous end (ms), duration (ms), is_active 0/1], ...]}
+# expand_dictionary_batch rebuilds the compact activity entries above, so they parse like msgpack ones.
+COMPACT_FORMATS = ('msgpack', 'dict')
+
+_UTC = datetime.timezone.utc
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=_UTC)
+_from_timestamp = datetime.datetime.fromtimestamp
+
+
+def accepted_activity_formats():
+    """
+    Activity body formats this server decodes, in the agent's naming (agent/agent.py encode_body).
+    Advertised on heartbeat and 415 answers; agents send '+dict' batches only to a server that lists them.
+    """
+    formats = ['json', 'json+dict']
+    if msgpack is not None:
+        formats += ['msgpack', 'msgpack+dict']
+    return formats
+
+
+class UnsupportedWireFormat(Exception):
+    """The request body uses a format this server cannot decode."""
+
+
+def read_activity_payload(request):
+    """
+    Decodes an /api/log/activity body. Returns (data, wire_format) where data always
+    uses the long top-level keys ('employee_id', 'activities').
+    JSON stays the default so older agents keep working.
+    """
+    if request.mimetype in MSGPACK_MIMETYPES:
+        if msgpack is None:
+            raise UnsupportedWireFormat("msgpack is not installed on the server")
+        data = msgpack.unpackb(request.get_data(cache=False), raw=False, strict_map_key=False)
+        if not isinstance(data, dict):
+            raise ValueError("msgpack payload is not a map")
+        wire_format = 'msgpack'
+    else:
+        data, wire_format = request.get_json(), 'json'
+    if isinstance(data, dict) and "t" in data and "r" in data:
+        return expand_dictionary_batch(data), 'dict'
+    if wire_format == 'msgpack':
+        return {BATCH_KEYS.get(k, k): v for k, v in data.items()}, 'msgpack'
+    return data, 'json'
+
+
+def expand_dictionary_batch(data):
+    """Expands a dictionary-encoded batch. Raises ValueError if any row is malformed (later rows depend on it)."""
+    strings, rows, cursor = data.get("t"), data.get("r"), data.get("b")
+    if not isinstance(strings, list) or not isinstance(rows, list) or type(cursor) is not int:
+        raise ValueError("Dictionary batch needs a string table, rows and an integer base time")
+    string_count = len(strings)
+    activities = []
+    for row in rows:
+        try:
+            title_index, process_index, gap_ms, duration_ms, is_active = row
+        except (TypeError, ValueError):
+            raise ValueError(f"Malformed dictionary batch row: {row!r}")
+        # type() rather than isinstance() also rejects bools; this loop runs once per activity
+        if (type(title_index) is not int or type(process_index) is not int or type(gap_ms) is not int
+                or type(duration_ms) is not int or not 0 <= title_index < string_count
+                or not 0 <= process_index < string_count or duration_ms < 0):
+            raise ValueError(f"Malformed dictionary batch row: {row!r}")
+        start = cursor + gap_ms
+        cursor = start + duration_ms
+        activities.append({"w": strings[title_index], "p": strings[process_index], "s": start, "n": cursor,
+                           "d": (duration_ms + 500) // 1000, "i": bool(is_active)})
+    return {"employee_id": data.get("e", data.get("employee_id")), "activities": activities}
+
+
+def epoch_ms_to_datetime(value):
+    # Runs twice per compact activity: type() rather than isinstance() also rejects bools in one check
+    if type(value) is not int:
+        raise ValueError(f"Invalid epoch timestamp: {value!r}")
+    if value >= 0:
+        # About twice as fast as adding a timedelta; rounding to the microsecond keeps millisecond values exact
+        return _from_timestamp(value / 1000, _UTC)
+    return _EPOCH + datetime.timedelta(milliseconds=value)
+
+
+def parse_activity_item(act_data, wire_format):
+    """
+    Validates one activity entry and returns (window_title, process_name, start_time, end_time,
+    duration_seconds, is_active). Raises ValueError for malformed entries.
+    """
+    if wire_format in COMPACT_FORMATS:
+        start_raw, end_raw, duration_s = act_data.get("s"), act_data.get("n"), act_data.get("d")
+        window_title, process_name, is_active = act_data.get("w", "N/A"), act_data.get("p", "N/A"), act_data.get("i", True)
+        if start_raw is None or end_raw is None or duration_s is None:
+            raise ValueError("Missing time/duration fields")
+        start_time = epoch_ms_to_datetime(start_raw)
+        end_time = epoch_ms_to_datetime(end_raw)
+    else:
+        start_raw, end_raw, duration_s = act_data.get("start_time"), act_data.get("end_time"), act_data.get("duration_seconds")
+        window_title, process_name, is_active = act_data.get("window_title", "N/A"), act_data.get("process_name", "N/A"), act_data.get("is_active", True)
+        if start_raw is None or end_raw is None or duration_s is None or start_raw == "" or end_raw == "":
+            raise ValueError("Missing time/duration fields")
+        start_time = datetime.datetime.fromisoformat(start_raw)
+        end_time = datetime.datetime.fromisoformat(end_raw)
+
+    if not isinstance(duration_s, (int, float)) or duration_s < 0:
+        calculated_duration = (end_time - start_time).total_seconds()
+        if calculated_duration < 0:
+            raise ValueError(f"Negative calculated duration. Start: {start_time}, End: {end_time}")
+        duration_s = int(calculated_duration)
+
+    return window_title, process_name, start_time, end_time, int(duration_s), is_active